@@ -14,6 +14,7 @@ import itertools
 import pickle
 import json
 from glob import glob
+from functools import partial
 
 import numpy as np
 import mdtraj as md
@@ -50,6 +51,7 @@ from enspara.apps.util import readable_dir
 
 from enspara import mpi
 from enspara.cluster import KHybrid, KCenters, KMedoids
+from enspara.cluster.kmedoids import ctr_ids_mpi
 from enspara import ra
 from enspara.util import load_as_concatenated
 from enspara.util.log import timed
@@ -92,6 +94,29 @@ def process_command_line(argv):
         '--trajectories', nargs="+", action='append',
         help="List of paths to aligned trajectory files to cluster. "
              "All file types that MDTraj supports are supported here.")
+    input_args.add_argument(
+        "--features-memmap-dir", default=None,
+        help="Memory map .npy --features read-only rather than loading "
+             "them into memory, so that feature sets larger than RAM can "
+             "be clustered. If a node has several feature files (or "
+             "--subsample is used), they are first joined into a single, "
+             "uniquely named file in this directory, which is removed "
+             "once it is mapped.")
+    input_args.add_argument(
+        "--coordinate-cache-dir", default=None,
+        help="Directory of stores of atom-sliced, centered coordinates "
+             "for --trajectories. A run with the same trajectories, "
+             "topologies, --atoms and --subsample as an earlier one "
+             "memory-maps its store rather than re-parsing trajectories. "
+             "Useful when clustering the same trajectories several times.")
+    input_args.add_argument(
+        "--balance-stripes", default=False, action='store_true',
+        help="In MPI mode, divide trajectories (or feature files) between "
+             "nodes so that each holds about the same number of frames, "
+             "rather than the same number of trajectories. Helps when "
+             "trajectory lengths vary widely. Trajectory lengths must "
+             "then be read before loading. Restart files (e.g. "
+             "--init-assignments) must be given the same flag.")
     input_args.add_argument(
         '--topology', action='append', dest='topologies',
         help="The topology file for the trajectories. This flag must be"
@@ -145,6 +170,32 @@ def process_command_line(argv):
         "--init-distances", default=None, type=str,
         help="Path to an .h5 file that indicates how far each data point is"
              "to its cluster center. Useful for restarting clustering")
+    cluster_args.add_argument(
+        "--checkpoint-interval", default=None, type=int,
+        help="Every this many new k-centers centers, write center "
+             "indices, assignments and distances to an "
+             "'intermediate-kcenters-checkpoint' directory beside each "
+             "output. These can be given to --init-center-inds, "
+             "--init-assignments and --init-distances to restart an "
+             "interrupted kcenters or khybrid run.")
+    cluster_args.add_argument(
+        "--kcenters-batch-size", default=None, type=int,
+        help="Find up to this many new k-centers centers per pass over "
+             "the data (kcenters and khybrid only). Gives the same "
+             "clustering as the default of one center per pass, but "
+             "reads the data fewer times.")
+    cluster_args.add_argument(
+        "--batch-kmedoids-updates", default=False, action='store_true',
+        help="Evaluate a new medoid proposal for every cluster in a "
+             "single pass over the data, accepting all improving swaps "
+             "that don't interact (kmedoids and khybrid only).")
+    cluster_args.add_argument(
+        "--distance-dtype", default='float64',
+        choices=['float64', 'float32'],
+        help="Precision at which to store (and write) distances. float32 "
+             "halves the memory needed for distances. Distances are "
+             "always computed at double precision, but in float32 mode "
+             "ties are broken at single precision.")
     cluster_args.add_argument(
         '--subsample', default=1, type=int,
         help="Take only every nth frame when loading trajectories. "
@@ -186,6 +237,18 @@ def process_command_line(argv):
                 raise exception.ImproperlyConfigured(
                     "Subsampling is not supported for h5 inputs.")
 
+        if args.coordinate_cache_dir:
+            raise exception.ImproperlyConfigured(
+                "Option --coordinate-cache-dir is only meaningful when "
+                "clustering trajectories.")
+
+        if args.features_memmap_dir and len(args.features) == 1:
+            raise exception.ImproperlyConfigured(
+                "Option --features-memmap-dir requires .npy feature files, "
+                "one per trajectory. A single --features file (%s) is read "
+                "as an h5 RaggedArray, which can't be memory-mapped." %
+                args.features[0])
+
         # TODO: not necessary if mutually exclusvie above works
         if args.trajectories:
             raise exception.ImproperlyConfigured(
@@ -206,8 +269,13 @@ def process_command_line(argv):
     elif args.trajectories and args.topologies:
         args.trajectories = util.expand_files(args.trajectories)
 
+        if args.features_memmap_dir:
+            raise exception.ImproperlyConfigured(
+                "Option --features-memmap-dir is only meaningful when "
+                "clustering features.")
+
         if not args.cluster_distance or args.cluster_distance == 'rmsd':
-            args.cluster_distance = md.rmsd
+            args.cluster_distance = util.rmsd
         else:
             raise exception.ImproperlyConfigured(
                 "Option --cluster-distance must be rmsd when clustering "
@@ -245,19 +313,40 @@ def process_command_line(argv):
             raise exception.ImproperlyConfigured(
                 "--cluster-iterations only has an effect when using an "
                 "interative clustering scheme (e.g. khybrid).")
+        if args.batch_kmedoids_updates:
+            raise exception.ImproperlyConfigured(
+                "--batch-kmedoids-updates only has an effect when using "
+                "kmedoids or khybrid.")
     if args.Clusterer is KMedoids:
         if args.cluster_radius is not None:
             raise exception.ImproperlyConfigured(
                 "--cluster-radius only has an effect when using kcenters"
                 " or khybrid.")
+        if args.checkpoint_interval is not None:
+            raise exception.ImproperlyConfigured(
+                "--checkpoint-interval only has an effect when using "
+                "kcenters or khybrid.")
+        if args.kcenters_batch_size is not None:
+            raise exception.ImproperlyConfigured(
+                "--kcenters-batch-size only has an effect when using "
+                "kcenters or khybrid.")
     else:
-        restart_arg_names = [args.init_center_inds, args.init_distances,
-            args.init_assignments]
-        for name in restart_arg_names:
-            if name:
-                raise exception.ImproperlyConfigured(
-                    "--init-center-inds, --init-distances, and"
-                    "--init-assignments are only implemented for kmedoids")
+        restart_args = [args.init_center_inds, args.init_distances,
+                        args.init_assignments]
+        if any(restart_args) and not all(restart_args):
+            raise exception.ImproperlyConfigured(
+                "Restarting kcenters or khybrid requires all of "
+                "--init-center-inds, --init-distances, and "
+                "--init-assignments.")
+
+    if args.checkpoint_interval is not None:
+        if args.checkpoint_interval < 1:
+            raise exception.ImproperlyConfigured(
+                "--checkpoint-interval must be a positive integer.")
+        if not args.center_indices:
+            raise exception.ImproperlyConfigured(
+                "--checkpoint-interval requires --center-indices, since "
+                "center indices are needed to restart clustering.")
 
 
     if args.no_reassign and args.subsample == 1:
@@ -284,6 +373,35 @@ def process_command_line(argv):
     return args
 
 
+def load_kcenters_restart(args, lengths):
+    """Load the center indices, assignments and distances written by
+    a previous (e.g. checkpointed) kcenters run, in the form expected by
+    KCenters.fit and KHybrid.fit.
+    """
+
+    _, distances = mpi.io.load_h5_as_striped(
+        args.init_distances, balanced=args.balance_stripes)
+    _, assignments = mpi.io.load_h5_as_striped(
+        args.init_assignments, balanced=args.balance_stripes)
+
+    ctr_inds = np.load(args.init_center_inds)
+    if ctr_inds.ndim == 2:
+        # (trajectory, frame) pairs, as written by this app, count
+        # frames before subsampling.
+        ctr_inds = [(t, f // args.subsample) for t, f in ctr_inds]
+        if not mpi_mode:
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            ctr_inds = [offsets[t] + f for t, f in ctr_inds]
+
+    if mpi_mode:
+        ctr_inds = ctr_ids_mpi(
+            ctr_inds, lengths,
+            mpi.ops.stripe_owners(lengths, args.balance_stripes))
+
+    return {'assignments': assignments, 'distances': distances,
+            'cluster_center_inds': ctr_inds}
+
+
 def main(argv=None):
 
     args = process_command_line(argv)
@@ -302,25 +420,45 @@ def main(argv=None):
             kwargs['args']=args
             kwargs['lengths']=lengths
 
+    if args.batch_kmedoids_updates:
+        if args.Clusterer is KHybrid:
+            kwargs['batch_kmedoids_updates'] = True
+        elif args.Clusterer is KMedoids:
+            kwargs['batch_updates'] = True
+
     #kmedoids doesn't need a cluster radius, but kcenters does
     if args.cluster_radius is not None:
         kwargs['cluster_radius']=args.cluster_radius
         kwargs['mpi_mode']=mpi_mode
 
+    if args.checkpoint_interval is not None:
+        kwargs['checkpoint'] = partial(
+            util.write_kcenters_checkpoint, args=args, lengths=lengths,
+            mpi_mode=mpi_mode)
+        kwargs['checkpoint_interval'] = args.checkpoint_interval
+
+    if args.kcenters_batch_size is not None:
+        kwargs['batch_size'] = args.kcenters_batch_size
+
+    kwargs['distance_dtype'] = np.dtype(args.distance_dtype)
+
     clustering = args.Clusterer(
         metric=args.cluster_distance,
         n_clusters=args.cluster_number,
         **kwargs)
     
-    # Note to self: Need to implement restarts for KCenters as well
     kwargs_restart = {}
     if args.Clusterer is KMedoids:
         if args.init_distances:
             _, kwargs_restart['distances'] = \
-                 mpi.io.load_h5_as_striped(args.init_distances)
+                 mpi.io.load_h5_as_striped(
+                     args.init_distances, balanced=args.balance_stripes)
         if args.init_assignments:
             kwargs_restart['X_lengths'], kwargs_restart['assignments'] = \
-                mpi.io.load_h5_as_striped(args.init_assignments)
+                mpi.io.load_h5_as_striped(
+                    args.init_assignments, balanced=args.balance_stripes)
+            kwargs_restart['X_owners'] = mpi.ops.stripe_owners(
+                kwargs_restart['X_lengths'], args.balance_stripes)
         if args.save_intermediates:
             kwargs_restart['args']=args
         if args.init_center_inds:
@@ -328,7 +466,9 @@ def main(argv=None):
                 np.load(args.init_center_inds) 
         clustering.fit(data,**kwargs_restart)
     else:
-        clustering.fit(data)
+        if args.init_center_inds:
+            kwargs_restart = load_kcenters_restart(args, lengths)
+        clustering.fit(data, **kwargs_restart)
     # release the RAM held by the trajectories (we don't need it anymore)
     del data
 
@@ -343,11 +483,13 @@ def main(argv=None):
 
         with timed("Reassembled dist and assign arrays in %.2f sec",
                    logging.info):
+            owners = mpi.ops.stripe_owners(lengths, args.balance_stripes)
             all_dists = mpi.ops.assemble_striped_ragged_array(
-                local_dists, lengths)
+                local_dists, lengths, owners)
             all_assigs = mpi.ops.assemble_striped_ragged_array(
-                local_assigs, lengths)
-            ctr_inds = mpi.ops.convert_local_indices(local_ctr_inds, lengths)
+                local_assigs, lengths, owners)
+            ctr_inds = mpi.ops.convert_local_indices(
+                local_ctr_inds, lengths, owners)
 
         result = util.ClusterResult(
             center_indices=ctr_inds,
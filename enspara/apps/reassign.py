@@ -28,7 +28,9 @@ logging.basicConfig(
 
 import enspara
 
+from enspara import mpi
 from enspara.cluster.util import assign_to_nearest_center, partition_list
+from enspara.cluster.vptree import VPTree
 from enspara.util.load import (concatenate_trjs, sound_trajectory,
                                load_as_concatenated)
 
@@ -59,6 +61,12 @@ def process_command_line(argv):
         '--atoms', default="(name CA or name C or name N or name CB)",
         help="The atoms from the trajectories (using MDTraj atom-selection"
              "syntax) to cluster based upon.")
+    parser.add_argument(
+        '--center-index', default=None,
+        help="Path to a VP-tree index over the centers (an .npz file), "
+             "used to find nearest centers without comparing each frame "
+             "to every center. If the file doesn't exist, the index is "
+             "built and saved there.")
     parser.add_argument(
         '--output-path', default=None,
         help="Output path for results (distances, assignments). "
@@ -67,6 +75,18 @@ def process_command_line(argv):
         '-m', '--mem-fraction', default=0.5, type=float,
         help="The fraction of total RAM to use in deciding the batch size. "
              "Genrally, this number shouldn't be much higher than 0.5.")
+    parser.add_argument(
+        '--prefetch-batches', default=1, type=int,
+        help="The number of batches to load from disk while the current "
+             "batch is being assigned. The --mem-fraction budget is "
+             "split between these and the current batch.")
+    parser.add_argument(
+        '--coordinate-cache-dir', default=None,
+        help="Directory of stores of atom-sliced, centered coordinates "
+             "(as written by `enspara cluster --coordinate-cache-dir` "
+             "with --subsample 1). If the same trajectories were stored "
+             "with the same topologies and --atoms, they are memory-mapped "
+             "rather than re-parsed; otherwise, a store is created.")
 
     # OUTPUT ARGS
     parser.add_argument(
@@ -85,6 +105,11 @@ def process_command_line(argv):
             "Flag --mem-fraction must be in range (0, 1). Got %s"
             % args.mem_fraction)
 
+    if args.prefetch_batches < 0:
+        raise enspara.exception.ImproperlyConfigured(
+            "Flag --prefetch-batches must be non-negative. Got %s"
+            % args.prefetch_batches)
+
     if len(args.topologies) != len(args.trajectories):
         raise enspara.exception.ImproperlyConfigured(
             "The number of --topology and --trajectory flags must agree.")
@@ -115,9 +140,30 @@ def main(argv=None):
                 len(centers), centers.n_atoms, args.atoms,
                 time.perf_counter() - tick)
 
+    index = None
+    if args.center_index is not None:
+        # every rank must use the same tree, so a missing index is built
+        # (reproducibly) on rank 0 only, and the others load it from
+        # where it was saved.
+        exists = mpi.comm.bcast(
+            os.path.isfile(args.center_index) if mpi.rank() == 0 else None,
+            root=0)
+        if not exists:
+            if mpi.rank() == 0:
+                index = VPTree(centers, 'rmsd', random_state=0)
+                index.save(args.center_index)
+                logger.info('Saved center index at %s.', args.center_index)
+            mpi.comm.barrier()
+
+        if index is None:
+            index = VPTree.load(args.center_index, centers, 'rmsd')
+            logger.info('Loaded center index from %s.', args.center_index)
+
     assig, dist = reassign(
         args.topologies, args.trajectories, [args.atoms]*len(args.topologies),
-        centers=centers, frac_mem=args.mem_fraction)
+        centers=centers, frac_mem=args.mem_fraction,
+        prefetch=args.prefetch_batches, mpi_mode=mpi.size() > 1,
+        index=index, cache_dir=args.coordinate_cache_dir)
 
     mem_highwater = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     logger.info(
@@ -127,11 +173,14 @@ def main(argv=None):
         (mem_highwater / 1024**2),
         psutil.virtual_memory().total / 1024**3)
 
-    ra.save(args.distances, dist)
-    ra.save(args.assignments, assig)
+    if mpi.rank() == 0:
+        ra.save(args.distances, dist)
+        ra.save(args.assignments, assig)
+
+        logger.info("Wrote distances at %s.", args.distances)
+        logger.info("Wrote assignments at %s.", args.assignments)
 
-    logger.info("Wrote distances at %s.", args.distances)
-    logger.info("Wrote assignments at %s.", args.assignments)
+    mpi.comm.barrier()
 
     return 0
 
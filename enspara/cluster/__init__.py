@@ -4,7 +4,9 @@
 from . import hybrid
 from . import kcenters
 from . import kmedoids
+from . import sampled
 
 from .hybrid import KHybrid
 from .kcenters import KCenters
 from .kmedoids import KMedoids
+from .sampled import SampledKMedoids
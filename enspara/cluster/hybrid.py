@@ -53,6 +53,21 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         Use the MPI version of the algorithm. This assumes that each node
         in the MPI swarm owns its own data. If None, it is determined
         automatically.
+    checkpoint : callable, default=None
+        Called with the (local, in MPI mode) k-centers ClusterResult
+        every `checkpoint_interval` new centers during the k-centers
+        phase. See `kcenters.kcenters`.
+    checkpoint_interval : int, default=None
+        Number of new centers between calls to `checkpoint`.
+    batch_size : int, default=None
+        Find up to this many new centers per pass over the data in the
+        k-centers phase. See `kcenters.kcenters`.
+    batch_kmedoids_updates : bool, default=False
+        Evaluate a k-medoids proposal for every cluster in one pass over
+        the data. See `kmedoids.kmedoids`.
+    distance_dtype : np.dtype, default=np.float64
+        Precision at which to store distances (np.float64 or
+        np.float32) in both phases. See `kcenters.kcenters`.
 
     References
     ----------
@@ -63,7 +78,9 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 
     def __init__(self, metric, n_clusters=None, cluster_radius=None,
                  kmedoids_updates=5, random_first_center=False,
-                 random_state=None, mpi_mode=None, args=None, lengths=None):
+                 random_state=None, mpi_mode=None, args=None, lengths=None,
+                 checkpoint=None, checkpoint_interval=None, batch_size=None,
+                 batch_kmedoids_updates=False, distance_dtype=np.float64):
 
         if n_clusters is None and cluster_radius is None:
             raise ImproperlyConfigured("Either n_clusters or cluster_radius "
@@ -79,16 +96,32 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         self.mpi_mode = mpi_mode if mpi_mode is not None else mpi.size() != 1
         self.args = args
         self.lengths = lengths
-
-    def fit(self, X, init_centers=None, args=None):
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.batch_size = batch_size
+        self.batch_kmedoids_updates = batch_kmedoids_updates
+        self.distance_dtype = distance_dtype
+
+    def fit(self, X, init_centers=None, args=None, assignments=None,
+            distances=None, cluster_center_inds=None):
         """Takes trajectories, X, and performs KHybrid clustering.
         Optionally continues clustering from an initial set of cluster
-        centers.
+        centers, or restarts the k-centers phase of a previous run from
+        its center indices, assignments and distances.
 
         Parameters
         ----------
         X : array-like, shape=(n_observations, n_features(, n_atoms))
             Data to cluster.
+        assignments : ndarray, shape=(X.shape[0],), default=None
+            Assignments of each frame in `X` from a previous k-centers
+            run.
+        distances : ndarray, shape=(X.shape[0],), default=None
+            Distances of each frame in `X` from a previous k-centers
+            run.
+        cluster_center_inds : list, [(rank, index), ...] or [index, ...]
+            Centers found by a previous k-centers run, in the order they
+            were found.
         """
 
         t0 = time.perf_counter()
@@ -102,7 +135,15 @@ class KHybrid(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             init_centers=init_centers,
             random_state=self.random_state,
             mpi_mode=self.mpi_mode, args=self.args,
-            lengths=self.lengths)
+            lengths=self.lengths,
+            assignments=assignments,
+            distances=distances,
+            cluster_center_inds=cluster_center_inds,
+            checkpoint=self.checkpoint,
+            checkpoint_interval=self.checkpoint_interval,
+            batch_size=self.batch_size,
+            batch_kmedoids_updates=self.batch_kmedoids_updates,
+            distance_dtype=self.distance_dtype)
 
         self.runtime_ = time.perf_counter() - t0
 
@@ -113,51 +154,49 @@ def hybrid(
         X, distance_method, n_iters=5, n_clusters=np.inf,
         dist_cutoff=0, random_first_center=False,
         init_centers=None, random_state=None, mpi_mode=False,
-        args=None, lengths=None):
+        args=None, lengths=None, assignments=None, distances=None,
+        cluster_center_inds=None, checkpoint=None, checkpoint_interval=None,
+        batch_size=None, batch_kmedoids_updates=False,
+        distance_dtype=np.float64):
 
     distance_method = util._get_distance_method(distance_method)
 
     result = kcenters.kcenters(
         X, distance_method, n_clusters=n_clusters, dist_cutoff=dist_cutoff,
         init_centers=init_centers, random_first_center=random_first_center,
-        mpi_mode=mpi_mode)
+        mpi_mode=mpi_mode, assignments=assignments, distances=distances,
+        cluster_center_inds=cluster_center_inds, checkpoint=checkpoint,
+        checkpoint_interval=checkpoint_interval, batch_size=batch_size,
+        distance_dtype=distance_dtype)
 
     cluster_center_inds, assignments, distances, centers = (
         result.center_indices, result.assignments, result.distances,
         result.centers)
 
+    writer = None
     if args != None and args.save_intermediates:
-
-        int_result = util.ClusterResult(
-            center_indices=cluster_center_inds,
-            assignments=assignments,
-            distances=distances,
-            centers=centers).partition(lengths)
-
-        int_indcs, int_assigs, int_dists, int_centers = int_result
-
-        print(int_indcs)
-        print(np.shape(int_assigs))
-        with timed("Wrote kcenters center indices in %.2f sec.", logger.info):
-            util.write_centers_indices(
-                args.center_indices,
-                [(t, f * args.subsample) for t, f in int_indcs],
-                intermediate_n=f'kcenters')
-
-        with timed("Wrote kcenters center structures in %.2f sec.", logger.info):
-            util.write_centers(int_result, args, intermediate_n=f'kcenters')
-
-        util.write_assignments_and_distances_with_reassign(int_result, args, 
-            intermediate_n=f'kcenters')
-
-    if n_iters > 0:
-        return kmedoids._kmedoids_iterations(
-            X, distance_method, n_iters, cluster_center_inds, assignments,
-            distances, args=args, lengths=lengths, random_state=random_state)
-    else:
-        return util.ClusterResult(
-            center_indices=cluster_center_inds,
-            assignments=assignments,
-            distances=distances,
-            centers=centers)
-
+        writer = util.IntermediateWriter(args, lengths)
+        writer.submit(
+            util.ClusterResult(
+                center_indices=cluster_center_inds,
+                assignments=assignments,
+                distances=distances,
+                centers=centers),
+            intermediate_n='kcenters')
+
+    try:
+        if n_iters > 0:
+            return kmedoids._kmedoids_iterations(
+                X, distance_method, n_iters, cluster_center_inds,
+                assignments, distances, args=args, lengths=lengths,
+                random_state=random_state,
+                batch_updates=batch_kmedoids_updates, writer=writer)
+        else:
+            return util.ClusterResult(
+                center_indices=cluster_center_inds,
+                assignments=assignments,
+                distances=distances,
+                centers=centers)
+    finally:
+        if writer is not None:
+            writer.close()
@@ -2,6 +2,7 @@ import time
 import logging
 
 import numpy as np
+import mdtraj as md
 
 from sklearn.base import BaseEstimator, ClusterMixin
 from sklearn.utils import check_random_state
@@ -14,6 +15,12 @@ from . import util
 
 logger = logging.getLogger(__name__)
 
+# frames of traj per candidate center considered by batched k-centers
+_BATCH_POOL_FACTOR = 32
+
+# size of the blocks of traj compared to all of a batch's centers at once
+_BATCH_BLOCK_BYTES = 2**22
+
 
 class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
     """Sklearn-style object for kcenters clustering.
@@ -47,6 +54,19 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         Use the MPI version of the algorithm. This assumes that each node
         in the MPI swarm owns its own data. If None, it is determined
         automatically.
+    checkpoint : callable, default=None
+        Called with a (local, in MPI mode) ClusterResult every
+        `checkpoint_interval` new centers, e.g. to write it to disk so
+        that clustering can be restarted with `fit`'s
+        `cluster_center_inds`, `assignments` and `distances`.
+    checkpoint_interval : int, default=None
+        Number of new centers between calls to `checkpoint`.
+    batch_size : int, default=None
+        Find up to this many new centers per pass over the data. See
+        `kcenters` for details.
+    distance_dtype : np.dtype, default=np.float64
+        Precision at which to store distances (np.float64 or
+        np.float32). See `kcenters` for details.
 
     References
     ----------
@@ -57,7 +77,9 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 
     def __init__(
             self, metric, n_clusters=None, cluster_radius=None,
-            random_first_center=False, random_state=None, mpi_mode=None):
+            random_first_center=False, random_state=None, mpi_mode=None,
+            checkpoint=None, checkpoint_interval=None, batch_size=None,
+            distance_dtype=np.float64):
 
         if n_clusters is None and cluster_radius is None:
             raise ImproperlyConfigured("Either n_clusters or cluster_radius "
@@ -72,10 +94,17 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         self.random_state = check_random_state(random_state)
         self.mpi_mode = mpi.size() != 1 if mpi_mode is None else mpi_mode
 
-    def fit(self, X, init_centers=None):
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.batch_size = batch_size
+        self.distance_dtype = distance_dtype
+
+    def fit(self, X, init_centers=None, assignments=None, distances=None,
+            cluster_center_inds=None):
         """Takes trajectories, X, and performs KCenters clustering.
         Optionally continues clustering from an initial set of cluster
-        centers.
+        centers, or restarts a previous run from its center indices,
+        assignments and distances.
 
         Parameters
         ----------
@@ -83,6 +112,13 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             Data to cluster.
         init_centers : array-like, shape=(n_centers, n_features(, n_atoms))
             Begin clustring with these centers as cluster centers.
+        assignments : ndarray, shape=(X.shape[0],), default=None
+            Assignments of each frame in `X` from a previous run.
+        distances : ndarray, shape=(X.shape[0],), default=None
+            Distances of each frame in `X` from a previous run.
+        cluster_center_inds : list, [(rank, index), ...] or [index, ...]
+            Centers found by a previous run, in the order they were
+            found.
         """
 
         t0 = time.perf_counter()
@@ -94,7 +130,14 @@ class KCenters(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             dist_cutoff=self.cluster_radius,
             init_centers=init_centers,
             random_first_center=self.random_first_center,
-            mpi_mode=self.mpi_mode)
+            mpi_mode=self.mpi_mode,
+            assignments=assignments,
+            distances=distances,
+            cluster_center_inds=cluster_center_inds,
+            checkpoint=self.checkpoint,
+            checkpoint_interval=self.checkpoint_interval,
+            batch_size=self.batch_size,
+            distance_dtype=self.distance_dtype)
 
         self.runtime_ = time.perf_counter() - t0
         return self
@@ -107,7 +150,10 @@ def kcenters_mpi(*args, **kwargs):
 
 def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
              init_centers=None, random_first_center=False,
-             use_triangle_inequality=False, mpi_mode=False):
+             use_triangle_inequality=False, mpi_mode=False,
+             assignments=None, distances=None, cluster_center_inds=None,
+             checkpoint=None, checkpoint_interval=None, batch_size=None,
+             distance_dtype=np.float64):
     """Function implementation of the k-centers clustering algorithm.
 
     K-centers is essentially an outlier detection algorithm. It
@@ -154,6 +200,49 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         greater than half than its nearest intercluster distance to avoid
         recomputing some distances. This optimization was developed in
         ref [3]_.
+    mpi_mode : bool, default=False
+        Treat `traj` as this node's share of data striped across an MPI
+        swarm.
+    assignments : ndarray, shape=(len(traj),), default=None
+        Assignments from a previous (e.g. checkpointed) k-centers run.
+        Must be given together with `distances` and
+        `cluster_center_inds`, in which case clustering resumes exactly
+        where that run stopped.
+    distances : ndarray, shape=(len(traj),), default=None
+        Distances from a previous k-centers run.
+    cluster_center_inds : list, default=None
+        Center indices from a previous k-centers run, in the order they
+        were found. In MPI mode, these are (owner_rank, local_index)
+        pairs; otherwise they are positions in `traj`.
+    checkpoint : callable, default=None
+        Function called with the current ClusterResult (local to this
+        node, in MPI mode) every `checkpoint_interval` new centers. In
+        MPI mode, it is called on every rank. The result's arrays are
+        updated in place as clustering continues, so they must be
+        written or copied before `checkpoint` returns.
+    checkpoint_interval : int, default=None
+        Number of new centers between calls to `checkpoint`.
+    batch_size : int, default=None
+        If greater than 1, find up to this many new centers per pass
+        over `traj`. Each pass chooses candidates greedily from the
+        frames farthest from the existing centers, accepting a candidate
+        only when it is provably the frame Gonzalez's algorithm would
+        choose next, and then computes distances to all accepted
+        candidates in one blocked sweep over `traj`. The clustering is
+        thus identical to the unbatched one (and keeps its
+        2-approximation guarantee), but reads `traj` from memory fewer
+        times. Can't be combined with `use_triangle_inequality`.
+    distance_dtype : np.dtype, default=np.float64
+        Precision at which distances are stored, np.float64 or
+        np.float32. Single precision halves the memory needed for
+        `distances` (and for gathering it in MPI mode). Distances are
+        still computed at double precision, but are rounded to
+        `distance_dtype` before they are compared, so ties are broken
+        at the stored precision: a frame moves to a new center only if
+        it is strictly closer than its current one (so frames
+        equidistant from several centers stay with the earliest), and
+        the new center is the lowest-index frame (on the lowest rank,
+        in MPI mode) of those tied for farthest from all centers.
 
     Returns
     -------
@@ -179,6 +268,7 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
                                        "is required for KHybrid clustering")
 
     distance_method = util._get_distance_method(distance_method)
+    distance_dtype = util._check_distance_dtype(distance_dtype)
 
     if n_clusters is None and dist_cutoff is None:
         raise ImproperlyConfigured(
@@ -192,18 +282,50 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         raise NotImplementedError(
             "We haven't implemented kcenters 'random_first_center' yet.")
 
-    if init_centers is None:
+    if batch_size is not None and batch_size > 1:
+        if use_triangle_inequality:
+            raise ImproperlyConfigured(
+                "Batched k-centers can't use the triangle inequality.")
+    else:
+        batch_size = None
+
+    if checkpoint is not None and not checkpoint_interval:
+        raise ImproperlyConfigured(
+            "A checkpoint_interval is required to checkpoint k-centers.")
+
+    restart = (assignments, distances, cluster_center_inds)
+    if any(r is not None for r in restart):
+        if any(r is None for r in restart):
+            raise ImproperlyConfigured(
+                "Restarting k-centers requires all of assignments, "
+                "distances and cluster_center_inds.")
+        if init_centers is not None:
+            raise ImproperlyConfigured(
+                "init_centers can't be used when restarting k-centers "
+                "from assignments, distances and cluster_center_inds.")
+
+        ctr_inds, centers, assignments, distances = _restart_state(
+            traj, assignments, distances, cluster_center_inds, mpi_mode,
+            distance_dtype)
+        logger.info("Restarting k-centers from %s existing centers.",
+                    len(ctr_inds))
+    elif init_centers is None:
         ctr_inds = []
         centers = []
         assignments = np.full(len(traj), -1, dtype=int)
-        distances = np.full(len(traj), np.inf, dtype=float)
+        distances = np.full(len(traj), np.inf, dtype=distance_dtype)
     else:
         centers = [c for c in init_centers]
         logger.info("Updating assignments to previous cluster centers")
         assignments, distances = util.assign_to_nearest_center(
             traj, centers, distance_method)
-        ctr_inds = list(
-            util.find_cluster_centers(assignments, distances))
+        distances = distances.astype(distance_dtype, copy=False)
+        if mpi_mode:
+            ctr_inds = util.find_cluster_centers_mpi(
+                assignments, distances)
+        else:
+            ctr_inds = list(
+                util.find_cluster_centers(assignments, distances))
 
     if mpi_mode:
         iteration = _kcenters_iteration_mpi
@@ -212,26 +334,55 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         iteration = _kcenters_iteration
         kwargs = {}
 
-    maxdist = (mpi.ops.striped_array_max(distances) if mpi_mode
-               else distances.max())
-    while (len(ctr_inds) < n_clusters) and (maxdist > dist_cutoff):
+    if use_triangle_inequality:
+        kwargs['center_distances'] = _CenterDistances.from_centers(
+            centers, assignments, distances, distance_method, mpi_mode)
 
-        new_center, distances, assignments, center_inds = \
-            iteration(traj, distance_method, distances, assignments, ctr_inds,
-                      use_triangle_inequality=use_triangle_inequality,
-                      **kwargs)
+    if batch_size is not None:
+        iteration = _kcenters_batch_iteration
+        kwargs = {'batch_size': batch_size, 'n_clusters': n_clusters,
+                  'dist_cutoff': dist_cutoff, 'mpi_mode': mpi_mode}
 
-        centers.append(new_center)
-        maxdist = (mpi.ops.striped_array_max(distances) if mpi_mode
-                   else distances.max())
+    maxdist, farthest = _farthest_frame(distances, assignments, mpi_mode)
+    last_checkpoint = len(ctr_inds)
+    while (len(ctr_inds) < n_clusters) and (maxdist > dist_cutoff):
+
+        if batch_size is not None:
+            new_centers, distances, assignments, center_inds = \
+                iteration(traj, distance_method, distances, assignments,
+                          ctr_inds, **kwargs)
+            centers.extend(new_centers)
+        else:
+            if mpi_mode:
+                kwargs['farthest'] = farthest
+            new_center, distances, assignments, center_inds = \
+                iteration(traj, distance_method, distances, assignments,
+                          ctr_inds,
+                          use_triangle_inequality=use_triangle_inequality,
+                          **kwargs)
+            centers.append(new_center)
+
+        maxdist, farthest = _farthest_frame(
+            distances, assignments, mpi_mode)
 
         if mpi.rank() == 0:
             logger.info(
                 "Center %s gives max dist of %.6f (stopping @ d=%.6f/n=%s).",
                 len(center_inds), maxdist, dist_cutoff, n_clusters)
 
+        if checkpoint is not None and \
+                len(ctr_inds) - last_checkpoint >= checkpoint_interval:
+            last_checkpoint = len(ctr_inds)
+            with log.timed("Checkpointed k-centers in %.2f sec",
+                           logger.info):
+                checkpoint(util.ClusterResult(
+                    center_indices=list(ctr_inds),
+                    assignments=assignments,
+                    distances=distances,
+                    centers=centers))
+
     logger.info("Terminated k-centers with n=%s and d=%0.6f.",
-                len(center_inds), maxdist,)
+                len(ctr_inds), maxdist,)
 
     return util.ClusterResult(
         center_indices=ctr_inds,
@@ -240,9 +391,533 @@ def kcenters(traj, distance_method, n_clusters=np.inf, dist_cutoff=0,
         centers=centers)
 
 
+def _farthest_frame(distances, assignments, mpi_mode):
+    """Find the largest distance from any frame to its center and, in
+    MPI mode, where that frame is, as (distance, owner_rank,
+    local_index, assignment), with a single collective. This is both
+    the stopping criterion and the next center, so that choosing each
+    new center costs one allreduce (and the broadcast of the frame).
+    """
+
+    if mpi_mode:
+        farthest = mpi.ops.striped_array_argmax(distances, assignments)
+        return farthest[0], farthest
+    else:
+        return distances.max(), None
+
+
+def _restart_state(traj, assignments, distances, cluster_center_inds,
+                   mpi_mode, distance_dtype=np.float64):
+    """Rebuild the k-centers loop state (center indices, center
+    coordinates, assignments and distances) from a previous run.
+    """
+
+    assignments = np.array(assignments, dtype=int)
+    distances = np.array(distances, dtype=distance_dtype)
+
+    if len(assignments) != len(traj) or len(distances) != len(traj):
+        raise ImproperlyConfigured(
+            "Restart assignments (%s) and distances (%s) must have the "
+            "same length as the data (%s)." %
+            (len(assignments), len(distances), len(traj)))
+
+    ctr_inds = [tuple(int(i) for i in c) if mpi_mode else int(c)
+                for c in cluster_center_inds]
+
+    if mpi_mode:
+        centers = [mpi.ops.distribute_frame(
+                       data=traj, world_index=idx, owner_rank=rank)
+                   for rank, idx in ctr_inds]
+    else:
+        centers = [traj[i] for i in ctr_inds]
+
+    return ctr_inds, centers, assignments, distances
+
+
+def _kcenters_batch_iteration(
+        traj, distance_method, distances, assignments, center_inds,
+        batch_size, n_clusters=np.inf, dist_cutoff=0, mpi_mode=False):
+    """Find up to `batch_size` new k-centers centers with a single sweep
+    over `traj`.
+
+    Candidates are chosen greedily from a pool of the frames (on each
+    node) farthest from the existing centers, tracking each pool frame's
+    distance to the candidates as they are chosen. Every frame outside
+    the pool is at most `tau` from its center, so a candidate farther
+    than `tau` from all existing centers and earlier candidates is
+    exactly the frame Gonzalez's algorithm would choose next; the batch
+    ends at the first candidate for which this can't be shown.
+
+    Parameters
+    ----------
+    traj : md.Trajectory or np.ndarray
+        The data to cluster with kcenters (this node's share, in MPI
+        mode).
+    distance_method : callable(X, y)
+        Distance function to use to compute distances between a dataset
+        (X) and a single point (y)
+    distances : np.ndarray
+        The current distance between each point and its nearest cluster
+        center
+    assignments : np.ndarray
+        The assignment of each point to a cluster center.
+    center_inds : list
+        The position of each center in ``traj`` (or, in MPI mode, its
+        (owner_rank, local_index) pair).
+    batch_size : int
+        Maximum number of centers to add.
+    n_clusters : int, default=np.inf
+        Never grow `center_inds` beyond this number of centers.
+    dist_cutoff : float, default=0
+        Don't add candidates that are no farther than this from their
+        nearest center.
+    mpi_mode : bool, default=False
+        Whether `traj` is striped across an MPI swarm.
+
+    Returns
+    -------
+    new_centers : list
+        Data for each center chosen by this batch.
+    distances : np.ndarray
+        Distances between each point and its nearest center, after the
+        inclusion of ``new_centers``
+    assignments : np.ndarray
+        Assignment of each point to its nearest center, after the
+        inclusion of ``new_centers``
+    center_inds : list
+        The location of each center (including ``new_centers``) in the
+        dataset.
+    """
+
+    assert len(traj) == len(distances)
+    assert len(traj) == len(assignments)
+
+    n_new = int(min(batch_size, n_clusters - len(center_inds)))
+    pool_size = min(len(traj), _BATCH_POOL_FACTOR * batch_size)
+
+    # the farthest frame is always in the pool, so that ties are broken
+    # toward the lowest index, as np.argmax(distances) would. In MPI
+    # mode, a node may hold no frames, and so contribute no pool.
+    if pool_size > 0:
+        pool = np.union1d(
+            np.argpartition(-distances, pool_size - 1)[:pool_size],
+            [np.argmax(distances)])
+    else:
+        pool = np.zeros(0, dtype=int)
+    outside = np.ones(len(traj), dtype=bool)
+    outside[pool] = False
+    tau = distances[outside].max() if outside.any() else -np.inf
+    if mpi_mode:
+        tau = mpi.comm.allreduce(tau, op=mpi.mpi4py.MAX)
+
+    pool_traj = traj[pool]
+    pool_dists = distances[pool].copy()
+
+    new_centers, new_inds = [], []
+    with log.timed("Chose batch of candidate centers in %.2f sec",
+                   logger.debug):
+        while len(new_centers) < n_new:
+            maxdist, owner, index = _pool_argmax(pool_dists, pool, mpi_mode)
+
+            # the first candidate is the global farthest frame, and so
+            # is always Gonzalez's choice.
+            if new_centers and (maxdist <= tau or maxdist <= dist_cutoff):
+                break
+
+            if mpi_mode:
+                new_center = mpi.ops.distribute_frame(
+                    data=traj, world_index=index, owner_rank=owner)
+                new_inds.append((owner, index))
+            else:
+                new_center = traj[index]
+                new_inds.append(index)
+            new_centers.append(new_center)
+
+            if len(new_centers) < n_new and len(pool) > 0:
+                pool_dists = np.minimum(
+                    pool_dists, util._distances_at(
+                        distance_method, pool_traj, new_center,
+                        pool_dists.dtype))
+
+    logger.debug("Chose %s candidate centers from a pool of %s (tau=%.6f)",
+                 len(new_centers), len(pool), tau)
+
+    with log.timed("Computed distances to batch in %.2f sec", logger.info):
+        _blocked_assign(traj, distance_method, new_centers, distances,
+                        assignments, first_label=len(center_inds))
+
+    center_inds.extend(new_inds)
+
+    return new_centers, distances, assignments, center_inds
+
+
+def _pool_argmax(pool_dists, pool, mpi_mode):
+    """Find the candidate farthest from all centers, as (distance,
+    owner_rank, index in `traj`), with one MAXLOC allreduce in MPI mode.
+    As with np.argmax, ties go to the lowest rank and then the lowest
+    index. A node with an empty pool contributes -inf.
+    """
+
+    if len(pool) > 0:
+        loc = int(np.argmax(pool_dists))
+        candidate = (pool_dists[loc], (mpi.rank(), int(pool[loc])))
+    else:
+        candidate = (-np.inf, (mpi.rank(), -1))
+
+    if mpi_mode:
+        candidate = mpi.comm.allreduce(candidate, op=mpi.mpi4py.MAXLOC)
+
+    maxdist, (owner, index) = candidate
+    return maxdist, owner, index
+
+
+def _blocked_assign(traj, distance_method, centers, distances, assignments,
+                    first_label):
+    """Update `distances` and `assignments` in place with the distance
+    from each frame of `traj` to each of `centers` (labelled from
+    `first_label`).
+
+    `traj` is swept in cache-sized blocks, and for each block the
+    distance method is called once per center, so that the block is
+    still in cache for every center after the first. The centers are
+    looped over in Python; the distance computations are not combined
+    into a single kernel call.
+    """
+
+    if len(traj) == 0:
+        return
+
+    dist = np.empty(len(traj), dtype=distances.dtype)
+    for block in util._frame_blocks(traj, _BATCH_BLOCK_BYTES):
+        for label, center in enumerate(centers, start=first_label):
+            util._distances_to_subset(
+                distance_method, traj, center, block, out=dist)
+
+            inds = np.flatnonzero(dist[block] < distances[block]) + \
+                block.start
+            distances[inds] = dist[inds]
+            assignments[inds] = label
+
+
+def _round_down_f32(x):
+    """Cast `x` to float32, rounding toward -inf, so that lower bounds
+    stay lower bounds.
+    """
+
+    x32 = x.astype(np.float32)
+    return np.where(x32 > x, np.nextafter(x32, np.float32(-np.inf)), x32)
+
+
+class _CenterDistances:
+    """Growing cache of the distances between k-centers cluster centers
+    and of each cluster's radius, for triangle-inequality k-centers.
+
+    For a new center c owned by center a_c at distance D, the triangle
+    inequality gives d(a, c) >= d(a, a_c) - D for every existing center
+    a. If that bound is at least twice cluster a's radius, no member of
+    a can be closer to c than to a, so d(a, c) need not be computed
+    (Elkan's center-center bound). Distances are otherwise computed
+    only for centers that can't be pruned, and each new center's row is
+    appended to a preallocated k x k table rather than recomputed.
+
+    Cached center-center values are lower bounds (exact when computed)
+    and are stored as float32, so memory is 4k^2 bytes. Radii are upper
+    bounds, tightened every iteration using the points that were
+    compared to the new center.
+
+    Each point also keeps an anchor: the nearest center other than its
+    own whose exact distance to it is known (its previous center, or a
+    center it was compared to but not assigned to). Since
+    d(x, c) >= d(j, c) - d(x, j) for anchor j, a point whose own
+    cluster can't be pruned is still skipped when this bound shows it
+    can't move (Hamerly's per-point lower bound). This costs an index
+    and a distance per point.
+
+    Parameters
+    ----------
+    distance_method : callable(X, y)
+        Distance function used by k-centers.
+    mpi_mode : bool, default=False
+        Whether assignments and distances are striped across an MPI
+        swarm, in which case radii are reduced across nodes. The centers
+        themselves are known to every node.
+    capacity : int, default=64
+        Number of centers to preallocate space for. Storage doubles
+        whenever it fills.
+    """
+
+    def __init__(self, distance_method, mpi_mode=False, capacity=64):
+        self.distance_method = distance_method
+        self.mpi_mode = mpi_mode
+        self.n_centers = 0
+
+        self._cc = np.zeros((capacity, capacity), dtype=np.float32)
+        self._radii = np.zeros(capacity, dtype=float)
+        self._coords = None
+        self._topology = None
+        self._scratch = None
+        self._anchors = None
+        self._anchor_dists = None
+
+    @classmethod
+    def from_centers(cls, centers, assignments, distances, distance_method,
+                     mpi_mode=False):
+        """Build a cache for an existing set of centers, e.g. when
+        k-centers is started from initial centers or restarted.
+        """
+
+        cache = cls(distance_method, mpi_mode=mpi_mode,
+                    capacity=max(64, 2 * len(centers)))
+
+        for i, center in enumerate(centers):
+            if i > 0:
+                cc_dists = np.asarray(distance_method(
+                    cache.centers(np.arange(i)), center)).reshape(-1)
+            else:
+                cc_dists = np.zeros(0)
+            cache._append(center, cc_dists)
+
+        if len(centers) > 0:
+            cache._radii[:len(centers)] = cache._reduce_max(
+                np.zeros(len(centers)), assignments, distances,
+                assignments >= 0)
+
+        return cache
+
+    @property
+    def radii(self):
+        return self._radii[:self.n_centers]
+
+    def centers(self, inds):
+        """Center data for centers `inds`, stacked as the clustered data
+        is (an array or an md.Trajectory).
+        """
+
+        if self._topology is not None:
+            return md.Trajectory(self._coords[inds], self._topology)
+        return self._coords[inds]
+
+    def scratch(self, distances):
+        """An array like `distances`, kept between iterations, for the
+        distances to each new center to be written into. Its values are
+        whatever was last written there.
+        """
+
+        if self._scratch is None or self._scratch.shape != distances.shape \
+                or self._scratch.dtype != distances.dtype:
+            self._scratch = np.empty_like(distances)
+        return self._scratch
+
+    def lower_bounds(self, new_center, owner, owner_dist):
+        """Bound the distance from `new_center` to every existing center.
+
+        Parameters
+        ----------
+        new_center : array-like or md.Trajectory
+            The center about to be added.
+        owner : int
+            Index of the center `new_center` is currently assigned to.
+        owner_dist : float
+            Distance between `new_center` and center `owner`.
+
+        Returns
+        -------
+        cc_dists : np.ndarray, shape=(n_centers,)
+            A lower bound on the distance between each existing center
+            and `new_center`, computed exactly wherever that bound could
+            be less than twice the center's radius.
+        """
+
+        k = self.n_centers
+
+        cc_dists = np.maximum(self._cc[owner, :k] - owner_dist, 0)
+        cc_dists[owner] = owner_dist
+
+        compute = cc_dists < 2 * self.radii
+        compute[owner] = False
+
+        inds = np.flatnonzero(compute)
+        logger.debug("Computing %s of %s center-center distances",
+                     len(inds), k)
+        if len(inds) > 0:
+            cc_dists[inds] = np.asarray(self.distance_method(
+                self.centers(inds), new_center)).reshape(-1)
+
+        return cc_dists
+
+    def candidates(self, cc_dists, assignments, distances):
+        """Find the points that might be closer to a new center than to
+        their own.
+
+        Parameters
+        ----------
+        cc_dists : np.ndarray, shape=(n_centers,)
+            Lower bounds on the distance from each existing center to
+            the new center, as from `lower_bounds`.
+        assignments : np.ndarray
+            Assignments, before the new center is added.
+        distances : np.ndarray
+            Distances, before the new center is added.
+
+        Returns
+        -------
+        candidates : np.ndarray, dtype=bool
+            Mask of the points whose distance to the new center must be
+            computed.
+        unbounded : np.ndarray, dtype=bool
+            Mask of the points not within half the center-center
+            distance of their own center (a superset of `candidates`).
+        """
+
+        anchors, anchor_dists = self._point_bounds(distances)
+
+        unbounded = distances > (cc_dists[assignments] / 2)
+        candidates = unbounded.copy()
+
+        inds = np.flatnonzero(unbounded & (anchors >= 0))
+        candidates[inds] = \
+            (cc_dists[anchors[inds]] - anchor_dists[inds]) < distances[inds]
+
+        logger.debug("Per-point bounds skipped %s of %s unbounded points",
+                     len(inds) - np.count_nonzero(candidates[inds]),
+                     np.count_nonzero(unbounded))
+
+        return candidates, unbounded
+
+    def update_anchors(self, new_dists, moved, assignments, distances,
+                       compared=None):
+        """Update each point's anchor for a new center, before
+        `assignments` and `distances` are updated to include it.
+
+        Parameters
+        ----------
+        new_dists : np.ndarray
+            Distance from each point to the new center (valid where
+            `compared`).
+        moved : np.ndarray, dtype=bool
+            Mask of the points that will be assigned to the new center.
+        assignments : np.ndarray
+            Assignments, before the new center is added.
+        distances : np.ndarray
+            Distances, before the new center is added.
+        compared : np.ndarray, dtype=bool, default=None
+            Mask of the points whose distance to the new center was
+            computed. If None, every point was compared.
+        """
+
+        anchors, anchor_dists = self._point_bounds(distances)
+
+        closer = (new_dists < anchor_dists) & ~moved
+        if compared is not None:
+            closer &= compared
+        anchors[closer] = self.n_centers
+        anchor_dists[closer] = new_dists[closer]
+
+        # a point's old center becomes its nearest other center
+        anchors[moved] = assignments[moved]
+        anchor_dists[moved] = distances[moved]
+
+    def add_center(self, new_center, cc_dists, assignments, distances,
+                   compared=None):
+        """Add a center, after `assignments` and `distances` have been
+        updated to include it.
+
+        Parameters
+        ----------
+        new_center : array-like or md.Trajectory
+            The center that was added.
+        cc_dists : np.ndarray, shape=(n_centers,), default=None
+            Lower bounds on the distance from each existing center to
+            `new_center`, as from `lower_bounds`. If None, they are
+            computed exactly.
+        assignments : np.ndarray
+            Assignments, including `new_center`.
+        distances : np.ndarray
+            Distances, including `new_center`.
+        compared : np.ndarray, dtype=bool, default=None
+            Mask of the points not within half the center-center distance
+            of their own center, as from `candidates`. If None, every
+            point was compared.
+        """
+
+        k = self.n_centers
+
+        if cc_dists is None:
+            cc_dists = np.zeros(0) if k == 0 else np.asarray(
+                self.distance_method(self.centers(np.arange(k)),
+                                     new_center)).reshape(-1)
+
+        if compared is None:
+            radii = self._reduce_max(
+                np.zeros(k + 1), assignments, distances, assignments >= 0)
+        else:
+            # the remaining points are within half the center-center
+            # distance of their own center.
+            bound = np.zeros(k + 1)
+            bound[:k] = cc_dists / 2
+            radii = self._reduce_max(bound, assignments, distances, compared)
+            radii[:k] = np.minimum(radii[:k], self.radii)
+
+        self._append(new_center, cc_dists)
+        self._radii[:k + 1] = radii
+
+    def _point_bounds(self, distances):
+        if self._anchors is None or len(self._anchors) != len(distances):
+            self._anchors = np.full(len(distances), -1, dtype=np.intp)
+            self._anchor_dists = np.full(
+                len(distances), np.inf, dtype=distances.dtype)
+        return self._anchors, self._anchor_dists
+
+    def _reduce_max(self, out, assignments, distances, mask):
+        np.maximum.at(out, assignments[mask], distances[mask])
+
+        if self.mpi_mode:
+            global_out = np.empty_like(out)
+            mpi.comm.Allreduce(out, global_out, op=mpi.mpi4py.MAX)
+            out = global_out
+
+        return out
+
+    def _append(self, center, cc_dists):
+        k = self.n_centers
+
+        if hasattr(center, 'xyz'):
+            coords = center.xyz[0]
+            if self._topology is None:
+                self._topology = center.topology
+        else:
+            coords = np.asarray(center)
+
+        if self._coords is None:
+            self._coords = np.empty(
+                (len(self._radii),) + coords.shape, dtype=coords.dtype)
+
+        if k == len(self._radii):
+            self._grow(2 * k)
+
+        self._coords[k] = coords
+        self._cc[k, :k] = self._cc[:k, k] = _round_down_f32(cc_dists)
+        self.n_centers += 1
+
+    def _grow(self, capacity):
+        k = self.n_centers
+
+        cc = np.zeros((capacity, capacity), dtype=np.float32)
+        cc[:k, :k] = self._cc[:k, :k]
+        self._cc = cc
+
+        self._radii = np.concatenate(
+            [self._radii, np.zeros(capacity - len(self._radii))])
+
+        coords = np.empty((capacity,) + self._coords.shape[1:],
+                          dtype=self._coords.dtype)
+        coords[:k] = self._coords[:k]
+        self._coords = coords
+
+
 def _kcenters_iteration(
         traj, distance_method, distances, assignments, center_inds,
-        use_triangle_inequality=False):
+        use_triangle_inequality=False, center_distances=None):
     """Core inner loop for kcenters centers discovery.
 
     Parameters
@@ -259,6 +934,12 @@ def _kcenters_iteration(
         The assignment of each point to a cluster center.
     center_inds : list
         The position of each center in ``traj``.
+    use_triangle_inequality : bool, default=False
+        Skip distance computations that the triangle inequality shows
+        can't change an assignment.
+    center_distances : _CenterDistances, default=None
+        Center-center distance cache used (and updated) by the triangle
+        inequality. If None, one is built from ``center_inds``.
 
     Returns
     -------
@@ -284,94 +965,147 @@ def _kcenters_iteration(
 
     logger.debug("Chose frame %s as new center", new_center_index)
 
+    if use_triangle_inequality and center_distances is None:
+        center_distances = _CenterDistances.from_centers(
+            [traj[i] for i in center_inds], assignments, distances,
+            distance_method)
+
+    cc_dists, recompute_dists, unbounded = None, None, None
     if use_triangle_inequality and np.all(assignments >= 0):
-        cc_dists = distance_method(traj[center_inds], new_center)
-        recompute_dists = distances > (cc_dists[assignments] / 2)
+        cc_dists = center_distances.lower_bounds(
+            new_center, owner=assignments[new_center_index],
+            owner_dist=distances[new_center_index])
+        recompute_dists, unbounded = center_distances.candidates(
+            cc_dists, assignments, distances)
 
         logger.debug("Recomputing %s of %s distances",
                      np.count_nonzero(recompute_dists), len(recompute_dists))
 
-        dist = distances.copy()
-        dist[recompute_dists] = distance_method(
-            traj[recompute_dists], new_center)
+        dist = util._distances_to_subset(
+            distance_method, traj, new_center, recompute_dists,
+            out=center_distances.scratch(distances))
     else:
-        dist = distance_method(traj, new_center)
+        dist = util._distances_at(
+            distance_method, traj, new_center, distances.dtype)
 
     # scipy distance metrics return shape (n, 1) instead of (n), which
     # causes breakage here.
     assert len(dist.shape) == len(distances.shape)
 
     inds = (dist < distances)
+    if recompute_dists is not None:
+        # the rest of dist is left over from earlier iterations
+        inds &= recompute_dists
+
+    if use_triangle_inequality:
+        center_distances.update_anchors(
+            dist, inds, assignments, distances, compared=recompute_dists)
+
     distances[inds] = dist[inds]
     assignments[inds] = len(center_inds)
 
+    if use_triangle_inequality:
+        center_distances.add_center(
+            new_center, cc_dists, assignments, distances,
+            compared=unbounded)
+
     center_inds.append(new_center_index)
-    new_center_index = np.argmax(distances)
 
     return new_center, distances, assignments, center_inds
 
 
 def _kcenters_iteration_mpi(
         traj, distance_method, distances, assignments, center_inds,
-        centers, use_triangle_inequality=False):
+        centers, use_triangle_inequality=False, center_distances=None,
+        farthest=None):
     """The core inner loop of the kcenters iteration protocol. This can
     be used to start and stop doing kcenters (for example to save
     frequently or do checkpointing).
+
+    The new center is found with a single MAXLOC allreduce (or taken
+    from `farthest`, the result of `mpi.ops.striped_array_argmax` over
+    `distances` and `assignments`, if the caller already has it) and
+    then broadcast with a non-blocking collective, so that the node
+    that owns it computes its distances while the broadcast proceeds.
     """
 
     assert len(traj) == len(distances)
     assert len(traj) == len(assignments)
     assert np.issubdtype(type(assignments[0]), np.integer)
 
+    if use_triangle_inequality and center_distances is None:
+        center_distances = _CenterDistances.from_centers(
+            centers, assignments, distances, distance_method, mpi_mode=True)
+
     if len(center_inds) == 0:
         new_cluster_center_index = 0
         new_cluster_center_owner = 0
     else:
-        with log.timed("Gathered distances in %.2f sec", logger.debug):
-            # this could likely be accomplished with mpi.reduce instead...
-            dist_locs = np.array(
-                mpi.comm.allgather(np.argmax(distances)))
-            dist_vals = np.array(
-                mpi.comm.allgather(np.max(distances)))
-
-        new_cluster_center_owner = np.argmax(dist_vals)
-        new_cluster_center_index = dist_locs[new_cluster_center_owner]
+        if farthest is None:
+            with log.timed("Found farthest frame in %.2f sec",
+                           logger.debug):
+                farthest = mpi.ops.striped_array_argmax(
+                    distances, assignments)
+        owner_dist, new_cluster_center_owner, new_cluster_center_index, \
+            owner_assig = farthest
 
     logger.debug("Chose frame %s (node %s) as new center",
                  new_cluster_center_index, new_cluster_center_owner)
 
-    with log.timed("Distributed cluster ctr in %.2f sec",
-                   log_func=logger.info):
-        new_center = mpi.ops.distribute_frame(
-            data=traj,
-            world_index=new_cluster_center_index,
-            owner_rank=new_cluster_center_owner)
+    new_center, request = mpi.ops.distribute_frame(
+        data=traj,
+        world_index=new_cluster_center_index,
+        owner_rank=new_cluster_center_owner,
+        nonblocking=True)
 
+    is_owner = (mpi.rank() == new_cluster_center_owner)
+    if not is_owner:
+        with log.timed("Distributed cluster ctr in %.2f sec",
+                       log_func=logger.info):
+            request.Wait()
+
+    cc_dists, recompute_dists, unbounded = None, None, None
     with log.timed("Computed distance in %.2f sec", log_func=logger.info):
-        if use_triangle_inequality and np.all(assignments >= 0):
-            if hasattr(centers[0], 'xyz'):
-                cc_dists = np.array([distance_method(c, new_center).squeeze()
-                                     for c in centers])
-            else:
-                cc_dists = distance_method(np.array(centers), new_center)
-            recompute_dists = (distances > (cc_dists[assignments] / 2))
+        if use_triangle_inequality and len(center_inds) > 0 and \
+                np.all(assignments >= 0):
+            cc_dists = center_distances.lower_bounds(
+                new_center, owner=int(owner_assig), owner_dist=owner_dist)
+            recompute_dists, unbounded = center_distances.candidates(
+                cc_dists, assignments, distances)
             logger.debug(
                 "Recomputing %s of %s distances",
                 np.count_nonzero(recompute_dists), len(recompute_dists))
 
-            new_dists = distances.copy()
-            new_dists[recompute_dists] = distance_method(
-                traj[recompute_dists], new_center)
+            new_dists = util._distances_to_subset(
+                distance_method, traj, new_center, recompute_dists,
+                out=center_distances.scratch(distances))
         else:
-            new_dists = distance_method(traj, new_center)
+            new_dists = util._distances_at(
+                distance_method, traj, new_center, distances.dtype)
+
+    if is_owner:
+        request.Wait()
 
     assert len(distances.shape) == len(new_dists.shape)
 
     inds = (new_dists < distances)
+    if recompute_dists is not None:
+        # the rest of new_dists is left over from earlier iterations
+        inds &= recompute_dists
+
+    if use_triangle_inequality:
+        center_distances.update_anchors(
+            new_dists, inds, assignments, distances,
+            compared=recompute_dists)
 
     distances[inds] = new_dists[inds]
     assignments[inds] = len(center_inds)
 
+    if use_triangle_inequality:
+        center_distances.add_center(
+            new_center, cc_dists, assignments, distances,
+            compared=unbounded)
+
     center_inds.append(
         (new_cluster_center_owner, new_cluster_center_index))
 
@@ -2,6 +2,7 @@ import time
 import logging
 
 import numpy as np
+import scipy.sparse
 
 from sklearn.base import BaseEstimator, ClusterMixin
 from sklearn.utils import check_random_state
@@ -41,6 +42,13 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         is run without initial assignments, distances, or cluster_center_inds.
     n_iters : int, default=5
         Number of rounds of new proposed centers to run.
+    batch_updates : bool, default=False
+        Evaluate a proposal for every cluster in one pass over the data
+        and accept all improving, non-conflicting swaps, rather than
+        making one pass per proposal. See `kmedoids`.
+    distance_dtype : np.dtype, default=np.float64
+        Precision at which to store distances (np.float64 or
+        np.float32). See `kmedoids`.
 
     Returns
     -------
@@ -50,9 +58,12 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
     """
 
     def __init__(
-            self, metric, n_clusters=None, n_iters=5, args=None, lengths=None):
+            self, metric, n_clusters=None, n_iters=5, args=None, lengths=None,
+            batch_updates=False, distance_dtype=np.float64):
         
         self.metric = util._get_distance_method(metric)
+        self.batch_updates = batch_updates
+        self.distance_dtype = distance_dtype
 
         self.n_clusters = n_clusters
         self.n_iters = n_iters
@@ -60,7 +71,8 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         self.lengths = lengths
 
     def fit(self, X, assignments=None, distances=None,
-            cluster_center_inds=None, X_lengths=None, args=None):
+            cluster_center_inds=None, X_lengths=None, X_owners=None,
+            args=None):
         """Takes trajectories, X, and performs KMedoids clustering.
         Automatically determines whether or not to use the MPI version of this
         algorithm. Can start from scratch or perform a warm start using inital
@@ -87,6 +99,10 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
         X_lengths : list, [traj1_length, traj2_length, ...], default=None
             List of the lengths of all trajectories with respect to all data
             not just the data on a single MPI rank.
+        X_owners : array-like, shape=(len(X_lengths),), default=None
+            The MPI rank holding each trajectory (see
+            enspara.mpi.ops.stripe_owners). By default, trajectory i is
+            held by rank i % n.
         """
 
         t0 = time.perf_counter()
@@ -99,7 +115,9 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
             assignments=assignments,
             distances=distances,
             cluster_center_inds=cluster_center_inds,
-            X_lengths=X_lengths, args=args)
+            X_lengths=X_lengths, X_owners=X_owners, args=args,
+            batch_updates=self.batch_updates,
+            distance_dtype=self.distance_dtype)
 
         self.runtime_ = time.perf_counter() - t0
         return self
@@ -107,7 +125,9 @@ class KMedoids(BaseEstimator, ClusterMixin, util.MolecularClusterMixin):
 
 def kmedoids(X, distance_method, n_clusters=None, n_iters=5, assignments=None,
              distances=None, cluster_center_inds=None, proposals=None,
-             X_lengths=None, args=None, lengths=None, random_state=None):
+             X_lengths=None, X_owners=None, args=None, lengths=None,
+             random_state=None, batch_updates=False,
+             distance_dtype=np.float64):
     """K-Medoids clustering.
 
     K-Medoids is a clustering algorithm similar to the k-means algorithm
@@ -143,8 +163,27 @@ def kmedoids(X, distance_method, n_clusters=None, n_iters=5, assignments=None,
     X_lengths : list, [traj1_length, traj2_length, ...], default=None
         List of the lengths of all trajectories with respect to all data
         not just the data on a single MPI rank.
+    X_owners : array-like, shape=(len(X_lengths),), default=None
+        In MPI mode, the rank holding each trajectory (see
+        enspara.mpi.ops.stripe_owners). By default, trajectory i is held
+        by rank i % n.
     random_state : int, default=None
         Random state to fix RNG with.
+    batch_updates : bool, default=False
+        Instead of proposing and evaluating one new medoid at a time
+        (each costing a pass over `X` and, in MPI mode, a reduction),
+        propose one per cluster and evaluate them all in a single
+        blocked pass, FastPAM-style, accepting every improving swap that
+        doesn't conflict with a better one. Requires the mean-square
+        cost, and one extra pass up front to find each frame's
+        second-nearest medoid.
+    distance_dtype : np.dtype, default=np.float64
+        Precision at which distances are stored, np.float64 or
+        np.float32 (which halves their memory). Distances are rounded to
+        this precision before they are compared, and a frame is only
+        reassigned to a proposed medoid that is strictly closer than
+        its current one, as in `kcenters.kcenters`. Costs are always
+        accumulated at double precision.
 
     Returns
     -------
@@ -170,6 +209,7 @@ def kmedoids(X, distance_method, n_clusters=None, n_iters=5, assignments=None,
             " (assignments and distances) for KMedoids")
 
     distance_method = util._get_distance_method(distance_method)
+    distance_dtype = util._check_distance_dtype(distance_dtype)
 
     n_frames = len(X)
 
@@ -177,7 +217,7 @@ def kmedoids(X, distance_method, n_clusters=None, n_iters=5, assignments=None,
         assignments, distances, cluster_center_inds = \
          _kmedoids_inputs_tree_mpi(X, distance_method, n_clusters, assignments,
                                distances, cluster_center_inds, X_lengths,
-                               random_state=random_state) 
+                               X_owners=X_owners, random_state=random_state)
         
         #Check that the cluster_center_inds on this ranks corresponed to
         # distances with value 0.
@@ -196,14 +236,16 @@ def kmedoids(X, distance_method, n_clusters=None, n_iters=5, assignments=None,
         # be very close to 0 but not eactly 0.
         assert np.all(distances[cluster_center_inds] < 0.001)
 
+    distances = np.asarray(distances).astype(distance_dtype, copy=False)
+
     return _kmedoids_iterations(
                X, distance_method, n_iters, cluster_center_inds,
                assignments, distances, proposals=proposals, args=args, lengths=lengths,
-               random_state=random_state)
+               random_state=random_state, batch_updates=batch_updates)
 
 def _kmedoids_inputs_tree_mpi(X, distance_method, n_clusters, assignments,
                               distances, cluster_center_inds, X_lengths,
-                              random_state=None):
+                              X_owners=None, random_state=None):
     """Helper function to process K-Medoids clustering inputs in mpi mode.
 
     Parameters
@@ -230,6 +272,9 @@ def _kmedoids_inputs_tree_mpi(X, distance_method, n_clusters, assignments,
     X_lengths : list, [traj1_length, traj2_length, ...]
         List of the lengths of all trajectories with respect to all data
         not just the data on a single MPI rank.
+    X_owners : array-like, shape=(len(X_lengths),), default=None
+        The rank holding each trajectory. By default, trajectory i is
+        held by rank i % n.
     random_state : int, default = None
         Random state to fix RNG with.
 
@@ -272,7 +317,8 @@ def _kmedoids_inputs_tree_mpi(X, distance_method, n_clusters, assignments,
     # into the form that is appropriate for MPI communication
     elif (cluster_center_inds is not None and distances is not None
          and assignments is not None):
-        cluster_center_inds = ctr_ids_mpi(cluster_center_inds, X_lengths)
+        cluster_center_inds = ctr_ids_mpi(
+            cluster_center_inds, X_lengths, X_owners)
 
     else:
         raise ImproperlyConfigured(
@@ -362,7 +408,7 @@ def _kmedoids_inputs_tree(
 
     return assignments, distances, cluster_center_inds
 
-def ctr_ids_mpi(cluster_center_inds, lengths):
+def ctr_ids_mpi(cluster_center_inds, lengths, owners=None):
     """Map cluster_center_inds to MPI compatible format
    
     Parameters
@@ -374,6 +420,10 @@ def ctr_ids_mpi(cluster_center_inds, lengths):
     X_lengths : list, [traj1_length, traj2_length, ...]
         List of the lengths of all trajectories with respect to all data
         not just the data on a single MPI rank.
+    owners : array-like, shape=(len(lengths),), default=None
+        The rank holding each trajectory (see
+        enspara.mpi.ops.stripe_owners). By default, trajectory i is held
+        by rank i % n.
 
     Returns
     -------
@@ -382,35 +432,41 @@ def ctr_ids_mpi(cluster_center_inds, lengths):
 """
 
     num_procs = mpi.size()
-    updated_ctr_inds = []
-    global_inds = ra.RaggedArray(np.arange(sum(lengths)),lengths=lengths)
+    lengths = np.asarray(lengths, dtype=int)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
 
     if not hasattr(cluster_center_inds[0], '__len__'):
-        # Convert from [global_frame_ind, ...] to 
+        # Convert from [global_frame_ind, ...] to
         # [[global_traj_id, local_frame_id],...]
-        cluster_center_inds = [[np.where(global_inds == c)[0][0], \
-                           np.where(global_inds == c)[1][0]] for c in \
-                           cluster_center_inds]
-
-    # Converting from [[global_traj_id, local_frame_id],...] to 
-    # [(mpi_rank, local_frame_ind), ...]
-    for pair in cluster_center_inds:
-        global_traj_id, frame_id = pair
-        mpi_rank = global_traj_id % num_procs
-        trajs_owned = global_inds[np.arange(len(lengths))[mpi_rank::num_procs]]
-        trajs_owned_local_inds = \
-            ra.RaggedArray(np.arange(sum(trajs_owned.lengths)),
-                           lengths=trajs_owned.lengths)
-        local_trj_id = int(global_traj_id/num_procs)
-        concat_idx = trajs_owned_local_inds[local_trj_id][frame_id]
-        updated_ctr_inds.append((mpi_rank,concat_idx))
-
-    return updated_ctr_inds
+        global_frames = np.asarray(cluster_center_inds, dtype=int)
+        traj_ids = np.searchsorted(starts, global_frames, side='right') - 1
+        frame_ids = global_frames - starts[traj_ids]
+    else:
+        traj_ids, frame_ids = np.asarray(
+            cluster_center_inds, dtype=int).reshape(-1, 2).T
+
+    # Converting from [[global_traj_id, local_frame_id],...] to
+    # [(mpi_rank, local_frame_ind), ...]. Each trajectory follows the
+    # trajectories its rank holds before it.
+    if owners is None:
+        owners = np.arange(len(lengths)) % num_procs
+    owners = np.asarray(owners, dtype=int)
+
+    local_starts = np.zeros(len(lengths), dtype=int)
+    for rank in range(num_procs):
+        owned = owners == rank
+        local_starts[owned] = np.cumsum(lengths[owned]) - lengths[owned]
+
+    ranks = owners[traj_ids]
+    concat_inds = local_starts[traj_ids] + frame_ids
+
+    return [(int(r), int(i)) for r, i in zip(ranks, concat_inds)]
+
 
 def _kmedoids_iterations(
         X, distance_method, n_iters, cluster_center_inds,
-        assignments, distances, proposals=None, args=None, 
-        lengths=None, random_state=None):
+        assignments, distances, proposals=None, args=None,
+        lengths=None, random_state=None, batch_updates=False, writer=None):
     """Inner loop performing kmedoids updates.
 
     Parameters
@@ -437,6 +493,11 @@ def _kmedoids_iterations(
         center (rather than choosing randomly).
     random_state : int, default = None
         Random state to fix RNG with.
+    batch_updates : bool, default=False
+        Use `_kmedoids_batch_update` rather than `_kmedoids_pam_update`.
+    writer : util.IntermediateWriter, default=None
+        Writer for intermediate results, if `args.save_intermediates`.
+        If not given, one is made (and closed before returning).
 
     Returns
     -------
@@ -445,38 +506,60 @@ def _kmedoids_iterations(
         and center indices for this function.
     """
 
+    own_writer = (writer is None and args != None and
+                  args.save_intermediates)
+    if own_writer:
+        writer = util.IntermediateWriter(args, lengths)
+
+    try:
+        return _kmedoids_iterations_inner(
+            X, distance_method, n_iters, cluster_center_inds, assignments,
+            distances, proposals, random_state, batch_updates, writer)
+    finally:
+        if own_writer:
+            writer.close()
+
+
+def _kmedoids_iterations_inner(
+        X, distance_method, n_iters, cluster_center_inds, assignments,
+        distances, proposals, random_state, batch_updates, writer):
+
+    if batch_updates and n_iters > 0:
+        random_state = check_random_state(random_state)
+        centers = _medoid_coords(X, cluster_center_inds)
+        with timed("Found second-nearest medoids in %.2f sec.", logger.info):
+            assignments, distances, second_assignments, second_distances = \
+                _nearest_two(X, centers, distance_method, distances.dtype)
+
     for i in range(n_iters):
-        cluster_center_inds, distances, assignments, centers = \
-            _kmedoids_pam_update(X, distance_method, cluster_center_inds,
-                                 assignments, distances, proposals=proposals,
-                                 random_state=random_state)
+        if batch_updates:
+            (cluster_center_inds, distances, assignments, second_distances,
+             second_assignments, centers) = _kmedoids_batch_update(
+                X, distance_method, cluster_center_inds, centers,
+                assignments, distances, second_assignments,
+                second_distances, proposals=proposals,
+                random_state=random_state)
+        else:
+            cluster_center_inds, distances, assignments, centers = \
+                _kmedoids_pam_update(X, distance_method, cluster_center_inds,
+                                     assignments, distances,
+                                     proposals=proposals,
+                                     random_state=random_state)
         result = util.ClusterResult(
             center_indices=cluster_center_inds,
             assignments=assignments,
             distances=distances,
             centers=centers)
 
-        if args != None and args.save_intermediates:
-            #if on the last iteration, about to save anyways...
-            int_result = result.partition(lengths)
-            int_indcs, int_assigs, int_dists, int_centers = int_result
-
-            if i != n_iters -1:
-                with timed("Wrote center indices in %.2f sec.", logger.info):
-                    util.write_centers_indices(
-                        args.center_indices,
-                        [(t, f * args.subsample) for t, f in int_indcs],
-                        intermediate_n=f'kmedoids-{i}')
-                with timed("Wrote center structures in %.2f sec.", logger.info):
-                    util.write_centers(int_result, args, intermediate_n=f'kmedoids-{i}')
-                util.write_assignments_and_distances_with_reassign(int_result, args, 
-                    intermediate_n=f'kmedoids-{i}')
+        #if on the last iteration, about to save anyways...
+        if writer is not None and i != n_iters - 1:
+            writer.submit(result, intermediate_n=f'kmedoids-{i}')
         logger.info("KMedoids update %s", i)
 
     return result
 
 def _msq(x):
-    return mpi.ops.striped_array_mean(np.square(x))
+    return mpi.ops.striped_array_mean(np.square(x, dtype=np.float64))
 
 
 def _propose_new_center_amongst(X, state_inds, mpi_mode, random_state):
@@ -517,6 +600,25 @@ def _propose_new_center_amongst(X, state_inds, mpi_mode, random_state):
     return proposed_center, proposed_center_ind
 
 
+def _medoid_coords(X, medoid_inds):
+    """Build a list of the coordinates of each medoid, distributing them
+    to every node in MPI mode.
+    """
+
+    medoid_coords = []
+    if hasattr(medoid_inds[0], '__len__'):
+        assert len(medoid_inds[0]) == 2
+        for center_idx, (rank, frame_idx) in enumerate(medoid_inds):
+            assert rank < mpi.size()
+            new_center = mpi.ops.distribute_frame(
+                data=X, owner_rank=rank, world_index=frame_idx)
+            medoid_coords.append(new_center)
+    else:
+        medoid_coords = [X[i] for i in medoid_inds]
+
+    return medoid_coords
+
+
 def _kmedoids_pam_update(
         X, metric, medoid_inds, assignments, distances, proposals=None,
         cost=_msq, random_state=None):
@@ -595,16 +697,7 @@ def _kmedoids_pam_update(
     # this list will be updated as we go; this is primarily because we want
     # to limit the amount of communication that happens when we're running
     # MPI mode.
-    medoid_coords = []
-    if hasattr(medoid_inds[0], '__len__'):
-        assert len(medoid_inds[0]) == 2
-        for center_idx, (rank, frame_idx) in enumerate(medoid_inds):
-            assert rank < mpi.size()
-            new_center = mpi.ops.distribute_frame(
-                data=X, owner_rank=rank, world_index=frame_idx)
-            medoid_coords.append(new_center)
-    else:
-        medoid_coords = [X[i] for i in medoid_inds]
+    medoid_coords = _medoid_coords(X, medoid_inds)
 
     acceptances = 0
     for cid in range(len(medoid_inds)):
@@ -634,7 +727,8 @@ def _kmedoids_pam_update(
         # the distance from this center to every point. Depending on if
         # the distance goes up or down, and which old center it was
         # assigned to (this or other), we update distances and assignents.
-        new_ctr_dist = metric(X, proposed_center)
+        new_ctr_dist = util._distances_at(
+            metric, X, proposed_center, distances.dtype)
 
         new_dist = np.zeros_like(distances) - 1
         new_assig = np.zeros_like(assignments) - 1
@@ -697,3 +791,326 @@ def _kmedoids_pam_update(
                 min(old_cost, new_cost), acceptances / len(medoid_inds) * 100)
 
     return medoid_inds, distances, assignments, medoid_coords
+
+
+def _nearest_two(X, medoid_coords, metric, distance_dtype=np.float64):
+    """Find the nearest and second-nearest medoid to each frame of `X`,
+    with distances stored as `distance_dtype`.
+
+    Returns
+    -------
+    assignments : ndarray, shape=(X.shape[0],)
+        Index of the nearest medoid to each frame.
+    distances : ndarray, shape=(X.shape[0],)
+        Distance from each frame to its nearest medoid.
+    second_assignments : ndarray, shape=(X.shape[0],)
+        Index of the second-nearest medoid to each frame, or -1 if
+        there is only one medoid.
+    second_distances : ndarray, shape=(X.shape[0],)
+        Distance from each frame to its second-nearest medoid (or inf).
+    """
+
+    d1 = np.full(len(X), np.inf, dtype=distance_dtype)
+    d2 = np.full(len(X), np.inf, dtype=distance_dtype)
+    a1 = np.full(len(X), -1, dtype=int)
+    a2 = np.full(len(X), -1, dtype=int)
+
+    for i, medoid in enumerate(medoid_coords):
+        d = util._distances_at(metric, X, medoid, distance_dtype)
+
+        closer = d < d1
+        second = ~closer & (d < d2)
+
+        d2[closer], a2[closer] = d1[closer], a1[closer]
+        d1[closer], a1[closer] = d[closer], i
+        d2[second], a2[second] = d[second], i
+
+    return a1, d1, a2, d2
+
+
+def _propose_new_centers(X, assignments, n_clusters, mpi_mode,
+                         random_state):
+    """Propose one new center per cluster, drawn uniformly from its
+    members (across all nodes, in MPI mode).
+
+    Unlike calling `_propose_new_center_amongst` for each cluster, the
+    choices are made with a single gather and broadcast.
+
+    Returns
+    -------
+    proposals : list
+        For each cluster, a tuple of (center coordinates, center index),
+        or None if the cluster is empty. Indices are (rank, local index)
+        pairs in MPI mode.
+    """
+
+    counts = np.bincount(assignments, minlength=n_clusters)
+    members = np.argsort(assignments, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    if not mpi_mode:
+        proposals = []
+        for cid in range(n_clusters):
+            if counts[cid] == 0:
+                proposals.append(None)
+            else:
+                idx = members[starts[cid] + random_state.randint(counts[cid])]
+                proposals.append((X[idx], idx))
+        return proposals
+
+    all_counts = np.array(mpi.comm.allgather(counts))
+
+    if mpi.rank() == 0:
+        picks = []
+        for cid in range(n_clusters):
+            rank_counts = all_counts[:, cid]
+            if rank_counts.sum() == 0:
+                picks.append(None)
+                continue
+            u = random_state.randint(rank_counts.sum())
+            r = np.searchsorted(np.cumsum(rank_counts), u, side='right')
+            picks.append((r, u - rank_counts[:r].sum()))
+    else:
+        picks = None
+    picks = mpi.comm.bcast(picks, root=0)
+
+    # each node translates the picks it owns into local frame indices
+    local_inds = {cid: members[starts[cid] + pos]
+                  for cid, pick in enumerate(picks)
+                  if pick is not None and pick[0] == mpi.rank()
+                  for pos in [pick[1]]}
+    owned = {}
+    for d in mpi.comm.allgather(local_inds):
+        owned.update(d)
+
+    proposals = []
+    for cid, pick in enumerate(picks):
+        if pick is None:
+            proposals.append(None)
+            continue
+        rank, idx = pick[0], int(owned[cid])
+        center = mpi.ops.distribute_frame(
+            data=X, owner_rank=rank, world_index=idx)
+        proposals.append((center, (rank, idx)))
+
+    return proposals
+
+
+def _pair_keys(a, b, n_clusters):
+    """Encode unordered pairs of distinct cluster ids as integers."""
+
+    a, b = np.broadcast_arrays(np.asarray(a), np.asarray(b))
+    distinct = a != b
+    lo = np.minimum(a, b)[distinct]
+    hi = np.maximum(a, b)[distinct]
+    return lo.astype(np.int64) * n_clusters + hi
+
+
+def _kmedoids_batch_update(
+        X, metric, medoid_inds, medoid_coords, assignments, distances,
+        second_assignments, second_distances, proposals=None,
+        random_state=None):
+    """Compute a kmedoids update that evaluates one swap proposal per
+    cluster in a single blocked pass over `X`.
+
+    Like FastPAM, this keeps each frame's nearest and second-nearest
+    medoid, so that the change in the sum of squared distances for
+    swapping medoid j for its proposal can be computed exactly for all
+    j at once. A frame is touched by the swap of its own medoid; by any
+    other proposal nearer to it than both its current distance and the
+    distance its own medoid's swap would leave it at; and, if its own
+    medoid's swap would leave it with its second-nearest medoid, by
+    that medoid's swap. Two swaps conflict if they touch a common
+    frame. When no frame is touched by two accepted swaps, each frame
+    ends up where its one touching swap would put it, so the change in
+    cost is exactly the sum of the individual changes. Improving swaps
+    are accepted greedily, best first, unless they conflict with an
+    already-accepted swap, so a sweep never increases the cost (up to
+    rounding).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_observations, n_features, *)
+        Data to cluster. The user is responsible for pre-partitioning
+        this data across nodes.
+    metric : callable
+        Function that takes a parameter like `X` and a single frame
+        of `X` (_i.e._ X.shape[1:]).
+    medoid_inds : list, [(rank, index), ...] if MPI or [index, ...]
+        A list of the locations of center indices in terms of the rank
+        of the node that owns them and the index within that world.
+    medoid_coords : list
+        The coordinates of each medoid.
+    assignments, distances : ndarray, shape=(X.shape[0],)
+        Nearest medoid to each frame, and the distance to it.
+    second_assignments, second_distances : ndarray, shape=(X.shape[0],)
+        Second-nearest medoid to each frame, and the distance to it.
+    proposals : array-like, default=None
+        If specified, this list is a list of indices to propose as a
+        center (rather than choosing randomly).
+    random_state : numpy.RandomState
+        RandomState object used to indentify new centers.
+
+    Returns
+    -------
+    medoid_inds : list
+        Updated medoid locations.
+    distances, assignments : ndarray, shape=(X.shape[0],)
+        Updated distance to and index of each frame's nearest medoid.
+    second_distances, second_assignments : ndarray, shape=(X.shape[0],)
+        Updated distance to and index of each frame's second-nearest
+        medoid.
+    medoid_coords : list
+        Updated medoid coordinates.
+    """
+
+    assert np.issubdtype(type(assignments[0]), np.integer)
+    assert len(assignments) == len(X)
+    assert len(distances) == len(X)
+
+    random_state = check_random_state(random_state)
+    mpi_mode = hasattr(medoid_inds[0], '__len__')
+    n_clusters = len(medoid_inds)
+
+    a1, d1, a2, d2 = assignments, distances, second_assignments, \
+        second_distances
+
+    if proposals is None:
+        candidates = _propose_new_centers(
+            X, a1, n_clusters, mpi_mode, random_state)
+    else:
+        if len(proposals) != n_clusters:
+            raise exception.DataInvalid(
+                "Length of 'proposals' didn't match length of 'medoid_inds' "
+                "({} != {}).".format(len(proposals), n_clusters))
+        candidates = [(c, i) for c, i in zip(
+            _medoid_coords(X, proposals), proposals)]
+
+    # one pass over X: exact gain of each swap, the frames each proposal
+    # brings within their second-nearest distance, and the distance each
+    # frame's own proposal would put it at.
+    gains = np.zeros(n_clusters)
+    rec_x, rec_j, rec_d = [], [], []
+    own_dp = np.full(len(X), np.inf)
+    dist = np.empty(len(X), dtype=d1.dtype)
+
+    with timed("Evaluated %s proposals in %%.2f sec." % n_clusters,
+               logger.debug):
+        for block in util._frame_blocks(X):
+            a1b, d1b, d2b = a1[block], d1[block], d2[block]
+            sq1 = np.square(d1b, dtype=np.float64)
+
+            for cid, candidate in enumerate(candidates):
+                if candidate is None:
+                    continue
+
+                util._distances_to_subset(
+                    metric, X, candidate[0], block, out=dist)
+                dp = dist[block]
+
+                own = (a1b == cid)
+                new = np.where(own, np.minimum(dp, d2b), np.minimum(dp, d1b))
+                gains[cid] += np.sum(np.square(new, dtype=np.float64) - sq1)
+                own_dp[block][own] = dp[own]
+
+                near = np.flatnonzero(dp < d2b)
+                rec_x.append(near + block.start)
+                rec_j.append(np.full(len(near), cid))
+                rec_d.append(dp[near])
+
+    rec_x = np.concatenate(rec_x).astype(int)
+    rec_j = np.concatenate(rec_j).astype(int)
+    rec_d = np.concatenate(rec_d)
+
+    # the swaps touching each frame (see above); any two touching the
+    # same frame conflict.
+    proposed = np.array([c is not None for c in candidates])
+    own_new = np.where(proposed[a1], np.minimum(own_dp, d2), d1)
+    reach = np.maximum(d1, own_new)
+    falls_back = proposed[a1] & (own_dp >= d2) & (a2 >= 0)
+    falls_back &= proposed[np.maximum(a2, 0)]
+
+    idx = np.arange(len(X))
+    by_near = (rec_j != a1[rec_x]) & (rec_d < reach[rec_x])
+    tx = np.concatenate(
+        [idx[proposed[a1]], rec_x[by_near], idx[falls_back]])
+    tj = np.concatenate(
+        [a1[proposed[a1]], rec_j[by_near], a2[falls_back]])
+
+    order = np.lexsort((tj, tx))
+    tx, tj = tx[order], tj[order]
+    pairs = [np.zeros(0, dtype=np.int64)]
+    for offset in range(1, len(tx)):
+        same = tx[:-offset] == tx[offset:]
+        if not np.any(same):
+            break
+        pairs.append(_pair_keys(
+            tj[:-offset][same], tj[offset:][same], n_clusters))
+
+    pairs = np.unique(np.concatenate(pairs).astype(np.int64))
+
+    if mpi_mode:
+        global_gains = np.empty_like(gains)
+        mpi.comm.Allreduce(gains, global_gains, op=mpi.mpi4py.SUM)
+        gains = global_gains
+        pairs = np.unique(np.concatenate(mpi.comm.allgather(pairs)))
+
+    conflicts = scipy.sparse.coo_matrix(
+        (np.ones(len(pairs), dtype=bool),
+         (pairs // n_clusters, pairs % n_clusters)),
+        shape=(n_clusters, n_clusters))
+    conflicts = (conflicts + conflicts.T).tocsr()
+
+    accepted = np.zeros(n_clusters, dtype=bool)
+    for cid in np.argsort(gains, kind='stable'):
+        if gains[cid] >= 0:
+            break
+        nbrs = conflicts.indices[conflicts.indptr[cid]:conflicts.indptr[cid+1]]
+        if not np.any(accepted[nbrs]):
+            accepted[cid] = True
+
+    medoid_inds = list(medoid_inds)
+    medoid_coords = list(medoid_coords)
+    for cid in np.flatnonzero(accepted):
+        medoid_coords[cid], medoid_inds[cid] = candidates[cid]
+
+    # new nearest and second-nearest medoids. Every candidate below is
+    # within the old second-nearest distance, and every medoid we don't
+    # know about is at least that far, so two candidates settle it.
+    keep1 = ~accepted[a1]
+    keep2 = (a2 >= 0) & ~accepted[np.maximum(a2, 0)]
+    keep_rec = accepted[rec_j]
+
+    px = np.concatenate([idx[keep1], idx[keep2], rec_x[keep_rec]])
+    pd = np.concatenate([d1[keep1], d2[keep2], rec_d[keep_rec]])
+    pl = np.concatenate([a1[keep1], a2[keep2], rec_j[keep_rec]])
+
+    order = np.lexsort((pd, px))
+    px, pd, pl = px[order], pd[order], pl[order]
+    uniq, first, counts = np.unique(px, return_index=True, return_counts=True)
+    has2 = counts >= 2
+
+    new_a1, new_d1 = a1.copy(), d1.copy()
+    new_a2, new_d2 = a2.copy(), d2.copy()
+    new_a1[uniq[has2]] = pl[first[has2]]
+    new_d1[uniq[has2]] = pd[first[has2]]
+    new_a2[uniq[has2]] = pl[first[has2] + 1]
+    new_d2[uniq[has2]] = pd[first[has2] + 1]
+
+    settled = np.zeros(len(X), dtype=bool)
+    settled[uniq[has2]] = True
+
+    unsettled = np.flatnonzero(~settled)
+    with timed("Recomputed nearest medoids for %s points in %%.2f sec." %
+               len(unsettled), logger.debug):
+        if len(unsettled) > 0:
+            r_a1, r_d1, r_a2, r_d2 = _nearest_two(
+                X[unsettled], medoid_coords, metric, d1.dtype)
+            new_a1[unsettled], new_d1[unsettled] = r_a1, r_d1
+            new_a2[unsettled], new_d2[unsettled] = r_a2, r_d2
+
+    new_cost = _msq(new_d1)
+    logger.info("Kmedoid sweep reduced cost to %.7f (%.2f%% acceptance)",
+                new_cost, np.count_nonzero(accepted) / n_clusters * 100)
+
+    return medoid_inds, new_d1, new_a1, new_d2, new_a2, medoid_coords
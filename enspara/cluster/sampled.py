@@ -0,0 +1,223 @@
+import time
+import logging
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, ClusterMixin
+
+from . import kcenters
+from . import kmedoids
+from . import util
+
+from ..util.log import timed
+from ..exception import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+# size of the chunks of X read at once during the final assignment pass
+_ASSIGN_CHUNK_BYTES = 2**28
+
+
+class SampledKMedoids(BaseEstimator, ClusterMixin,
+                      util.MolecularClusterMixin):
+    """Sklearn-style object for sampled (CLARA-style) kmedoids
+    clustering.
+
+    Rather than holding every frame in memory while refining medoids,
+    medoids are refined on a series of rotating subsamples of the data
+    and every frame is assigned to its nearest medoid only once, at the
+    end. `X` need only support `len` and indexing, so it can be a
+    memory-mapped array (e.g. from `np.load(..., mmap_mode='r')`) or an
+    on-disk pytables array.
+
+    Parameters
+    ----------
+    metric : required
+        Distance metric used while comparing data points.
+    n_clusters : int
+        The number of medoids to find.
+    sample_size : int, default=None
+        Approximate number of frames in each subsample. Defaults to
+        100 frames per cluster.
+    n_samples : int, default=5
+        Number of subsamples to refine the medoids on.
+    n_iters : int, default=5
+        Number of kmedoids updates to run on each subsample.
+    batch_updates : bool, default=True
+        Use the single-pass batched kmedoids update on each subsample.
+    random_state : int, default=None
+        Random state to fix RNG with.
+
+    References
+    ----------
+    .. [1] Kaufman, L. & Rousseeuw, P. J. Clustering Large Applications
+       (Program CLARA). in Finding Groups in Data 126–163 (1990).
+    """
+
+    def __init__(
+            self, metric, n_clusters, sample_size=None, n_samples=5,
+            n_iters=5, batch_updates=True, random_state=None):
+
+        self.metric = util._get_distance_method(metric)
+        self.n_clusters = n_clusters
+        self.sample_size = sample_size
+        self.n_samples = n_samples
+        self.n_iters = n_iters
+        self.batch_updates = batch_updates
+        self.random_state = random_state
+
+    def fit(self, X, init_medoids=None):
+        """Takes trajectories, X, and performs sampled KMedoids
+        clustering.
+
+        Parameters
+        ----------
+        X : array-like, shape=(n_observations, n_features(, n_atoms))
+            Data to cluster. Only subsamples and chunks of `X` are read
+            into memory at any one time.
+        init_medoids : array-like, shape=(n_clusters,), default=None
+            Indices in `X` of medoids to start refining from. If None,
+            they are found with k-centers on the first subsample.
+        """
+
+        t0 = time.perf_counter()
+
+        self.result_ = sampled_kmedoids(
+            X,
+            distance_method=self.metric,
+            n_clusters=self.n_clusters,
+            sample_size=self.sample_size,
+            n_samples=self.n_samples,
+            n_iters=self.n_iters,
+            init_medoids=init_medoids,
+            batch_updates=self.batch_updates,
+            random_state=self.random_state)
+
+        self.runtime_ = time.perf_counter() - t0
+        return self
+
+
+def sampled_kmedoids(
+        X, distance_method, n_clusters, sample_size=None, n_samples=5,
+        n_iters=5, init_medoids=None, batch_updates=True, random_state=None):
+    """Sampled (CLARA-style) kmedoids clustering.
+
+    The data are split into `stride` = len(X) / `sample_size` disjoint
+    strided subsamples, X[offset::stride], and `n_samples` of them are
+    visited in a random order. The current medoids are added to each
+    subsample, so kmedoids refinement on it starts from (and can only
+    improve on) the medoids found so far. Finally, every frame of `X`
+    is assigned to its nearest medoid, one chunk at a time.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_observations, n_features, ``*``)
+        Data to cluster. Must support `len`, slicing and indexing with
+        a sorted array of indices; only subsamples and chunks of it are
+        read into memory.
+    distance_method : callable
+        Function that takes a parameter like `X` and a single frame
+        of `X` (_i.e._ X.shape[1:]).
+    n_clusters : int
+        Number of medoids to find.
+    sample_size : int, default=None
+        Approximate number of frames in each subsample. Defaults to 100
+        frames per cluster.
+    n_samples : int, default=5
+        Number of subsamples to refine medoids on. At most `stride`
+        subsamples are distinct.
+    n_iters : int, default=5
+        Number of kmedoids updates to run on each subsample.
+    init_medoids : array-like, default=None
+        Indices in `X` of initial medoids. If None, they are found with
+        k-centers on the first subsample.
+    batch_updates : bool, default=True
+        Use the single-pass batched kmedoids update on each subsample.
+    random_state : int, default=None
+        Random state to fix RNG with.
+
+    Returns
+    -------
+    result : ClusterResult
+        Subclass of NamedTuple containing assignments, distances,
+        center indices (into `X`) and center coordinates.
+    """
+
+    distance_method = util._get_distance_method(distance_method)
+    rng = np.random.default_rng(seed=random_state)
+
+    n_frames = len(X)
+    if sample_size is None:
+        sample_size = 100 * n_clusters
+    if n_clusters > min(sample_size, n_frames):
+        raise ImproperlyConfigured(
+            "Sampled kmedoids requires sample_size (%s) and the number of "
+            "frames (%s) to be at least n_clusters (%s)." %
+            (sample_size, n_frames, n_clusters))
+
+    stride = max(1, int(np.ceil(n_frames / sample_size)))
+    offsets = rng.permutation(stride)
+    offsets = offsets[np.arange(n_samples) % stride]
+
+    medoids = None if init_medoids is None else \
+        np.asarray(init_medoids, dtype=int)
+
+    for i, offset in enumerate(offsets):
+        sample_inds = np.arange(offset, n_frames, stride)
+        if medoids is not None:
+            sample_inds = np.union1d(sample_inds, medoids)
+
+        with timed("Loaded subsample of %s frames in %%.2f sec." %
+                   len(sample_inds), logger.info):
+            sample = X[sample_inds]
+
+        if medoids is None:
+            result = kcenters.kcenters(
+                sample, distance_method, n_clusters=n_clusters)
+            local_medoids = list(result.center_indices)
+        else:
+            local_medoids = list(np.searchsorted(sample_inds, medoids))
+
+        assignments, distances, local_medoids = kmedoids._kmedoids_inputs_tree(
+            sample, distance_method, n_clusters, None, None, local_medoids,
+            None)
+        start_cost = kmedoids._msq(distances)
+
+        result = kmedoids._kmedoids_iterations(
+            sample, distance_method, n_iters, local_medoids, assignments,
+            distances, random_state=int(rng.integers(2**31)),
+            batch_updates=batch_updates)
+
+        medoids = sample_inds[np.asarray(result.center_indices, dtype=int)]
+
+        logger.info(
+            "Subsample %s/%s (offset %s of %s) reduced cost %.7f -> %.7f.",
+            i + 1, len(offsets), offset, stride, start_cost,
+            kmedoids._msq(result.distances))
+
+    medoid_coords = list(X[medoids])
+
+    with timed("Assigned all frames to medoids in %.2f sec.", logger.info):
+        assignments, distances = _assign_in_chunks(
+            X, medoid_coords, distance_method)
+
+    return util.ClusterResult(
+        center_indices=medoids,
+        assignments=assignments,
+        distances=distances,
+        centers=medoid_coords)
+
+
+def _assign_in_chunks(X, centers, distance_method):
+    """Assign every frame of `X` to its nearest center, reading `X` into
+    memory one chunk at a time.
+    """
+
+    assignments = np.zeros(len(X), dtype=int)
+    distances = np.empty(len(X), dtype=float)
+
+    for chunk in util._frame_blocks(X, _ASSIGN_CHUNK_BYTES):
+        assignments[chunk], distances[chunk] = util.assign_to_nearest_center(
+            X[chunk], centers, distance_method)
+
+    return assignments, distances
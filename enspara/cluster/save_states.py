@@ -9,6 +9,8 @@ import time
 import subprocess as sp
 from multiprocessing import Pool
 
+from .util import _load_frames_from_file
+
 
 def _save_states(centers_info):
     states = centers_info['state']
@@ -17,11 +19,16 @@ def _save_states(centers_info):
     traj_filename = centers_info['trj_filename'][0]
     output_directory = centers_info['output'][0]
     topology = centers_info['topology'][0]
-    traj = md.load(traj_filename, top=topology)
+
+    # read only the needed frames, each once and in order
+    frame_ids = np.unique(frames)
+    loaded = _load_frames_from_file(
+        traj_filename, [int(f) for f in frame_ids], {'top': topology})
+
     for num in range(len(states)):
         pdb_filename = "{dir}State{state}-{conf}.pdb".format(
             dir=output_directory, state=states[num], conf=confs[num])
-        center = traj[frames[num]]
+        center = loaded[np.searchsorted(frame_ids, frames[num])]
         center.save_pdb(pdb_filename)
 
 
@@ -64,10 +71,17 @@ def save_states(
     reduced_iis = np.where((distances>-0.1)*(distances < largest_center))
     reduced_assignments = assignments[reduced_iis]
     reduced_distances = distances[reduced_iis]
+
+    # group the conformations by state (in order of distance) in one
+    # pass, rather than searching the assignments for each state
+    by_state = np.lexsort((reduced_distances, reduced_assignments))
+    sorted_assignments = reduced_assignments[by_state]
+    state_starts = np.searchsorted(sorted_assignments, state_nums, 'left')
+    state_ends = np.searchsorted(sorted_assignments, state_nums, 'right')
+
     centers_location = []
-    for state in state_nums:
-        state_iis = np.where(reduced_assignments == state)
-        nconfs_in_state = len(state_iis[0])
+    for state, start, end in zip(state_nums, state_starts, state_ends):
+        nconfs_in_state = end - start
         if nconfs_in_state >= n_confs:
             center_picks = np.array([0])
             if n_confs > 1:
@@ -79,10 +93,10 @@ def save_states(
             center_picks = np.array([0])
             center_picks = np.append(
                 center_picks, np.random.choice(nconfs_in_state, n_confs - 1))
-        state_centers = np.argsort(reduced_distances[state_iis])[center_picks]
+        state_centers = by_state[start:end][center_picks]
         # Obtain information on conformation locations within trajectories
-        traj_locations = reduced_iis[0][state_iis[0][state_centers]]
-        frame_nums = reduced_iis[1][state_iis[0][state_centers]]
+        traj_locations = reduced_iis[0][state_centers]
+        frame_nums = reduced_iis[1][state_centers]
         for conf_num in range(n_confs):
             traj_num = traj_locations[conf_num]
             centers_location.append(
@@ -104,11 +118,10 @@ def save_states(
                 ('frame', 'int'), ('trj_filename', np.str_, 500),
                 ('output', np.str_, 500),
                 ('topology', type(topology))])
-    unique_trajs = np.unique(centers_location['traj_num'])
-    partitioned_centers_info = []
-    for traj in unique_trajs:
-        partitioned_centers_info.append(
-            centers_location[np.where(centers_location['traj_num'] == traj)])
+    centers_location = centers_location[
+        np.argsort(centers_location['traj_num'], kind='stable')]
+    traj_starts = np.flatnonzero(np.diff(centers_location['traj_num'])) + 1
+    partitioned_centers_info = np.split(centers_location, traj_starts)
 
     logging.debug("  Saving states!")
 
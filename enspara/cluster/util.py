@@ -8,6 +8,7 @@
 # Proprietary and confidential
 
 import logging
+import multiprocessing as mp
 from collections import namedtuple
 from glob import glob
 import os
@@ -16,21 +17,24 @@ from enspara.util.log import timed
 from enspara.util.parallel import auto_nprocs
 from enspara import mpi
 import itertools
+import queue
+import socket
+import threading
 import pickle
 import time
-from joblib import Parallel, delayed
 import psutil
-from functools import partial
 import resource
 
 
 import mdtraj as md
 import numpy as np
 
+from ..geometry import libdist
 from ..geometry.libdist import euclidean, manhattan
 
 from enspara.util.load import (concatenate_trjs, sound_trajectory,
-                               load_as_concatenated)
+                               sound_trajectories, load_as_concatenated,
+                               load_cached_as_concatenated)
 
 from  enspara.exception import ImproperlyConfigured, DataInvalid
 from ..ra.ra import partition_list, partition_indices
@@ -48,7 +52,7 @@ class MolecularClusterMixin:
     trajectories.
     """
 
-    def predict(self, X):
+    def predict(self, X, index=None):
         """Use an existing clustring fit to predict the assignments,
         distances, and center indices of on new data.new
 
@@ -58,6 +62,9 @@ class MolecularClusterMixin:
         ----------
         X : array-like, shape=(n_states, n_features)
             New data to predict.
+        index : VPTree, default=None
+            Index over `centers_` used to find the nearest centers
+            without comparing every frame to every center.
 
         Returns
         -------
@@ -74,7 +81,8 @@ class MolecularClusterMixin:
         pred_assigs, pred_dists = assign_to_nearest_center(
             trajectory=X,
             cluster_centers=self.centers_,
-            distance_method=self.metric)
+            distance_method=self.metric,
+            index=index)
         pred_centers = find_cluster_centers(pred_assigs, pred_dists)
 
         result = ClusterResult(
@@ -156,7 +164,8 @@ class ClusterResult(namedtuple('ClusterResult',
                 centers=self.centers)
 
 
-def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
+def assign_to_nearest_center(trajectory, cluster_centers, distance_method,
+                             index=None):
     """Assign each frame from trajectory to one of the given cluster centers
     using the given distance metric.
 
@@ -172,6 +181,11 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
         The distance method to use for assigning each observation in
         trajectorys to one of the cluster_centers. Must take the entire
         trajectory and one item from cluster_centers as parameters.
+    index : VPTree, default=None
+        A metric tree over `cluster_centers` (see
+        enspara.cluster.vptree). If given, it is queried for the nearest
+        center to each frame, which avoids comparing each frame to every
+        center when there are many centers.
 
     Returns
     ----------
@@ -183,6 +197,20 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
         frame in cluster_centers.
     """
 
+    if index is not None:
+        if len(index) != len(cluster_centers):
+            raise DataInvalid(
+                "Index over %s centers can't be used to assign to %s "
+                "centers." % (len(index), len(cluster_centers)))
+        return index.query(trajectory)
+
+    kernel_metric = _nearest_center_kernel(trajectory, distance_method)
+    if kernel_metric is not None and \
+            np.asarray(cluster_centers).dtype == trajectory.dtype:
+        assignments, distances = libdist.nearest_center(
+            trajectory, np.asarray(cluster_centers), kernel_metric)
+        return assignments.astype(int, copy=False), distances
+
     assignments = np.zeros(len(trajectory), dtype=int)
     distances = np.empty(len(trajectory), dtype=float)
     distances.fill(np.inf)
@@ -205,6 +233,27 @@ def assign_to_nearest_center(trajectory, cluster_centers, distance_method):
     return assignments, distances
 
 
+def _nearest_center_kernel(trajectory, distance_method):
+    """Name of the libdist.nearest_center metric that computes
+    `distance_method` on `trajectory`, or None if there is none.
+    """
+
+    metric = {euclidean: 'euclidean', manhattan: 'manhattan',
+              libdist.hamming: 'hamming'}.get(distance_method)
+
+    if metric is None or not isinstance(trajectory, np.ndarray) or \
+            len(trajectory.shape) != 2:
+        return None
+
+    # the dtypes accepted by the corresponding libdist kernels
+    kinds = 'iu' if metric == 'hamming' else 'if'
+    if trajectory.dtype.kind not in kinds or \
+            trajectory.dtype == np.float16:
+        return None
+
+    return metric
+
+
 def find_cluster_centers(assignments, distances):
     """Given a list of distances and assignments, find the
     lowest-distance frame to each label in assignments.
@@ -230,19 +279,73 @@ def find_cluster_centers(assignments, distances):
             "Length of distances (%s) must match length of assignments "
             "(%s)." % (len(distances), len(assignments)))
 
-    unique_centers = np.unique(assignments)
-    center_inds = np.zeros_like(unique_centers)
+    assignments = np.asarray(assignments)
+    distances = np.asarray(distances)
+
+    # sort by label, then distance; the sort is stable, so the first
+    # frame of each label is its nearest, with ties going to the lowest
+    # frame index (as np.argmin would).
+    order = np.lexsort((distances, assignments))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = assignments[order[1:]] != assignments[order[:-1]]
+
+    return order[first].astype(assignments.dtype, copy=False)
+
+
+def find_cluster_centers_mpi(assignments, distances):
+    """Given the assignments and distances on each MPI rank, find the
+    lowest-distance frame to each label across all ranks.
+
+    Each rank finds the nearest of its frames to each label, and only
+    these per-rank minima are exchanged. This function must be called
+    on all ranks.
+
+    Parameters
+    ----------
+    assignments : array-like, shape=(n_frames,)
+        The assignment of each observation on this rank to a cluster.
+    distances: array-like, shape=(n_frames,)
+        The distance of each observation on this rank to the cluster
+        center.
+
+    Returns
+    ----------
+    cluster_center_inds : list, [(rank, index), ...]
+        For each label (in order of label), the rank holding the
+        nearest frame to it and the index of that frame on that rank.
+        Ties go to the lowest rank.
+    """
+
+    assignments = np.asarray(assignments)
+    distances = np.asarray(distances)
+
+    local_inds = find_cluster_centers(assignments, distances)
+    local_minima = (assignments[local_inds], distances[local_inds],
+                    local_inds)
+
+    labels, dists, ranks, inds = [], [], [], []
+    for rank, (l, d, i) in enumerate(mpi.comm.allgather(local_minima)):
+        labels.append(l)
+        dists.append(d)
+        ranks.append(np.full(len(l), rank, dtype=int))
+        inds.append(i)
 
-    for i, c in enumerate(unique_centers):
-        assigned_frames = np.where(assignments == c)[0]
-        ind = assigned_frames[np.argmin(distances[assigned_frames])]
+    labels = np.concatenate(labels)
+    dists = np.concatenate(dists)
+    ranks = np.concatenate(ranks)
+    inds = np.concatenate(inds)
 
-        center_inds[i] = ind
+    # ranks were concatenated in order, so the stable sort leaves ties
+    # to the lowest rank
+    order = np.lexsort((dists, labels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order[1:]] != labels[order[:-1]]
 
-    return center_inds
+    return [(int(r), int(i))
+            for r, i in zip(ranks[order[first]], inds[order[first]])]
 
 
-def load_frames(filenames, indices, **kwargs):
+def load_frames(filenames, indices, processes=1, **kwargs):
     """Load specific frame indices from a list of trajectory files.
 
     Given a list of trajectory file names (`filenames`) and tuples
@@ -250,6 +353,9 @@ def load_frames(filenames, indices, **kwargs):
     given frames into a list of md.Trajectory objects. All additional
     kwargs are passed on to md.load_frame.
 
+    Each file is opened only once, and its frames are read in order by
+    seeking; different files can be read in parallel.
+
     Parameters
     ----------
     indices: list, shape=(n_frames, 2)
@@ -258,6 +364,10 @@ def load_frames(filenames, indices, **kwargs):
     filenames: list, shape=(n_files)
         List of files to load frames from. The first position in indices
         is taken to refer to a position in this list.
+    processes : int, default=1
+        Number of processes to read files with. None means one per
+        core. This forks, so don't use more than one from a thread (e.g.
+        an IntermediateWriter's) or an MPI rank.
     stride: int
         Treat the indices as having been computed using a stride, so
         mulitply the second index (frame number) by this number (e.g.
@@ -273,22 +383,220 @@ def load_frames(filenames, indices, **kwargs):
     if stride is None:
         stride = 1
 
-    centers = []
+    indices = [(int(i), int(j) * stride) for i, j in indices]
+
+    file_frames = {}
     for i, j in indices:
-        try:
-            c = md.load_frame(filenames[i], index=j*stride, **kwargs)
-        except ValueError:
-            raise ImproperlyConfigured(
-                'Failed to load frame {fr} of {fn} using args {kw}.'.format(
-                    fn=filenames[i], fr=j*stride, kw=kwargs))
-        centers.append(c)
+        file_frames.setdefault(i, set()).add(j)
+    file_ids = sorted(file_frames)
+
+    jobs = [(filenames[i], sorted(file_frames[i]), kwargs) for i in file_ids]
+    if len(jobs) > 1 and processes != 1:
+        # only fork when asked to; see `processes` above.
+        with mp.Pool(processes=min(len(jobs), processes or auto_nprocs())) \
+                as pool:
+            loaded = pool.starmap(_load_frames_from_file, jobs)
+    else:
+        loaded = [_load_frames_from_file(*job) for job in jobs]
+
+    frames = {}
+    for i, (_, file_frame_ids, _), trjs in zip(file_ids, jobs, loaded):
+        frames.update(((i, j), t) for j, t in zip(file_frame_ids, trjs))
+
+    return [frames[i, j] for i, j in indices]
+
+
+def _load_frames_from_file(filename, frame_ids, kwargs):
+    """Load frames `frame_ids` (in ascending order) from a trajectory
+    file, opening it once. Formats that can't seek (e.g. pdb), or other
+    md.load_frame kwargs, fall back to md.load_frame.
+    """
+
+    try:
+        with md.open(filename) as f:
+            if hasattr(f, 'read_as_traj') and hasattr(f, 'seek') and \
+                    set(kwargs) <= {'top', 'atom_indices'}:
+                # HDF5 files carry their own topology; others need one.
+                read_args = []
+                if not isinstance(f, md.formats.HDF5TrajectoryFile):
+                    read_args.append(_as_topology(kwargs.get('top')))
+
+                frames = []
+                for j in frame_ids:
+                    f.seek(j)
+                    trj = f.read_as_traj(
+                        *read_args, n_frames=1,
+                        atom_indices=kwargs.get('atom_indices'))
+                    if len(trj) != 1:
+                        raise ValueError("Frame %s is out of range." % j)
+                    frames.append(trj)
+                return frames
+
+        return [md.load_frame(filename, index=j, **kwargs)
+                for j in frame_ids]
+    except (ValueError, OSError):
+        raise ImproperlyConfigured(
+            'Failed to load frames {fr} of {fn} using args {kw}.'.format(
+                fn=filename, fr=frame_ids, kw=kwargs))
+
+
+def _as_topology(top):
+    """Get an md.Topology from a topology, a trajectory or a path to a
+    topology file, as md.load_frame's `top` argument can be given.
+    """
+
+    if isinstance(top, md.Topology):
+        return top
+    elif isinstance(top, md.Trajectory):
+        return top.topology
+    elif top is None:
+        raise ValueError("A topology is required to read this file.")
+    else:
+        return md.load_topology(top)
+
+
+def _precenter(trj):
+    """Center `trj` in place and cache double-precision RMSD traces on
+    it (as `_rmsd_traces`, the attribute md.rmsd(precentered=True)
+    uses), unless this has already been done.
+
+    The coordinate array that was centered is recorded as
+    `_precentered_xyz`, so that a trajectory whose coordinates were
+    replaced (or a new trajectory sharing only its traces, as integer
+    indexing of an md.Trajectory produces) is centered again.
+    """
+
+    if getattr(trj, '_precentered_xyz', None) is not trj._xyz:
+        trj.center_coordinates()
+        trj._rmsd_traces = libdist.rmsd_traces(trj.xyz)
+        trj._precentered_xyz = trj._xyz
+
+    return trj._rmsd_traces
+
+
+def _mark_precentered(trj):
+    """Record that the coordinates of `trj` are already centered (as
+    they are when loaded from a coordinate store), caching their RMSD
+    traces without modifying them.
+    """
+
+    trj._rmsd_traces = libdist.rmsd_traces(trj.xyz)
+    trj._precentered_xyz = trj._xyz
+
+    return trj._rmsd_traces
+
+
+def rmsd(target, reference, indices=None, out=None):
+    """Compute the RMSD between each frame of `target` and the first
+    frame of `reference` using libdist's OpenMP-parallel QCP kernel.
+
+    Like md.rmsd, this centers both trajectories in place. The RMSD
+    traces are cached on each trajectory, so that repeated calls against
+    the same `target` (as in clustering) don't recompute them.
+
+    Parameters
+    ----------
+    target : md.Trajectory
+        Frames to compute the RMSD of.
+    reference : md.Trajectory
+        Trajectory whose first frame is the reference conformation.
+    indices : array, default=None
+        A boolean mask or integer array selecting frames of `target`.
+        If given, only these RMSDs are computed and written into `out`
+        at their position in `target`, without copying coordinates.
+    out : array, shape=(n_frames,), default=None
+        Array of np.float64 to write the RMSDs into.
+
+    Returns
+    -------
+    out : array, shape=(n_frames,)
+        The RMSD of each frame of `target` to `reference`.
+
+    See Also
+    --------
+    enspara.geometry.libdist.rmsd
+    """
+
+    target_traces = _precenter(target)
+    reference_traces = _precenter(reference)
+
+    return libdist.rmsd(
+        target.xyz, reference.xyz[0],
+        X_traces=target_traces, y_trace=reference_traces[0],
+        indices=indices, out=out)
+
+
+def _distances_to_subset(distance_method, X, y, subset, out):
+    """Compute the distances between `y` and the frames of `X` selected
+    by `subset` (a boolean mask, integer indices or a slice), placing
+    them in `out` at the same positions. For libdist-backed RMSD, no
+    copy of `X` is made.
+    """
+
+    if distance_method is rmsd:
+        if isinstance(subset, slice):
+            subset = np.arange(*subset.indices(len(X)))
+        distance_method(X, y, indices=subset, out=out)
+    else:
+        out[subset] = distance_method(X[subset], y)
+
+    return out
+
+
+def _distances_at(distance_method, X, y, dtype):
+    """Compute the distances between `y` and each frame of `X`, rounded
+    to `dtype`, so that they can be compared exactly with distances
+    stored at that precision. For libdist-backed metrics, they are
+    written directly into an array of that dtype.
+    """
+
+    if distance_method is rmsd or (
+            _nearest_center_kernel(X, distance_method) is not None and
+            getattr(y, 'dtype', None) == X.dtype):
+        return distance_method(X, y, out=np.empty(len(X), dtype=dtype))
+
+    return np.asarray(distance_method(X, y)).astype(dtype, copy=False)
+
+
+def _check_distance_dtype(distance_dtype):
+    """Check that `distance_dtype` is a supported precision for cluster
+    distances (np.float64 or np.float32), returning it as an np.dtype.
+    """
+
+    try:
+        distance_dtype = np.dtype(distance_dtype)
+    except TypeError:
+        distance_dtype = None
+
+    if distance_dtype not in (np.float64, np.float32):
+        raise ImproperlyConfigured(
+            "Cluster distances must be np.float64 or np.float32, got "
+            "'%s'." % distance_dtype)
+
+    return distance_dtype
+
+
+def _frame_blocks(X, block_bytes=2**22):
+    """Split the frames of `X` into contiguous blocks of about
+    `block_bytes` bytes, so that a block can be compared to several
+    frames while it is still in cache.
+
+    Yields
+    ------
+    block : slice
+        The frames of `X` in this block.
+    """
+
+    frame_bytes = X[0].xyz.nbytes if hasattr(X, 'xyz') else X[0].nbytes
+    block_size = max(1, block_bytes // max(frame_bytes, 1))
 
-    return centers
+    for start in range(0, len(X), block_size):
+        yield slice(start, min(start + block_size, len(X)))
 
 
 def _get_distance_method(metric):
     if metric == 'rmsd':
-        return md.rmsd
+        return rmsd
     if metric == 'euclidean':
         return euclidean
     elif metric in ['cityblock', 'manhattan']:
@@ -321,20 +629,32 @@ def expand_files(pgroups):
     return expanded_pgroups
 
 
-def load_features(features, stride):
+def load_features(features, stride, memmap_dir=None, balanced=False):
     try:
         if len(features) == 1:
+            if memmap_dir is not None:
+                raise ImproperlyConfigured(
+                    "Features can only be memory-mapped from .npy files, "
+                    "one per trajectory. A single features file (%s) is "
+                    "read as an h5 RaggedArray, which can't be "
+                    "memory-mapped." % features[0])
             with timed("Loading features took %.1f s.", logger.info):
-                lengths, data = mpi.io.load_h5_as_striped(features[0], stride)
+                lengths, data = mpi.io.load_h5_as_striped(
+                    features[0], stride, balanced=balanced)
 
         else:  # and len(features) > 1
             with timed("Loading features took %.1f s.", logger.info):
-                lengths, data = mpi.io.load_npy_as_striped(features, stride)
-
-        with timed("Turned over array in %.2f min", logger.info):
-            tmp_data = data.copy()
-            del data
-            data = tmp_data
+                lengths, data = mpi.io.load_npy_as_striped(
+                    features, stride, memmap_dir=memmap_dir,
+                    balanced=balanced)
+
+        # a memmap is read straight from disk, so there's nothing to
+        # turn over (and copying it would read it all into memory).
+        if memmap_dir is None:
+            with timed("Turned over array in %.2f min", logger.info):
+                tmp_data = data.copy()
+                del data
+                data = tmp_data
     except MemoryError:
         logger.error(
             "Ran out of memory trying to allocate features array"
@@ -347,7 +667,8 @@ def load_features(features, stride):
     return lengths, data
 
 
-def load_trajectories(topologies, trajectories, selections, stride, processes):
+def load_trajectories(topologies, trajectories, selections, stride, processes,
+                      cache_dir=None, balanced=False):
 
     for top, selection in zip(topologies, selections):
         sentinel_trj = md.load(top)
@@ -392,12 +713,16 @@ def load_trajectories(topologies, trajectories, selections, stride, processes):
 
     with timed("Loading took %.1f sec", logger.info):
         lengths, xyz = mpi.io.load_trajectory_as_striped(
-            flat_trjs, args=configs, processes=auto_nprocs())
+            flat_trjs, args=configs, processes=auto_nprocs(),
+            cache_dir=cache_dir, balanced=balanced)
 
-    with timed("Turned over array in %.2f min", logger.info):
-        tmp_xyz = xyz.copy()
-        del xyz
-        xyz = tmp_xyz
+    # coordinates from a store are memory-mapped, so there's nothing to
+    # turn over.
+    if cache_dir is None:
+        with timed("Turned over array in %.2f min", logger.info):
+            tmp_xyz = xyz.copy()
+            del xyz
+            xyz = tmp_xyz
 
     logger.info("Loaded %s frames.", len(xyz))
 
@@ -406,6 +731,8 @@ def load_trajectories(topologies, trajectories, selections, stride, processes):
 
 def load_asymm_frames(center_indices, trajectories, topology, subsample):
 
+    filenames = list(itertools.chain(*trajectories))
+
     frames = []
     begin_index = 0
     for topfile, trjset in zip(topology, trajectories):
@@ -415,7 +742,7 @@ def load_asymm_frames(center_indices, trajectories, topology, subsample):
 
         try:
             subframes = load_frames(
-                list(itertools.chain(*trajectories)),
+                filenames,
                 target_centers,
                 top=md.load(topfile).top,
                 stride=subsample)
@@ -434,7 +761,10 @@ def load_trjs_or_features(args):
 
     if args.features:
         with timed("Loading features took %.1f s.", logger.info):
-            lengths, data = load_features(args.features, stride=args.subsample)
+            lengths, data = load_features(
+                args.features, stride=args.subsample,
+                memmap_dir=getattr(args, 'features_memmap_dir', None),
+                balanced=getattr(args, 'balance_stripes', False))
     else:
         assert args.trajectories
         assert len(args.trajectories) == len(args.topologies)
@@ -449,7 +779,9 @@ def load_trjs_or_features(args):
         with timed("Loading trajectories took %.1f s.", logger.info):
             lengths, xyz, select_top = load_trajectories(
                 args.topologies, args.trajectories, selections=args.atoms,
-                stride=args.subsample, processes=auto_nprocs())
+                stride=args.subsample, processes=auto_nprocs(),
+                cache_dir=getattr(args, 'coordinate_cache_dir', None),
+                balanced=getattr(args, 'balance_stripes', False))
 
         logger.info("Clustering using %s atoms matching '%s'.", xyz.shape[1],
                     args.atoms)
@@ -458,6 +790,10 @@ def load_trjs_or_features(args):
         # the topology.
         data = md.Trajectory(xyz=xyz, topology=select_top)
 
+        # coordinates from a store are centered already, and read-only
+        if getattr(args, 'coordinate_cache_dir', None):
+            _mark_precentered(data)
+
     return lengths, data
 
 
@@ -484,7 +820,7 @@ def write_centers(result, args, intermediate_n=None):
             centers_dir = os.path.dirname(args.center_features)
             int_feats = f'{centers_dir}/intermediate-{intermediate_n}/{os.path.basename(args.center_features)}'
             os.makedirs(f'{centers_dir}/intermediate-{intermediate_n}', exist_ok=True)
-            ra.save(int_feats, result.centers)
+            np.save(int_feats, result.centers)
 
         else:
             np.save(args.center_features, result.centers)
@@ -532,6 +868,14 @@ def write_assignments_and_distances_with_reassign(result, args, intermediate_n=N
             args.topologies, args.trajectories, args.atoms,
             centers=result.centers)
 
+        # written at the precision the clustering was done at
+        if isinstance(dist, ra.RaggedArray):
+            dist = ra.RaggedArray(
+                dist._data.astype(result.distances.dtype, copy=False),
+                lengths=dist.lengths)
+        else:
+            dist = dist.astype(result.distances.dtype, copy=False)
+
         if intermediate_n is not None:
             dists_dir = os.path.dirname(args.distances)
             int_dists = f'{dists_dir}/intermediate-{intermediate_n}/{os.path.basename(args.distances)}'
@@ -548,6 +892,197 @@ def write_assignments_and_distances_with_reassign(result, args, intermediate_n=N
     else:
         logger.debug("Got --no-reassign, not doing reassigment")
 
+
+def write_intermediates(result, args, lengths, intermediate_n):
+    """Write the center indices, center structures, assignments and
+    distances of an in-progress clustering run (as for
+    --save-intermediates) to directories named
+    `intermediate-{intermediate_n}` beside each output.
+    """
+
+    int_result = result.partition(lengths)
+
+    with timed("Wrote %s center indices in %%.2f sec." % intermediate_n,
+               logger.info):
+        write_centers_indices(
+            args.center_indices,
+            [(t, f * args.subsample) for t, f in int_result.center_indices],
+            intermediate_n=intermediate_n)
+
+    with timed("Wrote %s center structures in %%.2f sec." % intermediate_n,
+               logger.info):
+        write_centers(int_result, args, intermediate_n=intermediate_n)
+
+    write_assignments_and_distances_with_reassign(
+        int_result, args, intermediate_n=intermediate_n)
+
+
+class IntermediateWriter:
+    """Write intermediate clustering results with `write_intermediates`
+    in a background thread, so that clustering can continue while they
+    are written.
+
+    Each submitted result is snapshotted (assignments, distances and
+    center indices are copied), so the caller may go on to modify its
+    arrays in place. To bound memory use, at most one snapshot exists at
+    a time: `submit` blocks until the previous snapshot has been
+    written. If results must be reassigned to be written (i.e.
+    subsampling without --no-reassign), they are written synchronously
+    by `submit` instead, since reassignment loads the whole dataset
+    again. An error in the writer is raised by the next call to
+    `submit` or `close`.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Arguments to the cluster app, giving the output paths.
+    lengths : array-like
+        Lengths of each trajectory, to partition results with.
+    """
+
+    def __init__(self, args, lengths):
+        self.args = args
+        self.lengths = lengths
+        self.background = args.subsample == 1 or args.no_reassign
+
+        self._pending = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = None
+        if self.background:
+            self._thread = threading.Thread(target=self._write, daemon=True)
+            self._thread.start()
+
+    def _write(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+
+            # drop all references to the snapshot before marking it
+            # done, so that it is freed before submit takes another.
+            result, intermediate_n = item
+            del item
+            try:
+                if self._error is None:
+                    write_intermediates(
+                        result, self.args, self.lengths, intermediate_n)
+            except BaseException as e:
+                self._error = e
+            finally:
+                del result
+                self._pending.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, result, intermediate_n):
+        """Write `result` as intermediate `intermediate_n`, in the
+        background if possible.
+        """
+
+        if not self.background:
+            write_intermediates(
+                result, self.args, self.lengths, intermediate_n)
+            return
+
+        # wait for the previous snapshot to be written (and dropped)
+        # before taking the next one.
+        with timed("Waited %.2f sec for intermediate writer.", logger.debug):
+            self._pending.join()
+        self._raise_error()
+
+        snapshot = ClusterResult(
+            center_indices=np.array(result.center_indices),
+            assignments=np.array(result.assignments),
+            distances=np.array(result.distances),
+            centers=list(result.centers))
+
+        self._pending.put((snapshot, intermediate_n))
+
+    def close(self):
+        """Wait for the pending snapshot to be written."""
+
+        if self._thread is not None and self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_kcenters_checkpoint(result, args, lengths, mpi_mode=False,
+                              intermediate_n='kcenters-checkpoint'):
+    """Write the center indices, assignments and distances of an
+    in-progress k-centers run next to the final outputs, in a directory
+    named `intermediate-{intermediate_n}`. Clustering can be resumed
+    from these files with --init-center-inds, --init-assignments and
+    --init-distances.
+
+    Each file is written to a temporary path and moved into place, so
+    that an interrupted write never clobbers the previous checkpoint.
+    In MPI mode, this must be called on every rank.
+
+    Parameters
+    ----------
+    result : ClusterResult
+        The (in MPI mode, local) state of the k-centers run.
+    args : argparse.Namespace
+        Arguments to the cluster app.
+    lengths : array-like
+        Global lengths of each trajectory.
+    mpi_mode : bool, default=False
+        Whether `result` is striped across an MPI swarm.
+    intermediate_n : str, default='kcenters-checkpoint'
+        Name of the intermediate directory to write into.
+    """
+
+    ctr_inds, assigs, dists = (
+        result.center_indices, result.assignments, result.distances)
+
+    if mpi_mode:
+        owners = mpi.ops.stripe_owners(
+            lengths, getattr(args, 'balance_stripes', False))
+        dists = mpi.ops.assemble_striped_ragged_array(dists, lengths, owners)
+        assigs = mpi.ops.assemble_striped_ragged_array(
+            assigs, lengths, owners)
+        ctr_inds = mpi.ops.convert_local_indices(ctr_inds, lengths, owners)
+
+    if mpi.rank() == 0:
+        ctr_inds = [(t, f * args.subsample)
+                    for t, f in partition_indices(ctr_inds, lengths)]
+
+        # always save RaggedArrays, so that each trajectory gets its own
+        # array in the h5 file, as mpi.io.load_h5_as_striped expects.
+        outputs = [
+            (args.center_indices, lambda p: np.save(p, ctr_inds)),
+            (args.assignments, lambda p: ra.save(
+                p, ra.RaggedArray(assigs, lengths=lengths))),
+            (args.distances, lambda p: ra.save(
+                p, ra.RaggedArray(dists, lengths=lengths))),
+        ]
+
+        for path, write in outputs:
+            outdir = os.path.join(
+                os.path.dirname(path), f'intermediate-{intermediate_n}')
+            os.makedirs(outdir, exist_ok=True)
+
+            outfile = os.path.join(outdir, os.path.basename(path))
+            root, ext = os.path.splitext(outfile)
+            tmpfile = f'{root}.tmp{ext}'
+
+            write(tmpfile)
+            os.replace(tmpfile, outfile)
+
+    mpi.comm.barrier()
+
+
 def compute_batches(lengths, batch_size):
     """Compute batches (slices into lengths) of combined length at most
     size batch_size.
@@ -579,7 +1114,87 @@ def determine_batch_size(n_atoms, dtype_bytes, frac_mem):
     return batch_size, batch_gb
 
 
-def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None):
+def _prefetch(load, items, n_buffers):
+    """Yield load(item) for each of items, in order, loading up to
+    `n_buffers` - 1 items ahead in a background thread.
+
+    At most `n_buffers` loaded items are alive at once: a buffer is
+    freed for the next load when the consumer asks for the next item,
+    so the consumer must drop its references to an item before then.
+    """
+
+    slots = threading.Semaphore(n_buffers)
+    loaded = queue.Queue()
+    stop = threading.Event()
+
+    def producer():
+        for item in items:
+            slots.acquire()
+            if stop.is_set():
+                return
+            try:
+                loaded.put((load(item), None))
+            except BaseException as e:
+                loaded.put((None, e))
+                return
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    try:
+        for _ in items:
+            result, error = loaded.get()
+            if error is not None:
+                raise error
+            yield result
+            del result
+            slots.release()
+    finally:
+        stop.set()
+        slots.release()
+        thread.join()
+
+
+def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None,
+                   prefetch=1, index=None, cache_dir=None):
+    """Assign trajectories on disk to centers in batches that fit in
+    memory.
+
+    While one batch is being assigned, the next `prefetch` batches are
+    loaded in the background, so that disk I/O overlaps with the RMSD
+    calculation. The `frac_mem` budget is split between the batch being
+    assigned and those being prefetched.
+
+    Parameters
+    ----------
+    targets : list of tuples, [(trjfile, topology, atom_ids), ...]
+        Trajectories to reassign, and the atoms to load from each.
+    centers : list of md.Trajectory
+        Precentered centers to assign to.
+    lengths : list of int
+        The length of each trajectory in `targets`.
+    frac_mem : float
+        The fraction of main RAM to use for trajectories.
+    n_procs : int, default=None
+        Number of processes to load trajectories with.
+    prefetch : int, default=1
+        Number of batches to load ahead of the one being assigned. If 0,
+        batches are loaded and assigned strictly in turn.
+    index : VPTree, default=None
+        Index over `centers` to find nearest centers with.
+    cache_dir : str, default=None
+        Directory of a coordinate store to memory-map (centered)
+        coordinates from, creating it if necessary (see
+        enspara.util.load.load_cached_as_concatenated).
+
+    Returns
+    -------
+    assignments : list of ndarray
+        Assignment of each frame of each trajectory in `targets`.
+    distances : list of ndarray
+        Distance of each frame of each trajectory in `targets` to its
+        center.
+    """
 
     example_center = centers[0]
 
@@ -587,49 +1202,86 @@ def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None):
     batch_size, batch_gb = determine_batch_size(
         example_center.n_atoms, DTYPE_BYTES, frac_mem)
 
-    logger.info(
-        'Batch max size set to %s frames (~%.2f GB, %.1f%% of total RAM).' %
-        (batch_size, batch_gb, frac_mem*100))
-
     if batch_size < max(lengths):
         raise ImproperlyConfigured(
             'Batch size of %s was smaller than largest file (size %s).' %
             (batch_size, max(lengths)))
 
+    if prefetch and batch_size // (prefetch + 1) < max(lengths):
+        logger.warning(
+            'Memory for %s prefetched batches would be smaller than the '
+            'largest file (size %s); not prefetching.',
+            prefetch, max(lengths))
+        prefetch = 0
+
+    batch_size //= prefetch + 1
+    batch_gb /= prefetch + 1
+
+    logger.info(
+        'Batch max size set to %s frames (~%.2f GB, %.1f%% of total RAM), '
+        'prefetching %s batches.' %
+        (batch_size, batch_gb, frac_mem*100 / (prefetch + 1), prefetch))
+
     batches = compute_batches(lengths, batch_size)
 
-    assignments = []
-    distances = []
+    # batches of a coordinate store are views of its memory map
+    if cache_dir is not None:
+        with timed("Opened coordinate store in %.1f seconds", logger.info):
+            lengths, store_xyz = load_cached_as_concatenated(
+                [tfile for tfile, top, aids in targets], cache_dir,
+                args=[{'top': top, 'atom_indices': aids}
+                      for t, top, aids in targets],
+                lengths=lengths, processes=n_procs)
+        starts = np.concatenate([[0], np.cumsum(lengths, dtype=int)])
 
-    for i, batch_indices in enumerate(batches):
-        tick = time.perf_counter()
-        logger.info("Starting batch %s of %s", i+1, len(batches))
+    def load_batch(batch_indices):
         batch_targets = [targets[i] for i in batch_indices]
 
         with timed("Loaded frames for batch in %.1f seconds", logger.info):
-            batch_lengths, xyz = load_as_concatenated(
-                [tfile for tfile, top, aids in batch_targets],
-                lengths=[lengths[i] for i in batch_indices],
-                args=[{'top': top, 'atom_indices': aids}
-                      for t, top, aids in batch_targets],
-                processes=n_procs)
+            if cache_dir is not None:
+                batch_lengths = [lengths[i] for i in batch_indices]
+                xyz = store_xyz[starts[batch_indices[0]]:
+                                starts[batch_indices[-1] + 1]]
+            else:
+                batch_lengths, xyz = load_as_concatenated(
+                    [tfile for tfile, top, aids in batch_targets],
+                    lengths=[lengths[i] for i in batch_indices],
+                    args=[{'top': top, 'atom_indices': aids}
+                          for t, top, aids in batch_targets],
+                    processes=n_procs)
 
         # mdtraj loads as float32, and load_as_concatenated should thus
-        # also load as float32. This should _never_ be hit, but there might be
-        # some platform-specific situation where double != float64?
+        # also load as float32. This should _never_ be hit, but there
+        # might be some platform-specific situation where double !=
+        # float64?
         assert xyz.dtype.itemsize == DTYPE_BYTES
 
+        return batch_lengths, xyz
+
+    assignments = []
+    distances = []
+
+    loaded_batches = _prefetch(load_batch, batches, prefetch + 1)
+    for i, (batch_lengths, xyz) in enumerate(loaded_batches):
+        tick = time.perf_counter()
+        logger.info("Starting batch %s of %s", i+1, len(batches))
+
         trj = md.Trajectory(xyz, topology=example_center.top)
 
+        # stored coordinates are already centered (and read-only)
         with timed("Precentered trajectories in %.1f seconds", logger.debug):
-            trj.center_coordinates()
+            if cache_dir is not None:
+                _mark_precentered(trj)
+            else:
+                _precenter(trj)
 
         with timed("Assigned trajectories in %.1f seconds", logger.debug):
             batch_assignments, batch_distances = assign_to_nearest_center(
-                    trj, centers, partial(md.rmsd, precentered=True))
+                    trj, centers, rmsd, index=index)
 
         # clear memory of xyz and trj to allow cleanup to deallocate
-        # these large arrays; may help with memory high-water mark
+        # these large arrays (and the prefetcher to load the next batch);
+        # may help with memory high-water mark
         with timed("Cleared array from memory in %.1f seconds", logger.debug):
             xyz_size = xyz.size
             del trj, xyz
@@ -649,7 +1301,29 @@ def batch_reassign(targets, centers, lengths, frac_mem, n_procs=None):
     return assignments, distances
 
 
-def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
+def _assemble_striped_reassignment(assignments, distances):
+    """Gather the per-trajectory assignments and distances of each rank,
+    whose trajectories are striped across ranks, into lists of all
+    trajectories on rank 0. Ranks holding no trajectories take part with
+    empty lists; ranks other than 0 get (None, None).
+    """
+
+    gathered = mpi.comm.gather((assignments, distances), root=0)
+    if mpi.rank() != 0:
+        return None, None
+
+    n_trajectories = sum(len(a) for a, _ in gathered)
+    all_assigs = [None] * n_trajectories
+    all_dists = [None] * n_trajectories
+    for rank, (rank_assigs, rank_dists) in enumerate(gathered):
+        all_assigs[rank::mpi.size()] = rank_assigs
+        all_dists[rank::mpi.size()] = rank_dists
+
+    return all_assigs, all_dists
+
+
+def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5,
+             prefetch=1, mpi_mode=False, index=None, cache_dir=None):
     """Reassign a set of trajectories based on a subset of atoms and centers.
 
     Parameters
@@ -669,10 +1343,32 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
     frac_mem : float, default=0.5
         The fraction of main RAM to use for trajectories. A lower number
         will mean more batches.
+    prefetch : int, default=1
+        Number of batches to load while the current batch is being
+        assigned. See batch_reassign.
+    mpi_mode : bool, default=False
+        Split the trajectories across MPI ranks (trajectory i goes to
+        rank i % size), reassign them on each rank, and assemble the
+        results on rank 0. All ranks must call this function, and ranks
+        other than 0 return (None, None). The RAM and processes of each
+        node are split between its ranks.
+    index : VPTree, default=None
+        Index over `centers` to find nearest centers with, e.g. one
+        loaded with VPTree.load from next to the center structures.
+    cache_dir : str, default=None
+        Directory of coordinate stores to load trajectories from. See
+        batch_reassign.
     """
 
     n_procs = auto_nprocs()
 
+    if mpi_mode:
+        # ranks sharing a node also share its RAM and cores
+        hosts = mpi.comm.allgather(socket.gethostname())
+        ranks_per_node = hosts.count(hosts[mpi.rank()])
+        frac_mem /= ranks_per_node
+        n_procs = max(1, n_procs // ranks_per_node)
+
     # check input validity
     if len(topologies) != len(trajectories):
         raise ImproperlyConfigured(
@@ -695,7 +1391,7 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
 
     # precenter centers (there will be many RMSD calcs here)
     for c in centers:
-        c.center_coordinates()
+        _precenter(c)
 
     with timed("Reassignment took %.1f seconds.", logger.info):
         # build flat list of targets
@@ -707,21 +1403,43 @@ def reassign(topologies, trajectories, atoms, centers, frac_mem=0.5):
                 assert os.path.exists(trjfile)
                 targets.append((trjfile, t, atom_ids))
 
-        # determine trajectory length
-        tick_sounding = time.perf_counter()
-        logger.info("Sounding dataset of %s trajectories and %s topologies.",
-                    sum(len(t) for t in trajectories), len(topologies))
-
-        lengths = Parallel(n_jobs=n_procs)(
-            delayed(sound_trajectory)(f) for f, _, _ in targets)
+        if mpi_mode:
+            # with more ranks than trajectories, some ranks hold none
+            local_targets = targets[mpi.rank()::mpi.size()]
+        else:
+            local_targets = targets
+
+        if local_targets:
+            # determine trajectory length
+            tick_sounding = time.perf_counter()
+            logger.info(
+                "Sounding dataset of %s trajectories and %s topologies.",
+                len(local_targets), len(topologies))
+
+            lengths = sound_trajectories(
+                [f for f, _, _ in local_targets], processes=n_procs)
+
+            logger.info(
+                "Sounded %s trajectories with %s frames (median length %i "
+                "frames) in %.1f seconds.", len(lengths), sum(lengths),
+                np.median(lengths), time.perf_counter() - tick_sounding)
+
+            assignments, distances = batch_reassign(
+                local_targets, centers, lengths, frac_mem=frac_mem,
+                n_procs=n_procs, prefetch=prefetch, index=index,
+                cache_dir=cache_dir)
+        else:
+            logger.info("No trajectories to reassign on this rank.")
+            assignments, distances = [], []
 
-        logger.info("Sounded %s trajectories with %s frames (median length "
-                    "%i frames) in %.1f seconds.",
-                    len(lengths), sum(lengths), np.median(lengths),
-                    time.perf_counter() - tick_sounding)
+        if mpi_mode:
+            with timed("Reassembled dist and assign arrays in %.2f sec",
+                       logger.info):
+                assignments, distances = _assemble_striped_reassignment(
+                    assignments, distances)
 
-        assignments, distances = batch_reassign(
-            targets, centers, lengths, frac_mem=frac_mem, n_procs=n_procs)
+    if assignments is None:
+        return None, None
 
     if all([len(assignments[0]) == len(a) for a in assignments]):
         logger.info("Trajectory lengths are homogenous. Output will "
@@ -0,0 +1,260 @@
+"""A vantage-point tree over cluster centers, for finding the nearest
+center to many frames without comparing each frame to every center.
+"""
+
+import logging
+
+import numpy as np
+import mdtraj as md
+
+from . import util
+
+from ..exception import DataInvalid
+from ..util.log import timed
+
+logger = logging.getLogger(__name__)
+
+# centers are only pruned if their lower bound exceeds the best distance
+# so far by this much, so that round-off in the (single-precision) RMSD
+# can't break exactness.
+_PRUNE_ATOL = 1e-5
+
+
+class VPTree:
+    """Vantage-point tree [1]_ over a set of cluster centers.
+
+    Each node splits its centers into those nearer to and farther from a
+    vantage center than the median distance, and records the range of
+    distances of each half to the vantage center. By the triangle
+    inequality, a frame at distance d from the vantage center is at
+    least max(lo - d, d - hi) from every center in a half whose
+    distances span [lo, hi], so halves that can't contain a closer
+    center are skipped. Results are exact for any metric, including
+    RMSD.
+
+    Frames are queried in batches: all frames descend the tree together,
+    and their distances to each vantage center are computed in one call
+    to the distance method.
+
+    Parameters
+    ----------
+    centers : md.Trajectory, array-like or list
+        The centers to index. A list of single-frame trajectories (as
+        kept by clusterers in `centers_`) is joined into one trajectory.
+    distance_method : str or callable
+        The metric to use, as in `assign_to_nearest_center`.
+    leaf_size : int, default=8
+        Largest number of centers compared directly in a leaf.
+    random_state : int, default=None
+        Random state used to pick vantage centers.
+
+    References
+    ----------
+    .. [1] Yianilos, P. N. Data structures and algorithms for nearest
+       neighbor search in general metric spaces. in Proceedings of the
+       Fourth Annual ACM-SIAM Symposium on Discrete Algorithms 311–321
+       (1993).
+    """
+
+    def __init__(self, centers, distance_method, leaf_size=8,
+                 random_state=None):
+
+        self.distance_method = util._get_distance_method(distance_method)
+        self.centers = _as_batch(centers)
+        self.leaf_size = leaf_size
+
+        with timed("Built VP-tree over %s centers in %%.2f sec." %
+                   len(self.centers), logger.info):
+            self._build(np.random.default_rng(random_state))
+
+    def __len__(self):
+        return len(self.centers)
+
+    def _build(self, rng):
+
+        n_centers = len(self.centers)
+        buf = np.empty(n_centers, dtype=np.float64)
+
+        vantage, children, bounds, leaves = [], [], [], []
+        stack = [(np.arange(n_centers), None)]
+
+        while stack:
+            members, parent = stack.pop()
+            node = len(vantage)
+            if parent is not None:
+                children[parent[0]][parent[1]] = node
+
+            children.append([-1, -1])
+            bounds.append([np.inf, -np.inf, np.inf, -np.inf])
+
+            if len(members) <= self.leaf_size:
+                vantage.append(-1)
+                leaves.append((node, np.sort(members)))
+                continue
+
+            v = members[rng.integers(len(members))]
+            members = members[members != v]
+            vantage.append(v)
+
+            d = util._distances_to_subset(
+                self.distance_method, self.centers, self._frame(v),
+                members, buf)[members]
+            inside = d <= np.median(d)
+            if inside.all():
+                # all equidistant (e.g. duplicate centers); split anyway
+                # so the tree stays balanced.
+                inside = np.arange(len(d)) < len(d) // 2
+
+            for side, mask in enumerate([inside, ~inside]):
+                if mask.any():
+                    bounds[node][2*side:2*side+2] = [
+                        d[mask].min(), d[mask].max()]
+                    stack.append((members[mask], (node, side)))
+
+        self.vantage_ = np.array(vantage, dtype=int)
+        self.children_ = np.array(children, dtype=int)
+        self.bounds_ = np.array(bounds, dtype=np.float64)
+
+        self.leaf_offsets_ = np.zeros(len(vantage) + 1, dtype=int)
+        for node, members in leaves:
+            self.leaf_offsets_[node+1] = len(members)
+        self.leaf_offsets_ = np.cumsum(self.leaf_offsets_)
+        self.leaf_centers_ = np.concatenate(
+            [members for _, members in sorted(leaves, key=lambda l: l[0])])
+
+    def _frame(self, i):
+        if isinstance(self.centers, md.Trajectory):
+            return self.centers.slice(i, copy=False)
+        return self.centers[i]
+
+    def query(self, X):
+        """Find the nearest center to each frame of `X`.
+
+        Parameters
+        ----------
+        X : md.Trajectory or array-like
+            Frames to find the nearest center to.
+
+        Returns
+        -------
+        assignments : ndarray, shape=(n_frames,)
+            Index of the nearest center to each frame. Ties go to the
+            center with the lowest index, as in
+            `assign_to_nearest_center`.
+        distances : ndarray, shape=(n_frames,)
+            Distance from each frame to its nearest center.
+        """
+
+        assignments = np.full(len(X), -1, dtype=int)
+        distances = np.full(len(X), np.inf, dtype=np.float64)
+        buf = np.empty(len(X), dtype=np.float64)
+
+        self._search(0, np.arange(len(X)), X, assignments, distances, buf)
+
+        return assignments, distances
+
+    def _compare(self, X, center, active, assignments, distances, buf):
+        """Compare frames `active` of `X` to one center, keeping it if it
+        is the nearest so far, and return the distances.
+        """
+
+        d = util._distances_to_subset(
+            self.distance_method, X, self._frame(center), active, buf)[active]
+
+        better = (d < distances[active]) | \
+            ((d == distances[active]) & (center < assignments[active]))
+        distances[active[better]] = d[better]
+        assignments[active[better]] = center
+
+        return d
+
+    def _search(self, node, active, X, assignments, distances, buf):
+
+        if len(active) == 0:
+            return
+
+        v = self.vantage_[node]
+        if v < 0:
+            leaf = self.leaf_centers_[
+                self.leaf_offsets_[node]:self.leaf_offsets_[node+1]]
+            for center in leaf:
+                self._compare(X, center, active, assignments, distances, buf)
+            return
+
+        d = self._compare(X, v, active, assignments, distances, buf)
+
+        in_lo, in_hi, out_lo, out_hi = self.bounds_[node]
+        near_inside = d <= (in_hi + out_lo) / 2
+
+        # frames visit the half they are likely to be in first, so that
+        # the best distance is small when deciding whether to visit the
+        # other half
+        for group, sides in [(near_inside, (0, 1)), (~near_inside, (1, 0))]:
+            for side in sides:
+                child = self.children_[node, side]
+                if child < 0:
+                    continue
+                lo, hi = self.bounds_[node, 2*side:2*side+2]
+                lower_bound = np.maximum(lo - d, d - hi)
+                visit = group & \
+                    (lower_bound <= distances[active] + _PRUNE_ATOL)
+                self._search(child, active[visit], X, assignments,
+                             distances, buf)
+
+    def save(self, path):
+        """Save the tree (but not the centers) as an npz archive, e.g.
+        next to the center structures it indexes.
+        """
+
+        # write through a handle, so that np.savez doesn't add '.npz'
+        with open(path, 'wb') as f:
+            np.savez(f, vantage=self.vantage_, children=self.children_,
+                     bounds=self.bounds_, leaf_offsets=self.leaf_offsets_,
+                     leaf_centers=self.leaf_centers_,
+                     leaf_size=self.leaf_size)
+
+    @classmethod
+    def load(cls, path, centers, distance_method):
+        """Load a tree saved with `save`.
+
+        Parameters
+        ----------
+        path : str
+            Path of the saved tree.
+        centers : md.Trajectory, array-like or list
+            The centers the tree was built over, in the same order.
+        distance_method : str or callable
+            The metric the tree was built with.
+        """
+
+        tree = cls.__new__(cls)
+        tree.distance_method = util._get_distance_method(distance_method)
+        tree.centers = _as_batch(centers)
+
+        with np.load(path) as f:
+            tree.vantage_ = f['vantage']
+            tree.children_ = f['children']
+            tree.bounds_ = f['bounds']
+            tree.leaf_offsets_ = f['leaf_offsets']
+            tree.leaf_centers_ = f['leaf_centers']
+            tree.leaf_size = int(f['leaf_size'])
+
+        n_indexed = np.count_nonzero(tree.vantage_ >= 0) + \
+            len(tree.leaf_centers_)
+        if n_indexed != len(tree.centers):
+            raise DataInvalid(
+                "VP-tree at %s indexes %s centers, but %s were given." %
+                (path, n_indexed, len(tree.centers)))
+
+        return tree
+
+
+def _as_batch(centers):
+    """Turn a list of single-frame trajectories into one trajectory, so
+    that distances to many centers can be computed in one call.
+    """
+
+    if isinstance(centers, list) and len(centers) and \
+            isinstance(centers[0], md.Trajectory):
+        return md.join(centers, check_topology=False)
+    return centers
@@ -24,11 +24,21 @@ ctypedef fused INTEGRAL_TYPE_T:
     np.int32_t
     np.int64_t
 
+# distances may be stored at single or double precision; they are
+# always accumulated at double precision.
+ctypedef fused OUT_TYPE_T:
+    np.float32_t
+    np.float64_t
+
 cdef extern from "math.h" nogil:
     double sqrt(double x)
     double fabs(double x)
     float fabs(float x)
 
+# Newton-Raphson convergence criterion for the QCP largest eigenvalue.
+cdef double QCP_EVAL_PREC = 1e-11
+cdef int QCP_MAX_ITER = 50
+
 def _check_is_2d(X):
     if len(X.shape) != 2:
         raise exception.DataInvalid(
@@ -55,11 +65,12 @@ def _prepare_for_2d_to_1d_distance(X, y, out):
     if out is None:
         out = np.zeros((X.shape[0]), dtype=np.float64)
     else:
-        # precision problems happen if out is less than 64-bit
-        if out.dtype != np.float64:
+        # distances are accumulated at double precision regardless, but
+        # only single- and double-precision floats can hold them.
+        if out.dtype not in (np.float32, np.float64):
             raise exception.DataInvalid(
-                "In-place output array must be np.float64, got '%s'."
-                % out.dtype)
+                "In-place output array must be np.float32 or np.float64, "
+                "got '%s'." % out.dtype)
         if out.shape[0] != X.shape[0]:
             raise exception.DataInvalid(
                 ("In-place output array dimension (%s) must match number of "
@@ -76,21 +87,23 @@ def _prepare_for_2d_to_1d_distance(X, y, out):
 @cython.wraparound(False)
 def _hamming(np.ndarray[INTEGRAL_TYPE_T, ndim=2] X,
              np.ndarray[INTEGRAL_TYPE_T, ndim=1] y,
-             np.ndarray[np.float64_t, ndim=1] out):
+             np.ndarray[OUT_TYPE_T, ndim=1] out):
 
     cdef long n_samples = len(out)
     cdef long n_features = len(y)
     assert len(out) == X.shape[0], "Size of output array didn't match number of observations in X"
     assert n_features == X.shape[1], "Number of features between X and y didn't match."
 
-    cdef long i, j = 0
+    cdef long i, j, n_diff
+    cdef double d
 
     for i in prange(n_samples, nogil=True):
-        out[i] = 0
+        n_diff = 0
         for j in range(n_features):
             if y[j] != X[i, j]:
-                out[i] += 1
-        out[i] /= n_features
+                n_diff = n_diff + 1
+        d = n_diff
+        out[i] = d / n_features
 
     return out
 
@@ -99,7 +112,7 @@ def _hamming(np.ndarray[INTEGRAL_TYPE_T, ndim=2] X,
 @cython.wraparound(False)
 def _manhattan(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
                np.ndarray[FLOAT_TYPE_T, ndim=1] y,
-               np.ndarray[np.float64_t, ndim=1] out):
+               np.ndarray[OUT_TYPE_T, ndim=1] out):
 
     cdef long n_samples = len(out)
     cdef long n_features = len(y)
@@ -107,12 +120,13 @@ def _manhattan(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
     assert n_features == X.shape[1]
 
     cdef long i, j = 0
-    for i in prange(n_samples, nogil=True):
-        out[i] = 0
+    cdef double d
 
     for i in prange(n_samples, nogil=True):
+        d = 0
         for j in range(n_features):
-            out[i] += fabs(X[i, j] - y[j])
+            d = d + fabs(X[i, j] - y[j])
+        out[i] = d
 
     return out.reshape(-1, 1)
 
@@ -121,7 +135,7 @@ def _manhattan(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
 @cython.wraparound(False)
 def _euclidean(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
                np.ndarray[FLOAT_TYPE_T, ndim=1] y,
-               np.ndarray[np.float64_t, ndim=1] out):
+               np.ndarray[OUT_TYPE_T, ndim=1] out):
 
     cdef long n_samples = len(out)
     cdef long n_features = len(y)
@@ -129,22 +143,16 @@ def _euclidean(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
     assert n_features == X.shape[1]
 
     cdef long i, j = 0
-
-    # zero out output array; this is fast compared to the actual
-    # computation, so we always do it.
-    for i in prange(n_samples, nogil=True):
-        out[i] = 0
+    cdef double d
 
     for i in prange(n_samples, nogil=True):
+        d = 0
         for j in range(n_features):
-            out[i] += (X[i, j] - y[j])**2
-
-    for i in prange(n_samples, nogil=True):
-        out[i] = sqrt(out[i])
+            d = d + (X[i, j] - y[j])**2
+        out[i] = sqrt(d)
 
     return out.reshape(-1, 1)
 
-
 def euclidean(X, y, out=None):
     """Compute the euclidean distance between a point, `y`, and a group
     of points `X`. Uses thread-parallelism with OpenMP.
@@ -156,8 +164,10 @@ def euclidean(X, y, out=None):
     y: array, shape=(n_features)
         The point, for all rows in `X`, to compute the distance to.
     out: array, shape=(n_samples), default=None
-        If provided, the array to place the distances in. If not provided,
-        an array will be allocated for you.
+        If provided, the array to place the distances in, either
+        np.float64 or (to save memory) np.float32. Distances are
+        computed at double precision either way. If not provided, an
+        np.float64 array will be allocated for you.
     """
     out = _prepare_for_2d_to_1d_distance(X, y, out)
     _euclidean(X, y, out)
@@ -174,8 +184,10 @@ def manhattan(X, y, out=None):
     y: array, shape=(n_features)
         The point, for all rows in `X`, to compute the distance to.
     out: array, shape=(n_samples), default=None
-        If provided, the array to place the distances in. If not provided,
-        an array will be allocated for you.
+        If provided, the array to place the distances in, either
+        np.float64 or (to save memory) np.float32. Distances are
+        computed at double precision either way. If not provided, an
+        np.float64 array will be allocated for you.
     """
 
     out = _prepare_for_2d_to_1d_distance(X, y, out)
@@ -194,10 +206,619 @@ def hamming(X, y, out=None):
     y: array, shape=(n_features)
         The point, for all rows in `X`, to compute the distance to.
     out: array, shape=(n_samples), default=None
-        If provided, the array to place the distances in. If not provided,
-        an array will be allocated for you.
+        If provided, the array to place the distances in, either
+        np.float64 or (to save memory) np.float32. Distances are
+        computed at double precision either way. If not provided, an
+        np.float64 array will be allocated for you.
     """
 
     out = _prepare_for_2d_to_1d_distance(X, y, out)
     _hamming(X, y, out)
     return out
+
+
+def _check_rmsd_inputs(X, y):
+    if len(X.shape) != 3 or X.shape[2] != 3:
+        raise exception.DataInvalid(
+            "Coordinate array must have shape (n_frames, n_atoms, 3), got "
+            "shape %s." % str(X.shape))
+    if y.shape != X.shape[1:]:
+        raise exception.DataInvalid(
+            ("Target coordinates shape %s must match the shape of a frame "
+             "of the data array (%s).") % (str(y.shape), str(X.shape[1:])))
+
+
+def _prepare_subset(indices, n_samples):
+    """Check a subset specification (boolean mask or integer indices)
+    and convert it to a form accepted by the kernels without copying
+    the mask. Returns a pair (is_mask, subset).
+    """
+
+    indices = np.asarray(indices)
+    if indices.dtype == np.bool_:
+        if indices.shape != (n_samples,):
+            raise exception.DataInvalid(
+                ("Boolean mask shape %s must match number of samples in "
+                 "data array (%s).") % (str(indices.shape), n_samples))
+        return True, np.ascontiguousarray(indices).view(np.uint8)
+    elif np.issubdtype(indices.dtype, np.integer):
+        if len(indices.shape) != 1:
+            raise exception.DataInvalid(
+                "Index array must be one-dimensional, got shape %s." %
+                str(indices.shape))
+        if len(indices) and (indices.min() < 0 or
+                             indices.max() >= n_samples):
+            raise exception.DataInvalid(
+                "Indices must be in the range [0, %s)." % n_samples)
+        return False, np.require(indices, dtype=np.intp, requirements='C')
+    else:
+        raise exception.DataInvalid(
+            "Indices must be a boolean mask or an integer array, got "
+            "dtype '%s'." % indices.dtype)
+
+
+cdef inline double _dabs(double x) nogil:
+    # math.h's fabs is declared above with a float signature, which
+    # would truncate the double-precision QCP intermediates.
+    return -x if x < 0 else x
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _qcp_rmsd(
+        const float* a, const float* b, long n_atoms,
+        double g_a, double g_b) nogil:
+    """RMSD between two precentered frames with traces g_a and g_b via
+    the quaternion characteristic polynomial (QCP) method of Theobald.
+    """
+
+    cdef long k
+    cdef double Sxx = 0, Sxy = 0, Sxz = 0
+    cdef double Syx = 0, Syy = 0, Syz = 0
+    cdef double Szx = 0, Szy = 0, Szz = 0
+    cdef double x1, y1, z1, x2, y2, z2
+
+    for k in range(n_atoms):
+        x1 = a[3*k]
+        y1 = a[3*k+1]
+        z1 = a[3*k+2]
+        x2 = b[3*k]
+        y2 = b[3*k+1]
+        z2 = b[3*k+2]
+
+        Sxx = Sxx + x1 * x2
+        Sxy = Sxy + x1 * y2
+        Sxz = Sxz + x1 * z2
+        Syx = Syx + y1 * x2
+        Syy = Syy + y1 * y2
+        Syz = Syz + y1 * z2
+        Szx = Szx + z1 * x2
+        Szy = Szy + z1 * y2
+        Szz = Szz + z1 * z2
+
+    cdef double Sxx2 = Sxx * Sxx, Syy2 = Syy * Syy, Szz2 = Szz * Szz
+    cdef double Sxy2 = Sxy * Sxy, Syz2 = Syz * Syz, Sxz2 = Sxz * Sxz
+    cdef double Syx2 = Syx * Syx, Szy2 = Szy * Szy, Szx2 = Szx * Szx
+
+    cdef double SyzSzymSyySzz2 = 2.0 * (Syz * Szy - Syy * Szz)
+    cdef double Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+
+    cdef double c2 = -2.0 * (Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 +
+                             Szx2 + Syz2 + Szy2)
+    cdef double c1 = 8.0 * (Sxx * Syz * Szy + Syy * Szx * Sxz +
+                            Szz * Sxy * Syx - Sxx * Syy * Szz -
+                            Syz * Szx * Sxy - Szy * Syx * Sxz)
+
+    cdef double SxzpSzx = Sxz + Szx
+    cdef double SyzpSzy = Syz + Szy
+    cdef double SxypSyx = Sxy + Syx
+    cdef double SyzmSzy = Syz - Szy
+    cdef double SxzmSzx = Sxz - Szx
+    cdef double SxymSyx = Sxy - Syx
+    cdef double SxxpSyy = Sxx + Syy
+    cdef double SxxmSyy = Sxx - Syy
+    cdef double Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    cdef double c0 = (
+        Sxy2Sxz2Syx2Szx2 * Sxy2Sxz2Syx2Szx2 +
+        (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2) *
+        (Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2) +
+        (-SxzpSzx * SyzmSzy + SxymSyx * (SxxmSyy - Szz)) *
+        (-SxzmSzx * SyzpSzy + SxymSyx * (SxxmSyy + Szz)) +
+        (-SxzpSzx * SyzpSzy - SxypSyx * (SxxpSyy - Szz)) *
+        (-SxzmSzx * SyzmSzy - SxypSyx * (SxxpSyy + Szz)) +
+        (SxypSyx * SyzpSzy + SxzpSzx * (SxxmSyy + Szz)) *
+        (-SxymSyx * SyzmSzy + SxzpSzx * (SxxpSyy + Szz)) +
+        (SxypSyx * SyzmSzy + SxzmSzx * (SxxmSyy - Szz)) *
+        (-SxymSyx * SyzpSzy + SxzmSzx * (SxxpSyy - Szz)))
+
+    # Newton-Raphson on the characteristic polynomial, starting from
+    # the upper bound E0 on the largest eigenvalue.
+    cdef double e0 = (g_a + g_b) * 0.5
+    cdef double eig = e0
+    cdef double old_eig, x2e, pb, pa, denom
+    cdef int it
+
+    for it in range(QCP_MAX_ITER):
+        old_eig = eig
+        x2e = eig * eig
+        pb = (x2e + c2) * eig
+        pa = pb + c1
+        denom = 2.0 * x2e * eig + pb + pa
+        # the polynomial is flat at degenerate (e.g. colinear) roots
+        if denom == 0:
+            break
+        eig = eig - (pa * eig + c0) / denom
+        if _dabs(eig - old_eig) < _dabs(QCP_EVAL_PREC * eig):
+            break
+
+    return sqrt(_dabs(2.0 * (e0 - eig) / n_atoms))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_traces(const float[:, :, ::1] X, np.float64_t[::1] out):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long i, k
+    cdef double g, x, y, z
+
+    for i in prange(n_samples, nogil=True):
+        g = 0
+        for k in range(n_atoms):
+            x = X[i, k, 0]
+            y = X[i, k, 1]
+            z = X[i, k, 2]
+            g = g + (x * x + y * y + z * z)
+        out[i] = g
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_all(const float[:, :, ::1] X, const float[:, ::1] y,
+              const np.float64_t[::1] X_traces, double y_trace,
+              OUT_TYPE_T[::1] out):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long i
+
+    for i in prange(n_samples, nogil=True):
+        out[i] = _qcp_rmsd(&X[i, 0, 0], &y[0, 0], n_atoms,
+                           X_traces[i], y_trace)
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_mask(const float[:, :, ::1] X, const float[:, ::1] y,
+               const np.float64_t[::1] X_traces, double y_trace,
+               const np.uint8_t[::1] mask, OUT_TYPE_T[::1] out):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long i
+
+    for i in prange(n_samples, nogil=True):
+        if mask[i]:
+            out[i] = _qcp_rmsd(&X[i, 0, 0], &y[0, 0], n_atoms,
+                               X_traces[i], y_trace)
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _rmsd_indices(const float[:, :, ::1] X, const float[:, ::1] y,
+                  const np.float64_t[::1] X_traces, double y_trace,
+                  const np.intp_t[::1] indices, OUT_TYPE_T[::1] out):
+
+    cdef long n_indices = indices.shape[0]
+    cdef long n_atoms = X.shape[1]
+    cdef long i
+    cdef np.intp_t j
+
+    for i in prange(n_indices, nogil=True):
+        j = indices[i]
+        out[j] = _qcp_rmsd(&X[j, 0, 0], &y[0, 0], n_atoms,
+                           X_traces[j], y_trace)
+
+    return out
+
+
+def rmsd_traces(X, out=None):
+    """Compute the RMSD 'trace' (sum of squared coordinates) of each
+    frame of a precentered coordinate array. These are the per-frame
+    quantities that :func:`rmsd` reuses between calls.
+
+    Parameters
+    ----------
+    X : array, shape=(n_samples, n_atoms, 3)
+        Precentered coordinates (e.g. ``md.Trajectory.xyz`` after
+        ``center_coordinates``).
+    out: array, shape=(n_samples), default=None
+        If provided, the np.float64 array to place the traces in. If
+        not provided, an array will be allocated for you.
+    """
+
+    X = np.require(X, dtype=np.float32, requirements='C')
+    if len(X.shape) != 3 or X.shape[2] != 3:
+        raise exception.DataInvalid(
+            "Coordinate array must have shape (n_frames, n_atoms, 3), got "
+            "shape %s." % str(X.shape))
+
+    if out is None:
+        out = np.zeros((X.shape[0]), dtype=np.float64)
+    elif out.dtype != np.float64 or out.shape != (X.shape[0],):
+        raise exception.DataInvalid(
+            "In-place trace array must be np.float64 with shape (%s,), got "
+            "'%s' with shape %s." % (X.shape[0], out.dtype, out.shape))
+
+    _rmsd_traces(X, out)
+    return out
+
+
+def rmsd(X, y, X_traces=None, y_trace=None, indices=None, out=None):
+    """Compute the minimal (superposed) RMSD between a frame `y` and
+    each frame in `X` using the quaternion characteristic polynomial
+    (QCP) method [1]_. Uses thread-parallelism with OpenMP.
+
+    Both `X` and `y` must already be centered at the origin. Optionally,
+    only a subset of `X` is compared to `y`; in this case distances are
+    written into `out` at the positions of the subset, so that neither
+    the coordinates nor the output need to be copied.
+
+    Parameters
+    ----------
+    X : array, shape=(n_samples, n_atoms, 3)
+        Precentered coordinates, ideally C-contiguous np.float32 (as in
+        ``md.Trajectory.xyz``), which avoids a copy.
+    y: array, shape=(n_atoms, 3)
+        Precentered coordinates of the point to compute the RMSD to.
+    X_traces: array, shape=(n_samples), default=None
+        Traces of `X`, as computed by :func:`rmsd_traces`. Computed if
+        not provided. Single-precision traces (e.g. from
+        ``md.Trajectory.center_coordinates``) are accepted, but limit
+        the precision of small RMSDs.
+    y_trace: float, default=None
+        Trace of `y`. Computed if not provided.
+    indices: array, default=None
+        Either a boolean mask of shape (n_samples,) or an array of
+        integer indices into `X`. If provided, only the RMSDs of these
+        frames are computed and positions of `out` not in the subset
+        are left untouched.
+    out: array, shape=(n_samples), default=None
+        If provided, the array to place the distances in, either
+        np.float64 or (to save memory) np.float32. Distances are
+        computed at double precision either way. If not provided, an
+        np.float64 array will be allocated for you (and filled with NaN
+        outside of `indices`).
+
+    References
+    ----------
+    .. [1] Theobald, D. L. Rapid calculation of RMSDs using a
+        quaternion-based characteristic polynomial. Acta Cryst. A61,
+        478-480 (2005).
+    """
+
+    X = np.require(X, dtype=np.float32, requirements='C')
+    y = np.require(y, dtype=np.float32, requirements='C')
+    _check_rmsd_inputs(X, y)
+
+    n_samples = X.shape[0]
+
+    if X_traces is None:
+        X_traces = rmsd_traces(X)
+    else:
+        X_traces = np.require(X_traces, dtype=np.float64, requirements='C')
+        if X_traces.shape != (n_samples,):
+            raise exception.DataInvalid(
+                ("Trace array shape %s must match number of samples in data "
+                 "array (%s).") % (str(X_traces.shape), n_samples))
+
+    if y_trace is None:
+        # computed the same way as X_traces, so that identical frames
+        # have identical traces (and an RMSD of zero).
+        y_trace = rmsd_traces(y.reshape(1, -1, 3))[0]
+
+    if out is None:
+        out = np.full((n_samples), np.nan if indices is not None else 0,
+                      dtype=np.float64)
+    else:
+        if out.dtype not in (np.float32, np.float64):
+            raise exception.DataInvalid(
+                "In-place output array must be np.float32 or np.float64, "
+                "got '%s'." % out.dtype)
+        if out.shape != (n_samples,):
+            raise exception.DataInvalid(
+                ("In-place output array shape %s must match number of "
+                 "samples in data array (%s)") % (str(out.shape), n_samples))
+
+    if indices is None:
+        _rmsd_all(X, y, X_traces, y_trace, out)
+    else:
+        is_mask, subset = _prepare_subset(indices, n_samples)
+        if is_mask:
+            _rmsd_mask(X, y, X_traces, y_trace, subset, out)
+        else:
+            _rmsd_indices(X, y, X_traces, y_trace, subset, out)
+
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _hamming_nearest(np.ndarray[INTEGRAL_TYPE_T, ndim=2] X,
+                     np.ndarray[INTEGRAL_TYPE_T, ndim=2] C,
+                     long c_start, long c_stop,
+                     np.intp_t[::1] assignments,
+                     np.float64_t[::1] distances):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long i, j, c, n_diff
+    cdef double d
+
+    for i in prange(n_samples, nogil=True, schedule='static'):
+        for c in range(c_start, c_stop):
+            n_diff = 0
+            for j in range(n_features):
+                if C[c, j] != X[i, j]:
+                    n_diff = n_diff + 1
+            d = n_diff
+            d = d / n_features
+            if d < distances[i]:
+                distances[i] = d
+                assignments[i] = c
+
+    return assignments, distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _manhattan_nearest(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
+                       np.ndarray[FLOAT_TYPE_T, ndim=2] C,
+                       long c_start, long c_stop,
+                       np.intp_t[::1] assignments,
+                       np.float64_t[::1] distances):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long i, j, c
+    cdef double d
+
+    for i in prange(n_samples, nogil=True, schedule='static'):
+        for c in range(c_start, c_stop):
+            d = 0
+            for j in range(n_features):
+                d = d + fabs(X[i, j] - C[c, j])
+            if d < distances[i]:
+                distances[i] = d
+                assignments[i] = c
+
+    return assignments, distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _gemm_argmin(const np.float64_t[:, ::1] G,
+                 const np.float64_t[::1] C_sq, long c_start,
+                 np.intp_t[::1] assignments, np.float64_t[::1] partial,
+                 np.float64_t[::1] second):
+    # G[i, c] = <x_i, c>, so |c|^2 - 2 <x_i, c> orders the centers by
+    # their distance to x_i without the (constant) |x_i|^2 term. The
+    # runner-up score is kept to tell how close the call was.
+
+    cdef long n_samples = G.shape[0]
+    cdef long n_centers = G.shape[1]
+    cdef long i, c
+    cdef double d
+
+    for i in prange(n_samples, nogil=True, schedule='static'):
+        for c in range(n_centers):
+            d = C_sq[c] - 2 * G[i, c]
+            if d < partial[i]:
+                second[i] = partial[i]
+                partial[i] = d
+                assignments[i] = c_start + c
+            elif d < second[i]:
+                second[i] = d
+
+    return assignments, partial
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _euclidean_nearest(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
+                       np.ndarray[FLOAT_TYPE_T, ndim=2] C,
+                       const np.intp_t[::1] inds,
+                       np.intp_t[::1] assignments,
+                       np.float64_t[::1] distances):
+
+    cdef long n_inds = inds.shape[0]
+    cdef long n_centers = C.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long i, j, k, c, a
+    cdef double d, best
+
+    # exact sweep over all centers for the frames in `inds`, accumulated
+    # as in _euclidean so that ties are judged on the reported distances
+    for k in prange(n_inds, nogil=True, schedule='dynamic'):
+        i = inds[k]
+        best = -1
+        a = 0
+        for c in range(n_centers):
+            d = 0
+            for j in range(n_features):
+                d = d + (X[i, j] - C[c, j])**2
+            d = sqrt(d)
+            if best < 0 or d < best:
+                best = d
+                a = c
+        assignments[i] = a
+        distances[i] = best
+
+    return assignments, distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _euclidean_assigned(np.ndarray[FLOAT_TYPE_T, ndim=2] X,
+                        np.ndarray[FLOAT_TYPE_T, ndim=2] C,
+                        const np.intp_t[::1] assignments,
+                        np.float64_t[::1] out):
+
+    cdef long n_samples = X.shape[0]
+    cdef long n_features = X.shape[1]
+    cdef long i, j
+    cdef np.intp_t a
+
+    # accumulated exactly as in _euclidean, so that the distances are
+    # identical to those from `euclidean`
+    for i in prange(n_samples, nogil=True, schedule='static'):
+        a = assignments[i]
+        out[i] = 0
+        for j in range(n_features):
+            out[i] += (X[i, j] - C[a, j])**2
+        out[i] = sqrt(out[i])
+
+    return out
+
+
+# the center blocks of the nearest-center sweeps are sized to stay in
+# cache; the euclidean (GEMM) sweep also blocks frames so that the
+# block of inner products is about _NEAREST_BLOCK_BYTES.
+_NEAREST_CENTER_BLOCK_BYTES = 2**18
+_NEAREST_BLOCK_BYTES = 2**24
+
+
+def nearest_center(X, centers, metric='euclidean', assignments=None,
+                   distances=None):
+    """Find the nearest of several `centers` to each point in `X`.
+    Rather than sweeping over `X` once per center, centers are processed
+    in cache-sized blocks, each compared to all of `X` in a single
+    OpenMP-parallel sweep. Euclidean distances are ranked with a matrix
+    product (GEMM) on data shifted to the mean of `centers`; points
+    whose two best centers are too close to call at that precision are
+    checked exactly against every center.
+
+    Parameters
+    ----------
+    X : array, shape=(n_samples, n_features)
+        The group of points to assign to centers.
+    centers : array, shape=(n_centers, n_features)
+        The centers, with the same dtype as `X`.
+    metric : {'euclidean', 'manhattan', 'hamming'}, default='euclidean'
+        The distance metric, as computed by the function of that name.
+    assignments : array, shape=(n_samples), default=None
+        If provided, the np.intp array to place the index of the nearest
+        center in. If not provided, an array will be allocated for you.
+    distances : array, shape=(n_samples), default=None
+        If provided, the np.float64 array to place the distance to the
+        nearest center in. If not provided, an array will be allocated
+        for you.
+
+    Returns
+    -------
+    assignments : array, shape=(n_samples)
+        The index of the nearest center to each point. Ties go to the
+        center with the lowest index.
+    distances : array, shape=(n_samples)
+        The distance of each point to its nearest center.
+    """
+
+    _check_is_2d(X)
+    _check_is_2d(centers)
+    if centers.dtype != X.dtype:
+        raise exception.DataInvalid(
+            "Center dtype ('%s') must match data array dtype ('%s')." %
+            (centers.dtype, X.dtype))
+    centers = np.require(centers, requirements='C')
+    if X.shape[1] != centers.shape[1]:
+        raise exception.DataInvalid(
+            ("Center dimension (%s) must match data array dimension (%s)")
+            % (centers.shape[1], X.shape[1]))
+
+    n_samples = X.shape[0]
+    n_centers = centers.shape[0]
+
+    if assignments is None:
+        assignments = np.zeros((n_samples), dtype=np.intp)
+    elif assignments.dtype != np.intp or assignments.shape != (n_samples,):
+        raise exception.DataInvalid(
+            "In-place assignment array must be np.intp with shape (%s,), "
+            "got '%s' with shape %s." %
+            (n_samples, assignments.dtype, assignments.shape))
+    else:
+        assignments.fill(0)
+
+    if distances is None:
+        distances = np.zeros((n_samples), dtype=np.float64)
+    elif distances.dtype != np.float64 or distances.shape != (n_samples,):
+        raise exception.DataInvalid(
+            "In-place distance array must be np.float64 with shape (%s,), "
+            "got '%s' with shape %s." %
+            (n_samples, distances.dtype, distances.shape))
+    distances.fill(np.inf)
+
+    if n_centers == 0 or n_samples == 0:
+        return assignments, distances
+
+    center_block = max(
+        1, _NEAREST_CENTER_BLOCK_BYTES // max(centers[0].nbytes, 1))
+
+    if metric == 'euclidean':
+        # |c|^2 - 2 <x, c> cancels badly when the data sit far from the
+        # origin, so both are shifted to the centers' mean first.
+        C = centers.astype(np.float64)
+        mu = C.mean(axis=0)
+        C -= mu
+        C_sq = np.einsum('ij,ij->i', C, C)
+        c_norm = np.sqrt(C_sq.max())
+
+        # bound on the rounding error of a difference of two scores (and
+        # of two exact distances), relative to (|x| + max |c|)^2
+        rel_err = 4 * (X.shape[1] + 4) * np.finfo(np.float64).eps
+        if X.dtype.kind == 'f':
+            rel_err += 4 * np.finfo(X.dtype).eps
+
+        frame_block = max(1, _NEAREST_BLOCK_BYTES // (8 * min(
+            center_block, n_centers)))
+
+        recheck = []
+        for f_start in range(0, n_samples, frame_block):
+            f_stop = min(f_start + frame_block, n_samples)
+            Xb = np.asarray(X[f_start:f_stop], dtype=np.float64) - mu
+            second = np.full(f_stop - f_start, np.inf)
+            for c_start in range(0, n_centers, center_block):
+                c_stop = min(c_start + center_block, n_centers)
+                G = np.dot(Xb, C[c_start:c_stop].T)
+                _gemm_argmin(G, C_sq[c_start:c_stop], c_start,
+                             assignments[f_start:f_stop],
+                             distances[f_start:f_stop], second)
+
+            x_norm = np.sqrt(np.einsum('ij,ij->i', Xb, Xb))
+            close = (second - distances[f_start:f_stop]) <= \
+                rel_err * (x_norm + c_norm)**2
+            recheck.append(f_start + np.flatnonzero(close))
+
+        _euclidean_assigned(X, centers, assignments, distances)
+        _euclidean_nearest(
+            X, centers, np.concatenate(recheck).astype(np.intp),
+            assignments, distances)
+    elif metric in ('manhattan', 'hamming'):
+        kernel = _manhattan_nearest if metric == 'manhattan' \
+            else _hamming_nearest
+        for c_start in range(0, n_centers, center_block):
+            c_stop = min(c_start + center_block, n_centers)
+            kernel(X, centers, c_start, c_stop, assignments, distances)
+    else:
+        raise exception.ImproperlyConfigured(
+            "No nearest-center kernel for metric '%s'." % metric)
+
+    return assignments, distances
@@ -1,23 +1,27 @@
 import logging
+import os
+import tempfile
 
 import numpy as np
 import tables
 
 from enspara import ra
-from ..util.load import load_as_concatenated
+from ..util.load import (load_as_concatenated,
+                         load_cached_as_concatenated, sound_trajectories)
 from .. import exception
 
 from .. import mpi
-from .ops import assemble_striped_array
+from .ops import assemble_striped_array, stripe_owners
 
 logger = logging.getLogger(__name__)
 
 
-def load_h5_as_striped(filename, stride=1):
+def load_h5_as_striped(filename, stride=1, balanced=False):
     """Load HDF5 files into distributed arrays across nodes in an MPI swarm.
 
     Table i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, or, if `balanced`, as assigned by
+    enspara.mpi.ops.stripe_owners.
 
     Parameters
     ----------
@@ -27,6 +31,9 @@ def load_h5_as_striped(filename, stride=1):
         supports are supported by this function.
     stride : int, default=1
         Load only every stride-th frame.
+    balanced : bool, default=False
+        Assign tables to nodes so that each holds about the same number
+        of frames, rather than the same number of tables.
 
     Returns
     -------
@@ -53,29 +60,34 @@ def load_h5_as_striped(filename, stride=1):
     global_lengths = [s[0] for s in all_shapes]
 
     if len(all_keys) == 2 and 'array' in all_keys and 'lengths' in all_keys:
-        raise NotImplementedError(
-            'Parallel loading of RaggedArrays that have been stored as '
-            'arrays and lengths cannot be loaded in parallel.')
+        raise exception.ImproperlyConfigured(
+            "%s holds a RaggedArray stored as one array and its lengths, "
+            "which can't be loaded in parallel. Save it with ra.save, "
+            "which writes each row as its own node, to load it striped." %
+            filename)
+
+    owners = stripe_owners(global_lengths, balanced)
+    local_keys = [k for k, o in zip(all_keys, owners) if o == mpi.rank()]
 
-    local_data = ra.load(filename,
-                         keys=all_keys[mpi.rank()::mpi.size()],
-                         stride=stride)
+    local_data = ra.load(filename, keys=local_keys, stride=stride)
 
     if hasattr(local_data, '_data'):
         local_data = local_data._data
     else:
         # we shoud only get here if only one key is given to load
-        assert len(global_lengths[mpi.rank()::mpi.size()]) == 1
+        assert len(local_keys) == 1
         local_data = local_data
 
     return global_lengths, local_data
 
 
-def load_npy_as_striped(filenames, stride=1):
+def load_npy_as_striped(filenames, stride=1, memmap_dir=None,
+                        balanced=False):
     """Load ndarrays into distributed arrays across nodes in an MPI swarm.
 
     File i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, or, if `balanced`, as assigned by
+    enspara.mpi.ops.stripe_owners.
 
     Parameters
     ----------
@@ -85,6 +97,16 @@ def load_npy_as_striped(filenames, stride=1):
         supports are supported by this function.
     stride : int, default=1
         Load only every stride-th frame.
+    memmap_dir : str, default=None
+        If given, the data is not read into memory, but returned as a
+        read-only memory map. A node with one file and no stride maps
+        that file directly; otherwise, its files are first written to
+        one contiguous, uniquely named .npy file in this directory
+        (created if it doesn't exist), which is then mapped. That file is removed as soon as it is
+        mapped, so its space is freed when the map is closed.
+    balanced : bool, default=False
+        Assign files to nodes so that each holds about the same number
+        of frames, rather than the same number of files.
 
     Returns
     -------
@@ -115,23 +137,57 @@ def load_npy_as_striped(filenames, stride=1):
 
     global_lengths = [s[0] for s, d in specs]
     logger.debug("Determined global lengths to be %s", global_lengths)
-    local_lengths = [s[0] for s, d in specs[mpi.rank()::mpi.size()]]
-
-    local_data = np.empty((sum(local_lengths),) + shape0[1:],
-                          dtype=dtype)
-    logger.debug("Allocated array of shape %s and type %s",
-                 local_data.shape, local_data.dtype)
-
-    # TODO could be thread parallelized?
-    local_filenames = filenames[mpi.rank()::mpi.size()]
-    start = 0
-    for i, f in enumerate(local_filenames):
-        data = np.load(f, mmap_mode='r')
-        end = start + len(data[::stride])
-        logger.debug("Writing file %s to [%s:%s]", i, start, end)
-        local_data[start:end] = data[::stride]
-        start = end
-    assert end == len(local_data)
+    local = np.flatnonzero(
+        stripe_owners(global_lengths, balanced) == mpi.rank())
+    local_lengths = [len(range(0, specs[i][0][0], stride)) for i in local]
+    local_filenames = [filenames[i] for i in local]
+
+    if memmap_dir is not None and len(local_filenames) == 1 and stride == 1:
+        local_data = np.load(local_filenames[0], mmap_mode='r')
+        logger.debug("Mapped npy %s with shape %s.",
+                     local_filenames[0], local_data.shape)
+        return global_lengths, local_data
+
+    if memmap_dir is not None:
+        os.makedirs(memmap_dir, exist_ok=True)
+
+        # a unique name, so that concurrent runs sharing memmap_dir don't
+        # overwrite one another's data.
+        fd, memmap_fname = tempfile.mkstemp(
+            suffix='.npy', dir=memmap_dir,
+            prefix='striped-rank%s-of-%s-' % (mpi.rank(), mpi.size()))
+        os.close(fd)
+        local_data = np.lib.format.open_memmap(
+            memmap_fname, mode='w+', dtype=dtype,
+            shape=(sum(local_lengths),) + shape0[1:])
+        logger.debug("Created memmap %s of shape %s and type %s",
+                     memmap_fname, local_data.shape, local_data.dtype)
+    else:
+        local_data = np.empty((sum(local_lengths),) + shape0[1:],
+                              dtype=dtype)
+        logger.debug("Allocated array of shape %s and type %s",
+                     local_data.shape, local_data.dtype)
+
+    try:
+        # TODO could be thread parallelized?
+        start = 0
+        for i, f in enumerate(local_filenames):
+            data = np.load(f, mmap_mode='r')
+            end = start + len(data[::stride])
+            logger.debug("Writing file %s to [%s:%s]", i, start, end)
+            local_data[start:end] = data[::stride]
+            start = end
+        assert end == len(local_data)
+
+        if memmap_dir is not None:
+            local_data.flush()
+            del local_data
+            local_data = np.load(memmap_fname, mmap_mode='r')
+    finally:
+        # the map stays readable once its file is unlinked, and the
+        # file's space is freed when the map is closed.
+        if memmap_dir is not None:
+            os.remove(memmap_fname)
 
     logger.debug("Loaded %s npys into an array of shape %s.",
                  len(filenames), local_data.shape)
@@ -139,11 +195,13 @@ def load_npy_as_striped(filenames, stride=1):
     return global_lengths, local_data
 
 
-def load_trajectory_as_striped(filenames, *args, **kwargs):
+def load_trajectory_as_striped(filenames, *args, cache_dir=None,
+                               balanced=False, **kwargs):
     """Load trajectories into distributed arrays across nodes in an MPI swarm.
 
     File i is loaded by node i % n, where n is the number of nodes in
-    the swarm.
+    the swarm, or, if `balanced`, as assigned by
+    enspara.mpi.ops.stripe_owners.
 
     Parameters
     ----------
@@ -161,6 +219,20 @@ def load_trajectory_as_striped(filenames, *args, **kwargs):
     args : list, optional
         A list of dictionaries, each of which corresponds to additional
         kwargs to be passed to each of filenames.
+    cache_dir : str, optional
+        If given, each node memory-maps atom-sliced, centered
+        coordinates of its files from a coordinate store in this
+        directory, creating it if necessary (see
+        enspara.util.load.load_cached_as_concatenated). Requires args.
+    balanced : bool, default=False
+        Assign files to nodes so that each holds about the same number
+        of frames, rather than the same number of files. The length of
+        every file must then be known before loading, so each node
+        sounds a share of them (see enspara.util.load.sound_trajectories).
+    index_dir : str or False, optional
+        Directory of the trajectory length index consulted and updated
+        whenever lengths are sounded (see
+        enspara.util.load.sound_trajectories).
 
     Returns
     -------
@@ -179,16 +251,64 @@ def load_trajectory_as_striped(filenames, *args, **kwargs):
             "node must be given. MPI size is %s, number of files is %s."
             % (mpi.size(), len(filenames)))
 
+    if balanced:
+        global_lengths = _sound_as_striped(filenames, kwargs)
+        local = np.flatnonzero(
+            stripe_owners(global_lengths, balanced) == mpi.rank())
+    else:
+        local = np.arange(mpi.rank(), len(filenames), mpi.size())
+    local_filenames = [filenames[i] for i in local]
+
     # if we're specifying parameters separately for each trj to load, we
     # need to stripe those across nodes also.
     if 'args' in kwargs and len(kwargs['args']) > 1:
         assert len(kwargs['args']) == len(filenames)
-        kwargs['args'] = kwargs['args'].copy()[mpi.rank()::mpi.size()]
-
-    local_lengths, my_xyz = load_as_concatenated(
-        filenames=filenames[mpi.rank()::mpi.size()], *args, **kwargs)
+        kwargs['args'] = [kwargs['args'][i] for i in local]
+
+    if cache_dir is not None:
+        local_args = kwargs['args']
+        if len(local_args) == 1:
+            local_args = local_args * len(local_filenames)
+        local_lengths, my_xyz = load_cached_as_concatenated(
+            local_filenames, cache_dir, args=local_args,
+            lengths=list(global_lengths[local]) if balanced else None,
+            processes=kwargs.get('processes'),
+            index_dir=kwargs.get('index_dir'))
+    else:
+        local_lengths, my_xyz = load_as_concatenated(
+            filenames=local_filenames, *args, **kwargs)
 
     local_lengths = np.array(local_lengths, dtype=int)
-    global_lengths = assemble_striped_array(local_lengths)
+    if balanced:
+        assert np.all(local_lengths == global_lengths[local])
+    else:
+        global_lengths = assemble_striped_array(local_lengths)
 
     return global_lengths, my_xyz
+
+
+def _sound_as_striped(filenames, kwargs):
+    """Find the length of each of `filenames` (once loaded with the
+    stride in `kwargs`, or in each of `kwargs['args']`), with each node
+    sounding a share of them, using the length index in
+    `kwargs['index_dir']` (or the default one).
+    """
+
+    frames = np.zeros(len(filenames), dtype=int)
+    local = np.arange(mpi.rank(), len(filenames), mpi.size())
+    frames[local] = sound_trajectories(
+        [filenames[i] for i in local], processes=kwargs.get('processes'),
+        index_dir=kwargs.get('index_dir'))
+
+    global_frames = np.empty_like(frames)
+    mpi.comm.Allreduce(frames, global_frames, op=mpi.mpi4py.SUM)
+
+    if 'args' in kwargs and len(kwargs['args']) > 1:
+        strides = [a.get('stride', 1) or 1 for a in kwargs['args']]
+    elif 'args' in kwargs:
+        strides = [kwargs['args'][0].get('stride', 1) or 1] * len(filenames)
+    else:
+        strides = [kwargs.get('stride', 1) or 1] * len(filenames)
+
+    return np.array([len(range(0, n, s))
+                     for n, s in zip(global_frames, strides)], dtype=int)
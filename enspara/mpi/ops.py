@@ -1,3 +1,4 @@
+import heapq
 import logging
 import numpy as np
 
@@ -11,7 +12,69 @@ from ..cluster import util
 logger = logging.getLogger(__name__)
 
 
-def convert_local_indices(local_ctr_inds, global_lengths):
+def stripe_owners(global_lengths, balanced=False):
+    """Determine which node in an MPI swarm holds each trajectory (or
+    file, or row) of a striped dataset.
+
+    By default, trajectory i is held by node i % n. If `balanced`,
+    trajectories are instead assigned, longest first, to the node with
+    the fewest frames so far (ties going to the lowest rank), so that
+    nodes hold about the same number of frames even when trajectory
+    lengths vary widely. Either way, each node holds its trajectories
+    in increasing order, and every node computes the same assignment
+    from the same lengths.
+
+    Parameters
+    ----------
+    global_lengths : array-like
+        Length of each trajectory across all nodes.
+    balanced : bool, default=False
+        Balance nodes by number of frames, rather than by number of
+        trajectories.
+
+    Returns
+    -------
+    owners : np.ndarray, shape=(n_trajectories,)
+        Rank of the node holding each trajectory.
+    """
+
+    global_lengths = np.asarray(global_lengths, dtype=int)
+    n_ranks = mpi.size()
+
+    if not balanced:
+        return np.arange(len(global_lengths)) % n_ranks
+
+    owners = np.empty(len(global_lengths), dtype=int)
+    loads = [(0, rank) for rank in range(n_ranks)]
+    for i in np.argsort(-global_lengths, kind='stable'):
+        load, rank = heapq.heappop(loads)
+        owners[i] = rank
+        heapq.heappush(loads, (load + global_lengths[i], rank))
+
+    logger.debug("Balanced %s trajectories over %s nodes; frames per "
+                 "node range from %s to %s.", len(global_lengths), n_ranks,
+                 min(l for l, _ in loads), max(l for l, _ in loads))
+
+    return owners
+
+
+def _stripe_frames(global_lengths, owners, rank):
+    """Global index of each frame held by `rank`, in the order that
+    rank holds them.
+    """
+
+    global_lengths = np.asarray(global_lengths, dtype=int)
+    starts = np.concatenate([[0], np.cumsum(global_lengths)[:-1]])
+
+    files = np.flatnonzero(owners == rank)
+    lengths = global_lengths[files]
+    local_starts = np.cumsum(lengths) - lengths
+
+    return np.repeat(starts[files] - local_starts, lengths) + \
+        np.arange(lengths.sum())
+
+
+def convert_local_indices(local_ctr_inds, global_lengths, owners=None):
     """Convert indices from (rank, local_frame) to (global frame).
 
     In enspara's clustering code, we represent frames in the data set by
@@ -26,15 +89,20 @@ def convert_local_indices(local_ctr_inds, global_lengths):
     global_lengths : np.ndarray
         Array of the length of each trajectory distributed across all
         the nodes.
+    owners : np.ndarray, default=None
+        Rank holding each trajectory, as from `stripe_owners`. If None,
+        trajectory i is held by rank i % n.
     """
 
-    global_indexing = np.arange(np.sum(global_lengths))
-    file_origin_ra = ra.RaggedArray(global_indexing, lengths=global_lengths)
+    if owners is None:
+        owners = stripe_owners(global_lengths)
 
+    rank_frames = {}
     ctr_inds = []
     for rank, local_fid in local_ctr_inds:
-        global_fid = file_origin_ra[rank::mpi.size()].flatten()[local_fid]
-        ctr_inds.append(global_fid)
+        if rank not in rank_frames:
+            rank_frames[rank] = _stripe_frames(global_lengths, owners, rank)
+        ctr_inds.append(rank_frames[rank][local_fid])
 
     return ctr_inds
 
@@ -79,7 +147,7 @@ def assemble_striped_array(local_arr):
     return global_arr
 
 
-def assemble_striped_ragged_array(local_array, global_lengths):
+def assemble_striped_ragged_array(local_array, global_lengths, owners=None):
     """Assemble an array that is striped according to the first dim of a
     ragged array.
 
@@ -97,6 +165,9 @@ def assemble_striped_ragged_array(local_array, global_lengths):
     global_lengths: np.ndarray
         Lengths for each row of the RA. The ultimate assembled RA will
         have this as it's lengths attribute.
+    owners : np.ndarray, default=None
+        Rank holding each row, as from `stripe_owners`. If None, row i
+        is held by rank i % n.
 
     Returns
     -------
@@ -106,23 +177,20 @@ def assemble_striped_ragged_array(local_array, global_lengths):
 
     assert np.issubdtype(type(global_lengths[0]), np.integer)
 
-    global_array = np.zeros(shape=(np.sum(global_lengths),)) - 1
-    global_ra = ra.RaggedArray(global_array, lengths=global_lengths)
+    if owners is None:
+        owners = stripe_owners(global_lengths)
+
+    # allocated at the dtype of the local arrays, so that e.g. float32
+    # distances are never held at double precision.
+    global_array = np.full(np.sum(global_lengths), -1,
+                           dtype=local_array.dtype)
 
     for rank in range(mpi.size()):
         rank_array = mpi.comm.bcast(local_array, root=rank)
+        global_array[_stripe_frames(global_lengths, owners, rank)] = \
+            rank_array
 
-        local_lengths = global_lengths[rank::mpi.size()]
-        if len(local_lengths) > 1:
-            rank_ra = ra.RaggedArray(
-                rank_array, lengths=local_lengths)
-            global_ra[rank::mpi.size()] = rank_ra
-        else:
-            global_ra[rank] = rank_array
-
-    assert np.all(global_ra._data) >= 0
-
-    return global_ra._data.astype(local_array.dtype)
+    return global_array
 
 
 def striped_array_max(local_array):
@@ -140,6 +208,51 @@ def striped_array_max(local_array):
     return global_max
 
 
+def striped_array_argmax(local_array, *payloads):
+    """Find the maximum of an array striped across MPI nodes, and where
+    it is, with a single allreduce.
+
+    Each node contributes its local maximum, located by the tuple
+    (rank, local_index, payload[local_index], ...), to a MAXLOC
+    reduction. As with np.argmax, ties are broken toward the first
+    occurrence: the lowest rank and, within it, the lowest index.
+
+    Parameters
+    ----------
+    local_array : np.ndarray
+        This node's share of the striped array.
+    *payloads : np.ndarray
+        Arrays striped like `local_array`, whose values at the maximum
+        are returned along with it.
+
+    Returns
+    -------
+    max : scalar
+        The global maximum of the striped array.
+    owner_rank : int
+        Rank of the node holding the maximum.
+    local_index : int
+        Position of the maximum in `local_array` on `owner_rank`.
+    *values : scalar
+        The value of each of `payloads` at the maximum.
+    """
+
+    # a node holding none of the array contributes -inf
+    if len(local_array) > 0:
+        local_index = int(np.argmax(local_array))
+        local_max = local_array[local_index]
+        loc = (mpi.rank(), local_index) + \
+            tuple(p[local_index] for p in payloads)
+    else:
+        local_max = -np.inf
+        loc = (mpi.rank(), -1) + (None,) * len(payloads)
+
+    global_max, loc = mpi.comm.allreduce(
+        (local_max, loc), op=mpi.mpi4py.MAXLOC)
+
+    return (global_max,) + tuple(loc)
+
+
 def striped_array_mean(local_array):
     """Compute the mean of an array striped across MPI nodes.
 
@@ -166,7 +279,7 @@ def striped_array_mean(local_array):
     return global_sum / global_len
 
 
-def distribute_frame(data, world_index, owner_rank):
+def distribute_frame(data, world_index, owner_rank, nonblocking=False):
     """Distribute an element of an array to every node in an MPI swarm.
 
     Parameters
@@ -178,13 +291,19 @@ def distribute_frame(data, world_index, owner_rank):
         Position of the target frame in `data` on the node that owns it
     owner_rank : int
         Rank of the node that owns the datum that we'll broadcast.
-    out : array-like or md.Trajectory
-        An array or trajectory to place the new data into.
+    nonblocking : bool, default=False
+        Broadcast the frame with a non-blocking collective, and return
+        the request along with the frame. The frame can be used on the
+        owner right away (e.g. to overlap computation with the
+        broadcast), but on other nodes only once the request completes.
 
     Returns
     -------
     frame : array-like or md.Trajectory
         A single slice of `data`, of shape `data.shape[1:]`.
+    request : mpi4py.MPI.Request
+        If `nonblocking`, the request for the broadcast, which must be
+        waited on.
     """
 
     if owner_rank >= mpi.size():
@@ -192,22 +311,33 @@ def distribute_frame(data, world_index, owner_rank):
             'In MPI swarm of size %s, recieved owner rank == %s.',
             mpi.size(), owner_rank)
 
+    # allocated from the shape of `data`, rather than its first frame,
+    # so that a node holding no frames can still receive one.
     if hasattr(data, 'xyz'):
         if mpi.rank() == owner_rank:
             frame = data[world_index].xyz
         else:
-            frame = np.empty_like(data[0].xyz)
+            frame = np.empty((1,) + data.xyz.shape[1:], dtype=data.xyz.dtype)
     else:
         if mpi.rank() == owner_rank:
             frame = data[world_index]
         else:
-            frame = np.empty_like(data[0])
+            frame = np.empty(data.shape[1:], dtype=data.dtype)
 
-    mpi.comm.Bcast(frame, root=owner_rank)
+    if nonblocking:
+        request = mpi.comm.Ibcast(frame, root=owner_rank)
+        # the send buffer can't be modified (e.g. centered) until the
+        # broadcast completes, so the owner gets its own copy.
+        if mpi.rank() == owner_rank:
+            frame = frame.copy()
+    else:
+        mpi.comm.Bcast(frame, root=owner_rank)
 
     if hasattr(data, 'xyz'):
-        wrapped_data = type(data)(xyz=frame, topology=data.top)
-        return wrapped_data
+        frame = type(data)(xyz=frame, topology=data.top)
+
+    if nonblocking:
+        return frame, request
     else:
         return frame
 
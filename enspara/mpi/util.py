@@ -18,6 +18,10 @@ class DummyComm:
     def Bcast(v, root=0):
         return DummyComm.bcast(v, root)
 
+    def Ibcast(v, root=0):
+        DummyComm.bcast(v, root)
+        return DummyRequest
+
 
     def allgather(v):
         return [v]
@@ -25,12 +29,27 @@ class DummyComm:
     def allreduce(v, op):
         return v
 
+    def Allreduce(sendbuf, recvbuf, op):
+        recvbuf[...] = sendbuf
+
+
+class DummyRequest:
+
+    def Wait():
+        pass
+
 
 class dummy_mpi4py:
 
     def MAX(*args):
         return max(*args)
 
+    def SUM(*args):
+        return sum(*args)
+
+    def MAXLOC(*args):
+        return max(*args)
+
 
 def mpiabort_excepthook(type, value, traceback):
     """A replacement of sys.__excepthook__ that explicitly aborts MPI.
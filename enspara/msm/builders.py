@@ -15,13 +15,13 @@ import scipy.sparse.linalg
 from enspara import exception
 
 from .transition_matrices import eq_probs
-from .libmsm import _mle_prinz_dense
+from .libmsm import _mle_prinz_dense, _mle_prinz_sparse
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def mle(C, prior_counts=None, calculate_eq_probs=True):
+def mle(C, prior_counts=None, calculate_eq_probs=True, warm_start=None):
     """Transform a counts matrix to a probability matrix using
     maximum-liklihood estimation (prinz) method.
 
@@ -37,6 +37,10 @@ def mle(C, prior_counts=None, calculate_eq_probs=True):
         matrix T. This flag is provided for compatibility with other
         builders only, as it has no effect in MLE (and, in fact, emits a
         warning).
+    warm_start : tuple (T, eq_probs), default=None
+        A transition probability matrix and its equilibrium
+        probabilities (e.g. from an MLE fit at a neighbouring lag time)
+        from which to start the iteration. Only used for sparse `C`.
 
     Returns
     -------
@@ -47,6 +51,12 @@ def mle(C, prior_counts=None, calculate_eq_probs=True):
     eq_probs : array, shape=(n_states)
         Equilibrium probability distribution of `T`.
 
+    Notes
+    -----
+    Sparse counts matrices are fit without ever being densified, so
+    memory and time per iteration scale with the number of nonzero
+    counts (see `libmsm._mle_prinz_sparse`).
+
     See Also
     --------
     msmbuilder.msm.MarkovStateModel and
@@ -60,22 +70,26 @@ def mle(C, prior_counts=None, calculate_eq_probs=True):
 
     C = _apply_prior_counts(C, prior_counts)
 
-    sparsetype = np.array
-    if scipy.sparse.issparse(C):
-        sparsetype = type(C)
-        C = C.todense()
-
-    equilibrium = None
     if not calculate_eq_probs:
         warnings.warn('MLE method cannot suppress calculation of '
                       'equilibrium probabilities, since they are calculated '
                       'together.', category=RuntimeWarning)
-        T, _ = _prinz_mle_py(C)
+
+    if scipy.sparse.issparse(C):
+        X0 = None
+        if warm_start is not None:
+            T0, pi0 = warm_start
+            X0 = scipy.sparse.diags(np.asarray(pi0).reshape(-1)) @ \
+                scipy.sparse.csr_matrix(T0)
+        T, equilibrium = _prinz_mle(C, X0=X0)
+        T = type(C)(T)
     else:
         T, equilibrium = _prinz_mle_py(C)
+        C = np.array(C)
+        T = np.array(T)
 
-    C = sparsetype(C)
-    T = sparsetype(T)
+    if not calculate_eq_probs:
+        equilibrium = None
 
     return C, T, equilibrium
 
@@ -207,7 +221,7 @@ def _row_normalize(C):
 def _prinz_mle(C, *args, **kwargs):
 
     if scipy.sparse.issparse(C):
-        assert False
+        return _mle_prinz_sparse(C, *args, **kwargs)
     else:
         return _mle_prinz_dense(C, *args, **kwargs)
 
@@ -306,8 +320,8 @@ def _prinz_mle_py(C, tol=1e-10, max_iter=10**5):
 
     if n_iter == max_iter - 1:
         warnings.warn(
-            exception.ConvergenceWarning,
-            "Prinz MLE did not converge after %s iterations." % n_iter)
+            "Prinz MLE did not converge after %s iterations." % n_iter,
+            exception.ConvergenceWarning)
 
     T = X / X.sum(axis=-1).reshape(len(X), 1)
     pi = X_rs / X_rs.sum()[..., None]
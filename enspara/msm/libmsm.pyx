@@ -1,14 +1,21 @@
 import warnings
 import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
 
 from enspara import exception
 
+from cython.parallel import prange
+
 cimport cython
 cimport numpy as np
 
 cdef extern from "math.h" nogil:
     double sqrt(double x)
     double log10(double x)
+    double log(double x)
+    double exp(double x)
 
 @cython.boundscheck(False) # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
@@ -86,8 +93,8 @@ def _mle_prinz_dense(
 
     if n_iter == max_iter - 1:
         warnings.warn(
-            exception.ConvergenceWarning,
-            "Prinz MLE did not converge after %s iterations." % n_iter)
+            "Prinz MLE did not converge after %s iterations." % n_iter,
+            exception.ConvergenceWarning)
 
     T = X / X.sum(axis=-1).reshape(len(X), 1)
     pi = X_rs / X_rs.sum()
@@ -96,3 +103,201 @@ def _mle_prinz_dense(
     assert np.sum(pi) - 1 < 1e-14
 
     return T, pi
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _prinz_sparse_rows(const np.int64_t[::1] indptr,
+                       const np.int64_t[::1] indices,
+                       const np.float64_t[::1] S_data,
+                       const np.float64_t[::1] C_data,
+                       const np.float64_t[::1] y,
+                       np.float64_t[::1] sig,
+                       np.float64_t[::1] flow,
+                       np.float64_t[::1] flow_rs,
+                       np.float64_t[::1] T_data):
+    # for each nonzero S_ij, sig = expit(y_i - y_j) and flow = S_ij sig,
+    # which is l_i X_ij; T is flow over its row sum. Returns the
+    # log-likelihood of T over the nonzeros of C (laid out like S).
+
+    cdef long n_states = indptr.shape[0] - 1
+    cdef long i, k
+    cdef double d, e, rs, row_logl
+    cdef double logl = 0
+
+    for i in prange(n_states, nogil=True, schedule='guided'):
+        rs = 0
+        for k in range(indptr[i], indptr[i+1]):
+            d = y[i] - y[indices[k]]
+            if d >= 0:
+                sig[k] = 1 / (1 + exp(-d))
+            else:
+                e = exp(d)
+                sig[k] = e / (1 + e)
+            flow[k] = S_data[k] * sig[k]
+            rs = rs + flow[k]
+        flow_rs[i] = rs
+
+        row_logl = 0
+        for k in range(indptr[i], indptr[i+1]):
+            T_data[k] = flow[k] / rs
+            if C_data[k] > 0:
+                row_logl = row_logl + C_data[k] * log(T_data[k])
+        logl += row_logl
+
+    return logl
+
+
+def _mle_prinz_sparse(C, double tol=1e-15, long max_iter=100, X0=None):
+    """Fit a transition probability matrix to sparse counts `C` with the
+    detailed balance-enforced maximum-likelihood (Prinz) method.
+
+    The fixed-point iteration of `_mle_prinz_dense` needs many thousands
+    of sweeps to converge on large, metastable counts matrices, so this
+    solves for the same estimate with Newton's method instead. At the
+    maximum, the flux matrix is X_ij = S_ij / (l_i + l_j), where
+    S = C + C.T and l_i = c_i / x_i is the ratio of the counts out of
+    state i to its flux. Writing l = exp(y), y minimizes the convex
+    function
+
+        f(y) = sum_{i<j} S_ij log(exp(y_i) + exp(y_j))
+               - sum_i (c_i - C_ii) y_i,
+
+    whose Hessian is a weighted graph Laplacian on the nonzeros of S.
+    Each Newton step is then one sparse linear solve (by preconditioned
+    conjugate gradients), so memory and time scale with the number of
+    observed transitions rather than n_states**2. After each step, T and
+    its log-likelihood over the nonzeros of C are computed row by row
+    in parallel with OpenMP; iteration stops when a step gains no more
+    than `tol` log-likelihood per observed transition.
+
+    Parameters
+    ----------
+    C : scipy.sparse matrix, shape=(n_states, n_states)
+        Transition counts.
+    tol : float, default=1e-15
+        Gain in log-likelihood per observed transition (i.e. divided by
+        the total number of counts) below which a Newton step is
+        considered to have converged. Near the optimum, T changes by
+        about the square root of this per step.
+    max_iter : int, default=100
+        The maximum number of Newton steps. If it is reached, a
+        ConvergenceWarning is emitted.
+    X0 : array or scipy.sparse matrix, shape=(n_states, n_states)
+        Initial (symmetric, up to scale) estimate of the flux matrix
+        pi_i T_ij, e.g. from an earlier fit. By default, C + C.T.
+
+    Returns
+    -------
+    T : scipy.sparse.csr_matrix, shape=(n_states, n_states)
+        Transition probabilities matrix derived from `C`.
+    pi : np.ndarray, shape=(n_states,)
+        Equilibrium probabilities of `T`.
+    """
+
+    C = scipy.sparse.csr_matrix(C, dtype=np.float64)
+    C.sum_duplicates()
+    n_states = C.shape[0]
+
+    S = (C + C.T).tocsr()
+    S.sum_duplicates()
+    S.sort_indices()
+
+    # C's nonzeros are a subset of S's, so this lays C out like S
+    C_S = (C + S).tocsr()
+    C_S.sort_indices()
+    C_data = C_S.data - S.data
+
+    indptr = S.indptr.astype(np.int64)
+    indices = S.indices.astype(np.int64)
+    rows = np.repeat(np.arange(n_states), np.diff(S.indptr))
+    cols = S.indices
+    upper = rows < cols
+    off_diag = rows != cols
+
+    C_rs = np.asarray(C.sum(axis=1), dtype=np.float64).reshape(-1)
+    C_diag = C.diagonal()
+    n_counts = C_rs.sum()
+
+    if not np.all(C_rs > 0):
+        raise exception.DataInvalid(
+            "Prinz MLE requires at least one transition out of every "
+            "state, but %s states have none." % np.sum(C_rs <= 0))
+
+    if X0 is None:
+        X_rs = np.asarray(S.sum(axis=1)).reshape(-1)
+    else:
+        X0 = scipy.sparse.csr_matrix(X0, dtype=np.float64)
+        X_rs = np.asarray(
+            (X0 + X0.T).multiply(S > 0).sum(axis=1)).reshape(-1)
+        if not np.all(X_rs > 0):
+            raise exception.DataInvalid(
+                "The initial estimate X0 gives %s states no flux." %
+                np.sum(X_rs <= 0))
+
+    y = np.log(C_rs / X_rs)
+
+    # f (and so y) is only defined up to a constant on each connected
+    # component of S, so hold one state of each fixed.
+    _, labels = scipy.sparse.csgraph.connected_components(
+        S, directed=False)
+    free = np.ones(n_states, dtype=bool)
+    free[np.unique(labels, return_index=True)[1]] = False
+
+    def f(y):
+        return (np.dot(S.data[upper],
+                       np.logaddexp(y[rows[upper]], y[cols[upper]])) +
+                np.dot(C_diag - C_rs, y))
+
+    sig = np.empty(S.nnz)
+    flow = np.empty(S.nnz)
+    flow_rs = np.empty(n_states)
+    T_vals = np.empty(S.nnz)
+    logl = _prinz_sparse_rows(indptr, indices, S.data, C_data, y,
+                              sig, flow, flow_rs, T_vals)
+
+    for n_iter in range(1, max_iter + 1):
+        grad = flow_rs - C_rs
+
+        w = np.where(off_diag, flow * (1 - sig), 0)
+        H = scipy.sparse.csr_matrix((-w, cols, S.indptr),
+                                    shape=(n_states, n_states))
+        H = (H + scipy.sparse.diags(
+            np.bincount(rows, weights=w, minlength=n_states))).tocsr()
+        H = H[free][:, free]
+
+        step = np.zeros(n_states)
+        if H.shape[0] > 0:
+            h_diag = H.diagonal()
+            inv_diag = np.divide(1, h_diag, out=np.zeros_like(h_diag),
+                                 where=h_diag > 0)
+            step[free], _ = scipy.sparse.linalg.cg(
+                H, -grad[free], M=scipy.sparse.diags(inv_diag))
+
+        # backtrack until the step decreases f enough (Armijo)
+        f_y, slope, alpha = f(y), np.dot(grad, step), 1.0
+        while f(y + alpha * step) > f_y + 1e-4 * alpha * slope and \
+                alpha > 1e-10:
+            alpha /= 2
+        y = y + alpha * step
+
+        old_logl = logl
+        logl = _prinz_sparse_rows(indptr, indices, S.data, C_data, y,
+                                  sig, flow, flow_rs, T_vals)
+
+        if logl - old_logl <= tol * n_counts:
+            break
+    else:
+        warnings.warn(
+            "Prinz MLE did not converge after %s iterations." % max_iter,
+            exception.ConvergenceWarning)
+
+    T = scipy.sparse.csr_matrix(
+        (T_vals, S.indices, S.indptr), shape=(n_states, n_states))
+
+    # x_i = flow_rs_i / l_i
+    log_x = np.log(flow_rs) - y
+    pi = np.exp(log_x - log_x.max())
+    pi /= pi.sum()
+
+    return T, pi
@@ -75,6 +75,24 @@ class MSM(SklearnBaseEstimator):
             lag_time=self.lag_time,
             sliding_window=self.sliding_window)
 
+        self.fit_counts(tcounts)
+
+    def fit_counts(self, tcounts):
+        '''Trims states (if applicable), computes a mapping from new to
+        old state numbering and fits the transition probability matrix
+        with the given `method`, from an already-counted transition
+        count matrix.
+
+        This allows the counts at several lag times to be found at once
+        (see `transition_matrices.assigns_to_counts_by_lag`) and shared
+        between models.
+
+        Parameters
+        ----------
+        tcounts : array-like, shape=(n_states, n_states)
+            Transition counts at this model's `lag_time`.
+        '''
+
         if self.trim:
             original_state_count = tcounts.shape[0]
             self.mapping_, tcounts = trim_disconnected(tcounts)
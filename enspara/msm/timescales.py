@@ -1,9 +1,11 @@
 import logging
+import multiprocessing as mp
 
 import numpy as np
+from scipy.sparse.linalg import ArpackNoConvergence
 
-from .transition_matrices import assigns_to_counts, eigenspectrum, \
-    trim_disconnected
+from .transition_matrices import assigns_to_counts, \
+    assigns_to_counts_by_lag, eigenspectrum, trim_disconnected
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -22,15 +24,24 @@ def calc_imp_times(assigns, lag_time, n_states, n_times, method,
         lag_time=lag_time,
         sliding_window=sliding_window)
 
+    return _imp_times_from_counts(C, lag_time, n_times, method, trim)
+
+
+def _imp_times_from_counts(C, lag_time, n_times, method, trim):
+    """Compute the implied timescales of the model built by `method`
+    from the transition counts `C`, observed at `lag_time`.
+    """
+
     if trim:
         mapping, C = trim_disconnected(C)
 
-    _, T, _ = method(C)
+    _, T, eq_probs = method(C)
 
     n_times += 1  # +1 accounts for eq pops
 
     try:
-        e_vals, e_vecs = eigenspectrum(T, n_eigs=n_times)
+        # with eq_probs, reversible models use a symmetric eigensolver
+        e_vals, e_vecs = eigenspectrum(T, n_eigs=n_times, eq_probs=eq_probs)
     except ArpackNoConvergence:
         logger.error("ArpackNoConvergence for lag time %s frames", lag_time)
         raise
@@ -42,7 +53,7 @@ def calc_imp_times(assigns, lag_time, n_states, n_times, method,
 
 def implied_timescales(
         assigns, lag_times, method, n_times=None,
-        sliding_window=True, trim=False):
+        sliding_window=True, trim=False, n_procs=1):
     """Calculate the implied timescales across a range of lag times.
 
     Parameters
@@ -67,6 +78,12 @@ def implied_timescales(
     sliding_window : bool, default=True
         Whether to use a sliding window for counting transitions or to
         take every lag_time'th state.
+    n_procs : int, default=1
+        The number of processes across which to build models and
+        compute eigenspectra for the lag times. Transitions at every lag
+        time are counted in this process beforehand, so only the count
+        matrices (and `method`, which must then be picklable) are sent
+        to each worker.
 
     Returns
     -------
@@ -83,11 +100,21 @@ def implied_timescales(
     if n_times > n_states - 1:  # -1 accounts for eq pops
         n_times = n_states - 1
 
-    implied_times_list = []
-    for t in lag_times:
-        tscale = calc_imp_times(assigns, t, n_states, n_times,
-                                method, sliding_window, trim)
+    # count at every lag time in one go, rather than re-reading the
+    # assignments for each.
+    counts = assigns_to_counts_by_lag(
+        assigns, lag_times, max_n_states=n_states,
+        sliding_window=sliding_window)
+
+    jobs = [(C, t, n_times, method, trim)
+            for t, C in zip(lag_times, counts)]
+    del counts
 
-        implied_times_list.append(tscale)
+    if n_procs > 1 and len(jobs) > 1:
+        with mp.Pool(processes=min(n_procs, len(jobs))) as pool:
+            implied_times_list = pool.starmap(
+                _imp_times_from_counts, jobs, chunksize=1)
+    else:
+        implied_times_list = [_imp_times_from_counts(*job) for job in jobs]
 
     return np.array(implied_times_list)
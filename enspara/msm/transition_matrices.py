@@ -18,10 +18,22 @@ import scipy.sparse.linalg
 from scipy.sparse.csgraph import connected_components
 
 from .. import exception
+from ..ra import RaggedArray
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# assigns_to_counts tallies transitions with a dense np.bincount when
+# there are at most this many (or as many as there are transitions)
+# possible (i, j) pairs, and by sorting otherwise.
+DENSE_COUNT_LIMIT = 2**22
+
+# eigenspectrum solves for every eigenpair of matrices with fewer than
+# this many states, and otherwise only for those requested. Below about
+# a thousand states, LAPACK finds all of them about as fast as ARPACK
+# finds a few, and it never fails to converge.
+FULL_EIG_MAX_STATES = 1000
+
 
 class TrimMapping:
     """The TrimMapping maps state ids before and after ergodic trimming.
@@ -112,13 +124,16 @@ class TrimMapping:
 
 def assigns_to_counts(
         assigns, lag_time, max_n_states=None, sliding_window=True):
-    """Count transitions between states in a single trajectory.
+    """Count transitions between states in a set of trajectories.
+
+    Frames assigned to -1 are dropped before counting, so that the
+    frames on either side of them are treated as adjacent.
 
     Parameters
     ----------
-    assigns : array, shape=(traj_len, )
-        A 2-D array where each row is a trajectory consisting of a
-        sequence of state indices.
+    assigns : array, shape=(n_trajectories, traj_len) or RaggedArray
+        A 2-D array or RaggedArray where each row is a trajectory
+        consisting of a sequence of state indices.
     lag_time : int
         The lag time (i.e. observation interval) for counting
         transitions.
@@ -132,45 +147,77 @@ def assigns_to_counts(
 
     Returns
     -------
-    C :  array, shape=(n_states, n_states)
+    C :  scipy.sparse.csr_matrix, shape=(n_states, n_states)
         A transition count matrix.
     """
 
-    if not isinstance(lag_time, numbers.Integral):
-        raise exception.DataInvalid(
-            "The lag time must be an integer. Got %s type %s." %
-            lag_time, type(lag_time))
-    if lag_time < 1:
-        raise exception.DataInvalid(
-            "Lag times must be be strictly greater than 0. Got '%s'." %
-            lag_time)
+    return assigns_to_counts_by_lag(
+        assigns, [lag_time], max_n_states=max_n_states,
+        sliding_window=sliding_window)[0]
 
-    # if it's 1d, later stuff will fail
-    if len(assigns.shape) == 1:
-        raise exception.DataInvalid(
-            'The given assignments array has 1-dimensional shape %s. '
-            'Two dimensional shapes = (n_trj, n_frames) are expected. '
-            'If this is really what you want, try using '
-            'assignments.reshape(1, -1) to create a single-row 2d array.')
 
-    assigns = np.array([a[np.where(a != -1)] for a in assigns], dtype='O')
+def assigns_to_counts_by_lag(
+        assigns, lag_times, max_n_states=None, sliding_window=True):
+    """Count transitions between states in a set of trajectories at each
+    of several lag times.
+
+    This is equivalent to calling `assigns_to_counts` once per lag time,
+    but the assignments are only prepared (flattened, stripped of -1
+    frames and indexed by trajectory) once. Each lag time then takes a
+    single vectorized pass over them.
+
+    Parameters
+    ----------
+    assigns : array, shape=(n_trajectories, traj_len) or RaggedArray
+        A 2-D array or RaggedArray where each row is a trajectory
+        consisting of a sequence of state indices.
+    lag_times : list of int
+        The lag times (i.e. observation intervals) at which to count
+        transitions.
+    max_n_states : int, default=None
+        The number of states. If not given, the largest state index in
+        `assigns` plus one. All count matrices have this shape.
+    sliding_window : bool, default=True
+        Whether to use a sliding window for counting transitions or to
+        take every lag_time'th state.
+
+    Returns
+    -------
+    counts : list of scipy.sparse.csr_matrix, shape=(n_states, n_states)
+        The transition count matrix at each of `lag_times`.
+
+    See Also
+    --------
+    assigns_to_counts
+    """
+
+    for lag_time in lag_times:
+        if not isinstance(lag_time, numbers.Integral):
+            raise exception.DataInvalid(
+                "The lag time must be an integer. Got %s type %s." %
+                (lag_time, type(lag_time)))
+        if lag_time < 1:
+            raise exception.DataInvalid(
+                "Lag times must be be strictly greater than 0. Got '%s'." %
+                lag_time)
+
+    data, lengths = _flatten_assigns(assigns)
+    data, position = _strip_unassigned(data, lengths)
 
     if max_n_states is None:
-        max_n_states = np.concatenate(assigns).max() + 1
+        max_n_states = int(data.max()) + 1 if len(data) else 0
+    elif len(data) and data.max() >= max_n_states:
+        raise exception.DataInvalid(
+            "Found state %s in assignments, but max_n_states is %s." %
+            (data.max(), max_n_states))
 
-    transitions = [
-        _transitions_helper(
-            assign, lag_time=lag_time, sliding_window=sliding_window)
-        for assign in assigns]
-    # generate sparse matrix
-    mat_coords = np.hstack(transitions)
-    mat_data = np.ones(mat_coords.shape[1], dtype=int)
-    C = scipy.sparse.coo_matrix(
-        (mat_data, mat_coords), shape=(max_n_states, max_n_states))
-    return C
+    return [_count_transitions(data, position, lag_time, max_n_states,
+                               sliding_window)
+            for lag_time in lag_times]
 
 
-def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30):
+def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30,
+                  eq_probs=None):
     """Compute the eigenvectors and eigenvalues of a transition
     probability matrix.
 
@@ -180,15 +227,25 @@ def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30):
         A transition probability matrix.
     n_eigs : int, optional
         The number of eigenvalues and eigenvectors to compute. If not
-        speficied, all are computed.
+        speficied, all are computed. If fewer than n_states - 1 are
+        requested from a matrix with at least FULL_EIG_MAX_STATES
+        states, only those are computed, with the (ARPACK) sparse
+        eigenvalue solver, even if `T` is dense. If ARPACK doesn't
+        converge, all eigenpairs are computed instead.
     left: bool, default=False
         Compute the left eigenvalues rather than the right eigenvalues.
     maxiter : int, default=100000
         Limit the maximum number of iterations used by the sparse
-        eigenvalue solver. (Used only for sparse matrices.)
+        eigenvalue solver. (Not used when all eigenpairs are computed.)
     tol : float, default=1e-30
-        Relative accuracy for eigenvalues (stopping criterion). (Used
-        only for sparse matrices.)
+        Relative accuracy for eigenvalues (stopping criterion). (Not
+        used when all eigenpairs are computed.)
+    eq_probs : array, shape=(n_states,), optional
+        Equilibrium probabilities of `T` (e.g. as returned by
+        `builders.transpose` or `builders.mle`). If given, and `T`
+        obeys detailed balance with respect to them, the spectrum is
+        found with a symmetric eigensolver (see
+        `reversible_eigenspectrum`).
 
     Returns
     -------
@@ -206,18 +263,38 @@ def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30):
             ("Trying to compute {n} eigenvalues from an {s} x {s} matrix " +
              "yields only {s} eigenvalues.").format(n=n_eigs, s=T.shape[0]))
 
+    if eq_probs is not None:
+        if is_reversible(T, eq_probs):
+            vals, left_vecs, right_vecs = reversible_eigenspectrum(
+                T, eq_probs, n_eigs=n_eigs, maxiter=maxiter, tol=tol)
+            vecs = left_vecs if left else right_vecs
+            vecs[:, 0] /= vecs[:, 0].sum()
+            return vals, vecs
+        logger.debug("T doesn't obey detailed balance with respect to "
+                     "eq_probs, using the nonsymmetric eigensolver.")
+
     # left eigenvectors input processing (?)
     T = T.T if left else T
 
-    # performance improvement for small arrays; also prevents erroring
-    # out when ndim - 2 <= n_eigs and T is sparse.
-    if T.shape[0] < 1000 and scipy.sparse.issparse(T):
-        T = T.toarray()
-
-    if scipy.sparse.issparse(T):
-        vals, vecs = scipy.sparse.linalg.eigs(
-            T.tocsr(), n_eigs, which="LR", maxiter=maxiter, tol=tol)
-    else:
+    # the sparse solver can't find n_states - 1 or more eigenpairs, and
+    # for small matrices it's no faster than finding them all.
+    partial = n_eigs < T.shape[0] - 1 and T.shape[0] >= FULL_EIG_MAX_STATES
+
+    if partial:
+        if scipy.sparse.issparse(T):
+            T = T.tocsr()
+        try:
+            vals, vecs = scipy.sparse.linalg.eigs(
+                T, n_eigs, which="LR", maxiter=maxiter, tol=tol)
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            logger.warning(
+                "ARPACK didn't converge on %s eigenpairs in %s iterations; "
+                "computing all of them instead.", n_eigs, maxiter)
+            partial = False
+
+    if not partial:
+        if scipy.sparse.issparse(T):
+            T = T.toarray()
         vals, vecs = scipy.linalg.eig(T)
 
     order = np.argsort(-np.real(vals))
@@ -233,6 +310,134 @@ def eigenspectrum(T, n_eigs=None, left=True, maxiter=100000, tol=1E-30):
     return vals, vecs
 
 
+def reversible_eigenspectrum(
+        T, eq_probs, n_eigs=None, maxiter=100000, tol=1E-30):
+    """Compute the eigenvalues and both the left and right eigenvectors
+    of a transition probability matrix that obeys detailed balance.
+
+    Such a T is similar to the symmetric matrix pi^1/2 T pi^-1/2, so
+    its spectrum can be found with a symmetric eigensolver (eigh, which
+    can find just the top eigenpairs of a dense matrix, or eigsh when
+    few are requested of a large sparse matrix). This is faster and
+    more stable than the general solver, and gives real eigenvalues.
+
+    Parameters
+    ----------
+    T : array, shape=(n_states, n_states)
+        A transition probability matrix in detailed balance with
+        respect to `eq_probs`.
+    eq_probs : array, shape=(n_states,)
+        The (strictly positive) equilibrium probabilities of `T`.
+    n_eigs : int, optional
+        The number of eigenvalues and eigenvectors to compute. If not
+        speficied, all are computed.
+    maxiter : int, default=100000
+        Limit the maximum number of iterations used by the sparse
+        eigenvalue solver.
+    tol : float, default=1e-30
+        Relative accuracy for eigenvalues (stopping criterion) used by
+        the sparse eigenvalue solver.
+
+    Returns
+    -------
+    vals, left_vecs, right_vecs : 3-tuple, (ndarray, ndarray, ndarray)
+        Eigenvalues, in descending order, and the corresponding left
+        and right eigenvectors. Left and right eigenvectors are
+        normalized so that left_vecs.T @ right_vecs is the identity,
+        with left_vecs[:, 0] equal to `eq_probs` and right_vecs[:, 0]
+        to ones.
+
+    See Also
+    --------
+    eigenspectrum, is_reversible
+    """
+
+    n_states = T.shape[0]
+    n_eigs = n_states if n_eigs is None else min(n_eigs, n_states)
+
+    eq_probs = np.asarray(eq_probs, dtype=float).reshape(-1)
+    sqrt_pi = np.sqrt(eq_probs / eq_probs.sum())
+
+    if scipy.sparse.issparse(T):
+        S = (scipy.sparse.diags(sqrt_pi) @ scipy.sparse.csr_matrix(T) @
+             scipy.sparse.diags(1 / sqrt_pi))
+    else:
+        S = sqrt_pi[:, None] * np.asarray(T) / sqrt_pi[None, :]
+    # remove any asymmetry from rounding.
+    S = (S + S.T) / 2
+
+    partial = (scipy.sparse.issparse(S) and n_eigs < n_states and
+               n_states >= FULL_EIG_MAX_STATES)
+
+    if partial:
+        try:
+            vals, vecs = scipy.sparse.linalg.eigsh(
+                S, n_eigs, which="LA", maxiter=maxiter, tol=tol)
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            logger.warning(
+                "ARPACK didn't converge on %s eigenpairs in %s iterations; "
+                "computing them with the dense solver instead.",
+                n_eigs, maxiter)
+            partial = False
+
+    if not partial:
+        if scipy.sparse.issparse(S):
+            S = S.toarray()
+        vals, vecs = scipy.linalg.eigh(
+            S, subset_by_index=[n_states - n_eigs, n_states - 1])
+
+    order = np.argsort(-vals)
+    vals = vals[order]
+    vecs = vecs[:, order]
+
+    # the top eigenvector of S is sqrt(pi), up to sign.
+    if vecs[:, 0].sum() < 0:
+        vecs[:, 0] *= -1
+
+    left_vecs = sqrt_pi[:, None] * vecs
+    right_vecs = vecs / sqrt_pi[:, None]
+
+    return vals, left_vecs, right_vecs
+
+
+def is_reversible(T, eq_probs, rtol=1e-8):
+    """Check whether transition probability matrix `T` obeys detailed
+    balance (pi_i T_ij == pi_j T_ji) with respect to equilibrium
+    probabilities `eq_probs`.
+
+    Parameters
+    ----------
+    T : array, shape=(n_states, n_states)
+        A transition probability matrix.
+    eq_probs : array, shape=(n_states,)
+        Candidate equilibrium probabilities of `T`.
+    rtol : float, default=1e-8
+        Largest permitted difference between the fluxes pi_i T_ij and
+        pi_j T_ji, relative to the largest flux.
+
+    Returns
+    -------
+    reversible : bool
+        Whether `T` is in detailed balance with respect to `eq_probs`,
+        with every equilibrium probability positive.
+    """
+
+    eq_probs = np.asarray(eq_probs, dtype=float).reshape(-1)
+    if eq_probs.shape != (T.shape[0],) or np.any(eq_probs <= 0):
+        return False
+
+    if scipy.sparse.issparse(T):
+        flux = scipy.sparse.diags(eq_probs) @ scipy.sparse.csr_matrix(T)
+        asymmetry = abs(flux - flux.T).max()
+        largest = abs(flux).max()
+    else:
+        flux = eq_probs[:, None] * np.asarray(T)
+        asymmetry = np.abs(flux - flux.T).max()
+        largest = np.abs(flux).max()
+
+    return bool(asymmetry <= rtol * largest)
+
+
 def trim_disconnected(counts, threshold=1, renumber_states=True):
     """Trim disconnected states from a counts matrix.
 
@@ -307,15 +512,95 @@ def eq_probs(T, maxiter=100000, tol=1E-30):
     return vec[:, 0]
 
 
-def _transitions_helper(
-        assigns_1d, lag_time=1, sliding_window=True):
-    # TODO: check trajectory is 1d array
+def _flatten_assigns(assigns):
+    """Get the concatenated frames of a set of trajectories, and the
+    length of each, without copying if `assigns` is a RaggedArray or a
+    2-D array.
+    """
+
+    if isinstance(assigns, RaggedArray):
+        return assigns._data, assigns.lengths
+
+    if isinstance(assigns, np.ndarray) and assigns.dtype != object:
+        # if it's 1d, later stuff will fail
+        if len(assigns.shape) == 1:
+            raise exception.DataInvalid(
+                'The given assignments array has 1-dimensional shape %s. '
+                'Two dimensional shapes = (n_trj, n_frames) are expected. '
+                'If this is really what you want, try using '
+                'assignments.reshape(1, -1) to create a single-row 2d '
+                'array.' % (assigns.shape,))
+        return (assigns.reshape(-1),
+                np.full(len(assigns), assigns.shape[1], dtype=int))
+
+    trjs = [np.asarray(a).reshape(-1) for a in assigns]
+    lengths = np.array([len(a) for a in trjs], dtype=int)
+    if not trjs:
+        return np.zeros(0, dtype=int), lengths
+
+    return np.concatenate(trjs), lengths
+
+
+def _strip_unassigned(data, lengths):
+    """Drop -1 frames from the concatenated trajectories `data`, and
+    find the position of each remaining frame within its (now shorter)
+    trajectory.
+    """
+
+    data = np.asarray(data)
+    lengths = np.asarray(lengths, dtype=np.intp)
+
+    keep = data != -1
+    if not np.all(keep):
+        kept = np.concatenate([[0], np.cumsum(keep)])
+        ends = np.cumsum(lengths)
+        lengths = kept[ends] - kept[ends - lengths]
+        data = data[keep]
+    del keep
+
+    # positions count up by one within a trajectory, and drop back to
+    # zero at the first frame of each, so they're a cumulative sum.
+    lengths = lengths[lengths > 0]
+    dtype = np.int32 if len(data) < 2**31 else np.int64
+    position = np.ones(len(data), dtype=dtype)
+    if len(data):
+        position[0] = 0
+        position[np.cumsum(lengths[:-1])] = 1 - lengths[:-1]
+        np.cumsum(position, out=position)
+
+    return data, position
+
+
+def _count_transitions(data, position, lag_time, n_states, sliding_window):
+    """Count the transitions at `lag_time` in the trajectories given by
+    concatenated frames `data` and the position of each frame in its
+    trajectory, as a CSR matrix.
+
+    Every transition (i, j) is tallied at once by its key i * n_states
+    + j, so there is no per-trajectory work.
+    """
+
+    # frame p starts a transition iff frame p + lag_time is in the same
+    # trajectory, i.e. iff its position is lag_time further on.
+    transitions = (position[lag_time:] - position[:-lag_time]) == lag_time
+    if not sliding_window:
+        transitions &= position[:-lag_time] % lag_time == 0
+
+    keys = data[:-lag_time][transitions].astype(np.int64) * n_states
+    keys += data[lag_time:][transitions]
+    del transitions
 
-    if sliding_window:
-        start_states = assigns_1d[:-lag_time:1]
-        end_states = assigns_1d[lag_time::1]
+    if n_states**2 <= max(len(keys), DENSE_COUNT_LIMIT):
+        counts = np.bincount(keys, minlength=n_states**2)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
     else:
-        start_states = assigns_1d[:-lag_time:lag_time]
-        end_states = assigns_1d[lag_time::lag_time]
-    transitions = np.row_stack((start_states, end_states))
-    return transitions
+        keys, counts = np.unique(keys, return_counts=True)
+
+    # keys are sorted, so they're already in CSR order.
+    rows, cols = np.divmod(keys, n_states)
+    indptr = np.zeros(n_states + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_states), out=indptr[1:])
+
+    return scipy.sparse.csr_matrix(
+        (counts, cols, indptr), shape=(n_states, n_states))
@@ -119,6 +119,26 @@ def test_rmsd_cluster_basic_kcenters():
         algorithm='kcenters')
 
 
+def test_rmsd_cluster_coordinate_cache():
+
+    expected_size = (2, 501)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for i in range(2):
+            runhelper([
+                '--trajectories', TRJFILE, TRJFILE,
+                '--topology', TOPFILE,
+                '--coordinate-cache-dir', cache_dir,
+                '--cluster-radius', '0.1',
+                '--atoms', '(name N or name C or name CA or name H or name O)',
+                '--algorithm', 'kcenters'],
+                expected_size=expected_size,
+                algorithm='kcenters')
+
+            # the second run maps the first run's store
+            assert len(os.listdir(cache_dir)) == 1
+
+
 def test_rmsd_cluster_fixed_k_kcenters():
 
     expected_size = (2, 501)
@@ -387,6 +407,28 @@ def test_feature_cluster_radius_based_h5_input():
         assert len(np.unique(assignments.flatten())) == 11
 
 
+def test_feature_cluster_h5_input_memmap_error():
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+
+    with tempfile.NamedTemporaryFile(suffix='.h5') as f, \
+            tempfile.TemporaryDirectory() as d:
+
+        ra.save(f.name, ra.RaggedArray(array=X, lengths=[50, 30, 20]))
+
+        with pytest.raises(exception.ImproperlyConfigured,
+                           match='requires .npy feature files'):
+            runhelper([
+                '--features', f.name,
+                '--features-memmap-dir', d,
+                '--cluster-radius', '3',
+                '--algorithm', 'kcenters',
+                '--cluster-distance', 'euclidean'],
+                expected_size=(3, (50, 30, 20)))
+
+
 def reorder_assignments(assigs):
     """Rewrite an assignments array so that lower indices appear earlier.
     """
@@ -477,6 +519,43 @@ def test_feature_cluster_number_kcenters_npy_input():
     assert_array_equal(y, assignments)
 
 
+def test_feature_cluster_number_kcenters_npy_input_memmap():
+
+    expected_size = (3, (50, 30, 20))
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+
+    with tempfile.TemporaryDirectory() as d:
+
+        a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        distances, assignments = runhelper([
+            '--features', pathnames[0], pathnames[1], pathnames[2],
+            '--features-memmap-dir', d,
+            '--cluster-number', '3',
+            '--algorithm', 'kcenters',
+            '--cluster-distance', 'euclidean'],
+            expected_size=expected_size,
+            centers_format='npy')
+
+    assert_array_equal(a.lengths, assignments.lengths)
+    assert_array_equal(a.lengths, distances.lengths)
+
+    y = reorder_assignments(y)
+    assignments = reorder_assignments(assignments.flatten())
+
+    assert len(np.unique(assignments)) == 3
+    assert_array_equal(y, assignments)
+
+
 def test_feature_cluster_number_kcenters_npy_input_iterations_flag_error():
 
     expected_size = (3, (50, 30, 20))
@@ -547,6 +626,148 @@ def test_feature_cluster_number_khybrid_npy_input_zero_iterations():
 
     assert_array_equal(kc.distances_, distances.flatten())
 
+def test_feature_cluster_khybrid_save_intermediates():
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+    a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+    with tempfile.TemporaryDirectory() as d:
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        fnames = {k: os.path.join(d, 'out', k + ext) for k, ext in [
+            ('distances', '.h5'), ('assignments', '.h5'),
+            ('center-features', '.npy'), ('center-indices', '.npy')]}
+        os.makedirs(os.path.join(d, 'out'))
+
+        argv = ['', '--features'] + pathnames + [
+            '--cluster-number', '3',
+            '--cluster-iterations', '3',
+            '--algorithm', 'khybrid',
+            '--cluster-distance', 'euclidean',
+            '--save_intermediates', 'True']
+        for k, v in fnames.items():
+            argv.extend(['--' + k, v])
+        cluster.main(argv)
+
+        for n in ['kcenters', 'kmedoids-0', 'kmedoids-1']:
+            int_dir = os.path.join(d, 'out', 'intermediate-' + n)
+            assert_array_equal(
+                ra.load(os.path.join(int_dir, 'assignments.h5')).lengths,
+                a.lengths)
+            assert len(np.load(os.path.join(int_dir, 'center-indices.npy'))) == 3
+        assert not os.path.exists(
+            os.path.join(d, 'out', 'intermediate-kmedoids-2'))
+
+
+def test_feature_cluster_number_kcenters_batched():
+
+    expected_size = (3, (50, 30, 20))
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+
+    kc = cluster.KCenters('euclidean', n_clusters=10)
+    kc.fit(X)
+
+    with tempfile.TemporaryDirectory() as d:
+
+        a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        distances, assignments = runhelper([
+            '--features', pathnames[0], pathnames[1], pathnames[2],
+            '--cluster-number', '10',
+            '--algorithm', 'kcenters',
+            '--kcenters-batch-size', '4',
+            '--cluster-distance', 'euclidean'],
+            expected_size=expected_size,
+            centers_format='npy')
+
+    assert_array_equal(kc.labels_, assignments.flatten())
+    assert_array_equal(kc.distances_, distances.flatten())
+
+
+def test_feature_cluster_number_kcenters_float32_distances():
+
+    expected_size = (3, (50, 30, 20))
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+
+    kc = cluster.KCenters('euclidean', n_clusters=10)
+    kc.fit(X)
+
+    with tempfile.TemporaryDirectory() as d:
+
+        a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        distances, assignments = runhelper([
+            '--features', pathnames[0], pathnames[1], pathnames[2],
+            '--cluster-number', '10',
+            '--algorithm', 'kcenters',
+            '--distance-dtype', 'float32',
+            '--cluster-distance', 'euclidean'],
+            expected_size=expected_size,
+            centers_format='npy')
+
+    assert distances.dtype == np.float32
+    assert_array_equal(kc.labels_, assignments.flatten())
+    assert_array_equal(kc.distances_.astype(np.float32), distances.flatten())
+
+
+def test_feature_cluster_number_khybrid_batch_kmedoids_updates():
+
+    expected_size = (3, (50, 30, 20))
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+
+    with tempfile.TemporaryDirectory() as d:
+
+        a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        distances, assignments = runhelper([
+            '--features', pathnames[0], pathnames[1], pathnames[2],
+            '--cluster-number', '3',
+            '--algorithm', 'khybrid',
+            '--cluster-iterations', '5',
+            '--batch-kmedoids-updates',
+            '--cluster-distance', 'euclidean'],
+            expected_size=expected_size,
+            centers_format='npy')
+
+    y = reorder_assignments(y)
+    assignments = reorder_assignments(assignments.flatten())
+
+    assert_array_equal(y, assignments)
+
+
 def test_kmedoids_warm_start():
 
     expected_size = (3, (50, 30, 20))
@@ -606,3 +827,62 @@ def test_kmedoids_warm_start():
     cluster_center_inds2 = util.find_cluster_centers(assignments2, distances2)
     assert_array_equal(assignments[cluster_center_inds2],
                        np.arange(len(cluster_center_inds2)))
+
+
+def test_kcenters_checkpoint_restart():
+
+    X, y = make_blobs(
+        n_samples=100, n_features=3, centers=3, center_box=(0, 100),
+        random_state=3)
+    a = ra.RaggedArray(array=X, lengths=[50, 30, 20])
+
+    with tempfile.TemporaryDirectory() as d:
+        pathnames = []
+        for row_i in range(len(a.lengths)):
+            pathname = os.path.join(d, "%s.npy" % row_i)
+            np.save(pathname, a[row_i])
+            pathnames.append(pathname)
+
+        def outputs(name):
+            os.makedirs(os.path.join(d, name))
+            return {k: os.path.join(d, name, k + ext) for k, ext in [
+                ('distances', '.h5'), ('assignments', '.h5'),
+                ('center-features', '.npy'), ('center-indices', '.npy')]}
+
+        def run(fnames, n_clusters, extra_args):
+            argv = ['', '--features'] + pathnames + [
+                '--cluster-number', str(n_clusters),
+                '--algorithm', 'kcenters',
+                '--cluster-distance', 'euclidean']
+            for k, v in fnames.items():
+                argv.extend(['--' + k, v])
+            cluster.main(argv + extra_args)
+
+        interrupted = outputs('interrupted')
+        run(interrupted, 2, ['--checkpoint-interval', '2'])
+
+        ckpt = {k: os.path.join(os.path.dirname(v),
+                                'intermediate-kcenters-checkpoint',
+                                os.path.basename(v))
+                for k, v in interrupted.items()}
+        assert_array_equal(np.load(ckpt['center-indices']),
+                           np.load(interrupted['center-indices']))
+
+        restarted = outputs('restarted')
+        run(restarted, 4, [
+            '--init-center-inds', ckpt['center-indices'],
+            '--init-assignments', ckpt['assignments'],
+            '--init-distances', ckpt['distances']])
+
+        uninterrupted = outputs('uninterrupted')
+        run(uninterrupted, 4, [])
+
+        assert_array_equal(np.load(restarted['center-indices']),
+                           np.load(uninterrupted['center-indices']))
+        for k in ['distances', 'assignments']:
+            assert_array_equal(ra.load(restarted[k])._data,
+                               ra.load(uninterrupted[k])._data)
+
+        with pytest.raises(exception.ImproperlyConfigured):
+            run(outputs('incomplete'), 4, [
+                '--init-center-inds', ckpt['center-indices']])
@@ -183,6 +183,46 @@ def test_rmsd_kcenters_mpi_subsample():
     assert_array_equal(expected_s.xyz, md.join(s).xyz)
 
 
+@pytest.mark.mpi
+def test_rmsd_kcenters_mpi_balanced():
+
+    TRJFILE = os.path.join(os.path.dirname(__file__), 'data', 'frame0.xtc')
+    TOPFILE = os.path.join(os.path.dirname(__file__), 'data', 'native.pdb')
+    SELECTION = '(name N or name C or name CA or name H or name O)'
+
+    trj = md.load(TRJFILE, top=TOPFILE)
+    trj_lengths = [501, 40, 120, 30, 60]
+    expected_size = (len(trj_lengths), trj_lengths)
+
+    with tempfile.TemporaryDirectory() as tdname:
+
+        tdname = mpi.comm.bcast(tdname, root=0)
+
+        if mpi.rank() == 0:
+            for i, n in enumerate(trj_lengths):
+                trj[-n:].save(os.path.join(tdname, 'frame%s.xtc' % i))
+        mpi.comm.Barrier()
+
+        results = []
+        for extra_args in [[], ['--balance-stripes']]:
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore')
+                results.append(runhelper([
+                    '--trajectories', os.path.join(tdname, 'frame?.xtc'),
+                    '--topology', TOPFILE,
+                    '--cluster-number', '4',
+                    '--atoms', SELECTION,
+                    '--algorithm', 'kcenters'] + extra_args,
+                    expected_size=expected_size,
+                    expect_reassignment=True))
+
+    (a, d, inds, _), (a_bal, d_bal, inds_bal, _) = results
+
+    assert_array_equal(inds, inds_bal)
+    assert_array_equal(a._data, a_bal._data)
+    assert_allclose(d._data, d_bal._data)
+
+
 @fix_np_rng()
 @pytest.mark.mpi
 def test_rmsd_khybrid_mpi_basic():
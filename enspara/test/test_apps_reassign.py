@@ -15,6 +15,7 @@ from numpy.testing import assert_array_equal, assert_allclose
 
 from enspara import ra
 from ..apps import reassign
+from ..util.load import LENGTHS_INDEX_NAME, LENGTHS_INDEX_DIR_VAR
 from .util import get_fn
 
 
@@ -153,3 +154,180 @@ def test_reassignment_function_heterogenous():
     assert_array_equal(assigns[0], assigns[1])
     assert_array_equal(assigns[0][::50], range(len(centers)))
     assert_allclose(dists[0], dists[1], atol=1e-3)
+
+
+def test_reassignment_prefetch_matches_serial(monkeypatch):
+
+    from enspara.cluster import util
+
+    topologies = [get_fn('native.pdb')]
+    trajectories = [[get_fn('frame0.xtc')]*5]
+    atoms = '(name N or name C or name CA or name H or name O)'
+    top = md.load(topologies[0]).top
+    # reassign precenters the centers in place, so each call gets its own
+    def centers():
+        return [c.atom_slice(top.select(atoms)) for c
+                in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    # force small batches (two trajectories per batch without prefetch)
+    monkeypatch.setattr(
+        util, 'determine_batch_size',
+        lambda n_atoms, dtype_bytes, frac_mem: (2 * 3 * 501, 0))
+
+    serial = reassign.reassign(
+        topologies, trajectories, [atoms], centers(), prefetch=0)
+    prefetched = reassign.reassign(
+        topologies, trajectories, [atoms], centers(), prefetch=2)
+
+    assert_array_equal(serial[0], prefetched[0])
+    assert_array_equal(serial[1], prefetched[1])
+    assert_array_equal(serial[0][0][::50], range(len(centers())))
+
+
+def test_reassignment_coordinate_cache(tmp_path, monkeypatch):
+
+    topologies = [get_fn('native.pdb')]
+    trajectories = [[get_fn('frame0.xtc')]*3]
+    atoms = '(name N or name C or name CA or name H or name O)'
+    top = md.load(topologies[0]).top
+    def centers():
+        return [c.atom_slice(top.select(atoms)) for c
+                in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    index_dir = tmp_path / 'index'
+    monkeypatch.setenv(LENGTHS_INDEX_DIR_VAR, str(index_dir))
+
+    expected = reassign.reassign(topologies, trajectories, [atoms], centers())
+    assert os.path.isfile(index_dir / LENGTHS_INDEX_NAME)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # the first run fills the cache and the second reads from it
+        for i in range(2):
+            assigns, dists = reassign.reassign(
+                topologies, trajectories, [atoms], centers(),
+                cache_dir=cache_dir)
+
+            # one coordinate store; lengths are indexed apart
+            assert len(os.listdir(cache_dir)) == 1
+            assert not os.path.isfile(
+                os.path.join(cache_dir, LENGTHS_INDEX_NAME))
+            assert_array_equal(assigns, expected[0])
+            assert_allclose(dists, expected[1], atol=1e-3)
+
+
+def test_prefetch_bounds_buffers_and_raises():
+
+    import threading
+    from enspara.cluster import util
+
+    alive = []
+    lock = threading.Lock()
+
+    def load(i):
+        with lock:
+            alive.append(i)
+            assert len(alive) <= 2
+        return i
+
+    for i in util._prefetch(load, list(range(10)), 2):
+        with lock:
+            alive.remove(i)
+
+    def failing_load(i):
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    seen = []
+    with pytest.raises(ValueError):
+        for i in util._prefetch(failing_load, list(range(10)), 2):
+            seen.append(i)
+    assert seen == [0, 1, 2]
+
+
+@pytest.mark.mpi
+def test_reassignment_function_mpi():
+
+    from enspara import mpi
+
+    xtc2 = os.path.join(TEST_DIR, 'cards_data', 'trj0.xtc')
+    top2 = os.path.join(TEST_DIR, 'cards_data', 'PROT_only.pdb')
+
+    topologies = [get_fn('native.pdb'), top2]
+    trajectories = [
+        [get_fn('frame0.xtc'), get_fn('frame0.xtc'), get_fn('frame0.xtc')],
+        [xtc2, xtc2]]
+    atoms = [
+        '(name N or name O) and (residue 2 or residue 3)',
+        '(name CA) and (residue 3 to 5)']
+
+    # reassign precenters the centers in place, so each call gets its own
+    def centers():
+        top = md.load(topologies[0]).top
+        return [c.atom_slice(top.select(atoms[0])) for c
+                in md.load(trajectories[0][0], top=topologies[0])[::50]]
+
+    serial = reassign.reassign(topologies, trajectories, atoms, centers())
+    striped = reassign.reassign(
+        topologies, trajectories, atoms, centers(), mpi_mode=True)
+
+    # results are only assembled on rank 0
+    if mpi.rank() == 0:
+        assert type(striped[0]) is ra.RaggedArray
+        assert_array_equal(striped[0].lengths, [501, 501, 501, 5001, 5001])
+        assert_array_equal(serial[0]._data, striped[0]._data)
+        assert_array_equal(serial[1]._data, striped[1]._data)
+    else:
+        assert striped == (None, None)
+
+    # ranks left without a trajectory still take part
+    serial = reassign.reassign(
+        topologies[:1], [trajectories[0][:1]], atoms[:1], centers())
+    striped = reassign.reassign(
+        topologies[:1], [trajectories[0][:1]], atoms[:1], centers(),
+        mpi_mode=True)
+
+    if mpi.rank() == 0:
+        assert_array_equal(serial[0], striped[0])
+        assert_array_equal(serial[1], striped[1])
+
+
+@pytest.mark.mpi
+def test_reassign_script_center_index_mpi():
+
+    from enspara import mpi
+
+    topology = get_fn('native.pdb')
+    trajectory = get_fn('frame0.xtc')
+    atoms = '(name N or name C or name CA or name H or name O)'
+    centers = [c for c in md.load(trajectory, top=topology)[::10]]
+
+    with tempfile.TemporaryDirectory() as d:
+        d = mpi.comm.bcast(d, root=0)
+        ctrs_fname = os.path.join(d, 'centers.pkl')
+        index_fname = os.path.join(d, 'centers-index.npz')
+        if mpi.rank() == 0:
+            with open(ctrs_fname, 'wb') as f:
+                pickle.dump(centers, f)
+        mpi.comm.Barrier()
+
+        # without an index, then building it (on rank 0 only, for all
+        # ranks), then loading it
+        for i, index_args in enumerate(
+                [[], ['--center-index', index_fname],
+                 ['--center-index', index_fname]]):
+            reassign.main([
+                '', '--centers', ctrs_fname,
+                '--trajectories', trajectory, trajectory, trajectory,
+                '--atoms', atoms, '--topology', topology,
+                '--assignments', os.path.join(d, 'assig%s.h5' % i),
+                '--distances', os.path.join(d, 'dist%s.h5' % i)] +
+                index_args)
+            assert os.path.isfile(index_fname) == bool(index_args)
+
+        if mpi.rank() == 0:
+            expected = ra.load(os.path.join(d, 'assig0.h5'))
+            for i in [1, 2]:
+                assert_array_equal(
+                    ra.load(os.path.join(d, 'assig%s.h5' % i)), expected)
+        mpi.comm.Barrier()
@@ -4,6 +4,8 @@ import tempfile
 import copy
 import pytest
 
+from unittest.mock import patch
+
 import numpy as np
 import mdtraj as md
 
@@ -14,7 +16,7 @@ from numpy.testing import assert_array_equal, assert_allclose
 from .util import get_fn, fix_np_rng
 from ..geometry import libdist
 from ..cluster.hybrid import KHybrid, hybrid
-from ..cluster import kcenters, kmedoids, util
+from ..cluster import kcenters, kmedoids, sampled, util
 from ..exception import DataInvalid, ImproperlyConfigured
 
 
@@ -210,10 +212,12 @@ class TestTrajClustering(unittest.TestCase):
 
         # this is simlar to asserting the distribution of distances.
         # since KCenters is deterministic, this shouldn't ever change?
+        # (values are for libdist's double-precision QCP RMSD, which,
+        # unlike md.rmsd, gives centers a distance of ~0 to themselves.)
         self.assertAlmostEqual(np.average(result.distances),
-                               0.074690734158752686)
+                               0.07468969845872973)
         self.assertAlmostEqual(np.std(result.distances),
-                               0.018754008455304401)
+                               0.01875814016721935)
 
     def test_kcenters_nclust(self):
         N_CLUSTERS = 3
@@ -634,6 +638,74 @@ class TestNumpyClustering(unittest.TestCase):
         # should actually be a frame
         assert len(np.where(clust.result_.distances == 0)) == 1
 
+    def test_kcenters_checkpoint_restart(self):
+
+        X = np.concatenate(self.traj_lst)
+
+        checkpoints = []
+
+        def checkpoint(result):
+            checkpoints.append(util.ClusterResult(
+                center_indices=list(result.center_indices),
+                assignments=result.assignments.copy(),
+                distances=result.distances.copy(),
+                centers=None))
+
+        full = kcenters.kcenters(
+            X, 'euclidean', n_clusters=5, checkpoint=checkpoint,
+            checkpoint_interval=2)
+
+        assert [len(c.center_indices) for c in checkpoints] == [2, 4]
+
+        n_calls = []
+
+        def counting_euclidean(X, y):
+            n_calls.append(1)
+            return libdist.euclidean(X, y)
+
+        restarted = kcenters.KCenters(counting_euclidean, n_clusters=5)
+        restarted.fit(
+            X,
+            assignments=checkpoints[0].assignments,
+            distances=checkpoints[0].distances,
+            cluster_center_inds=checkpoints[0].center_indices)
+
+        # distances to the two checkpointed centers are not recomputed
+        assert len(n_calls) == 3
+
+        assert_array_equal(restarted.center_indices_, full.center_indices)
+        assert_array_equal(restarted.labels_, full.assignments)
+        assert_array_equal(restarted.distances_, full.distances)
+        assert_array_equal(restarted.centers_, X[full.center_indices])
+
+    def test_kcenters_restart_requires_all_state(self):
+
+        X = np.concatenate(self.traj_lst)
+        result = kcenters.kcenters(X, 'euclidean', n_clusters=2)
+
+        with self.assertRaises(ImproperlyConfigured):
+            kcenters.kcenters(
+                X, 'euclidean', n_clusters=3,
+                assignments=result.assignments,
+                cluster_center_inds=result.center_indices)
+
+    def test_hybrid_kcenters_restart(self):
+
+        X = np.concatenate(self.traj_lst)
+        first = kcenters.kcenters(X, 'euclidean', n_clusters=2)
+
+        clust = KHybrid('euclidean', n_clusters=3, kmedoids_updates=0)
+        clust.fit(
+            X,
+            assignments=first.assignments,
+            distances=first.distances,
+            cluster_center_inds=first.center_indices)
+
+        full = kcenters.kcenters(X, 'euclidean', n_clusters=3)
+
+        assert_array_equal(clust.center_indices_, full.center_indices)
+        assert_array_equal(clust.labels_, full.assignments)
+
     def test_numpy_hybrid(self):
         N_CLUSTERS = 3
 
@@ -848,6 +920,194 @@ def test_mpi_kcenters_iteration_triangle_mdtraj():
         ctr_inds = trad_ctr_inds
 
 
+def test_kcenters_triangle_center_distance_cache():
+
+    X, y = make_blobs(centers=20, random_state=2, n_samples=2000)
+
+    n_calls = []
+
+    def counting_euclidean(X, y):
+        n_calls.append(len(X))
+        return libdist.euclidean(X, y)
+
+    # more centers than the cache's initial capacity, so it must grow
+    trad = kcenters.kcenters(X, libdist.euclidean, n_clusters=150)
+    tri = kcenters.kcenters(X, counting_euclidean, n_clusters=150,
+                            use_triangle_inequality=True)
+
+    assert_array_equal(trad.center_indices, tri.center_indices)
+    assert_array_equal(trad.assignments, tri.assignments)
+    assert_allclose(trad.distances, tri.distances)
+
+    # pruning should skip most frame and center-center distances
+    assert sum(n_calls) < 0.5 * 150 * (len(X) + 75)
+
+    cache = kcenters._CenterDistances.from_centers(
+        tri.centers, tri.assignments, tri.distances, libdist.euclidean)
+    true_cc = np.array([libdist.euclidean(X[tri.center_indices], c)
+                        for c in tri.centers])
+    assert_allclose(cache._cc[:150, :150], true_cc, rtol=1e-6)
+
+    radii = np.zeros(150)
+    np.maximum.at(radii, tri.assignments, tri.distances)
+    assert_allclose(cache.radii, radii)
+
+
+def test_kcenters_triangle_point_bounds():
+
+    X, y = make_blobs(centers=20, random_state=0, n_samples=5000)
+
+    def count_calls(candidates):
+        n_calls = []
+
+        def counting_euclidean(X, y):
+            n_calls.append(len(X))
+            return libdist.euclidean(X, y)
+
+        with patch.object(kcenters._CenterDistances, 'candidates',
+                          candidates):
+            result = kcenters.kcenters(X, counting_euclidean,
+                                       n_clusters=150,
+                                       use_triangle_inequality=True)
+        return result, sum(n_calls)
+
+    def center_bound_only(self, cc_dists, assignments, distances):
+        unbounded = distances > (cc_dists[assignments] / 2)
+        return unbounded, unbounded
+
+    ref = kcenters.kcenters(X, libdist.euclidean, n_clusters=150)
+    tri, n_point = count_calls(kcenters._CenterDistances.candidates)
+    cc_only, n_center = count_calls(center_bound_only)
+
+    for result in [tri, cc_only]:
+        assert_array_equal(ref.center_indices, result.center_indices)
+        assert_array_equal(ref.assignments, result.assignments)
+        assert_array_equal(ref.distances, result.distances)
+
+    # per-point anchors skip points center-center pruning can't
+    assert n_point < 0.9 * n_center
+
+
+@pytest.mark.parametrize('batch_size', [2, 7, 64])
+def test_kcenters_batched_npy(batch_size):
+
+    X, y = make_blobs(centers=20, random_state=4, n_samples=3000)
+
+    ref = kcenters.kcenters(X, libdist.euclidean, n_clusters=100)
+    batched = kcenters.kcenters(X, libdist.euclidean, n_clusters=100,
+                                batch_size=batch_size)
+
+    assert_array_equal(ref.center_indices, batched.center_indices)
+    assert_array_equal(ref.assignments, batched.assignments)
+    assert_array_equal(ref.distances, batched.distances)
+    assert_array_equal(ref.centers, batched.centers)
+
+    ref = kcenters.kcenters(X, libdist.euclidean, dist_cutoff=1.5)
+    batched = kcenters.kcenters(X, libdist.euclidean, dist_cutoff=1.5,
+                                batch_size=batch_size)
+
+    assert_array_equal(ref.center_indices, batched.center_indices)
+    assert_array_equal(ref.assignments, batched.assignments)
+
+
+def test_kcenters_batched_mdtraj():
+
+    X = md.load(get_fn('frame0.h5'))
+
+    ref = kcenters.kcenters(X, 'rmsd', n_clusters=40)
+    batched = kcenters.KCenters('rmsd', n_clusters=40, batch_size=8).fit(X)
+
+    assert_array_equal(ref.center_indices, batched.center_indices_)
+    assert_array_equal(ref.assignments, batched.labels_)
+    assert_allclose(ref.distances, batched.distances_, atol=1e-6)
+
+    with pytest.raises(ImproperlyConfigured):
+        kcenters.kcenters(X, 'rmsd', n_clusters=10, batch_size=8,
+                          use_triangle_inequality=True)
+
+
+@pytest.mark.mpi
+def test_kcenters_batched_mpi_npy():
+    from .. import mpi
+
+    X, y = make_blobs(centers=10, random_state=0, n_samples=2000)
+    X_local = X[mpi.rank()::mpi.size()]
+
+    ref = kcenters.kcenters(X_local, libdist.euclidean, n_clusters=50,
+                            mpi_mode=True)
+    batched = kcenters.kcenters(X_local, libdist.euclidean, n_clusters=50,
+                                batch_size=10, mpi_mode=True)
+
+    assert_array_equal(ref.center_indices, batched.center_indices)
+    assert_array_equal(ref.assignments, batched.assignments)
+    assert_array_equal(ref.distances, batched.distances)
+
+    # a rank holding no frames still takes part
+    X_local = X if mpi.rank() == 0 else X[:0]
+    serial = kcenters.kcenters(X, libdist.euclidean, n_clusters=50)
+    batched = kcenters.kcenters(X_local, libdist.euclidean, n_clusters=50,
+                                batch_size=10, mpi_mode=True)
+
+    assert_array_equal(batched.center_indices,
+                       [(0, i) for i in serial.center_indices])
+    if mpi.rank() == 0:
+        assert_array_equal(serial.assignments, batched.assignments)
+        assert_array_equal(serial.distances, batched.distances)
+    else:
+        assert len(batched.assignments) == 0
+
+
+def test_kcenters_float32_distances():
+
+    X, y = make_blobs(centers=20, random_state=4, n_samples=3000)
+
+    ref = kcenters.kcenters(X, libdist.euclidean, n_clusters=100)
+    f32 = kcenters.kcenters(X, libdist.euclidean, n_clusters=100,
+                            distance_dtype=np.float32)
+    batched = kcenters.kcenters(X, libdist.euclidean, n_clusters=100,
+                                batch_size=7, distance_dtype=np.float32)
+
+    assert f32.distances.dtype == np.float32
+    assert_allclose(f32.distances, ref.distances, rtol=1e-6)
+    assert_array_equal(f32.center_indices, batched.center_indices)
+    assert_array_equal(f32.assignments, batched.assignments)
+    assert_array_equal(f32.distances, batched.distances)
+
+    # ties go to the earlier center
+    X = np.array([[0], [2], [1]], dtype=float)
+    result = kcenters.kcenters(X, libdist.euclidean, n_clusters=2,
+                               distance_dtype=np.float32)
+    assert_array_equal(result.center_indices, [0, 1])
+    assert_array_equal(result.assignments, [0, 1, 0])
+
+    with pytest.raises(ImproperlyConfigured):
+        kcenters.kcenters(X, libdist.euclidean, n_clusters=2,
+                          distance_dtype=np.int32)
+
+
+def test_khybrid_float32_distances_mdtraj():
+
+    X = md.load(get_fn('frame0.h5'))
+
+    ref = kcenters.KCenters('rmsd', n_clusters=20).fit(X)
+    f32 = kcenters.KCenters('rmsd', n_clusters=20,
+                            distance_dtype=np.float32).fit(X)
+
+    assert f32.distances_.dtype == np.float32
+    assert_array_equal(ref.center_indices_, f32.center_indices_)
+    assert_allclose(ref.distances_, f32.distances_, atol=1e-6)
+
+    for batch in [False, True]:
+        clust = KHybrid('rmsd', n_clusters=10, kmedoids_updates=3,
+                        batch_kmedoids_updates=batch, random_state=0,
+                        distance_dtype=np.float32).fit(X)
+        assert clust.distances_.dtype == np.float32
+
+        assignments, distances = util.assign_to_nearest_center(
+            X, X[clust.center_indices_], util.rmsd)
+        assert_allclose(clust.distances_, distances, atol=1e-5)
+
+
 @pytest.mark.mpi
 def test_kmedoids_propose_center_amongst():
     from .. import mpi
@@ -885,3 +1145,203 @@ def test_kmedoids_propose_center_amongst_hits_all():
         hits.add(int(prop_c))
 
     assert hits == set([0, 3, 6, 9, 12, 15])
+
+
+@pytest.mark.mpi
+def test_kmedoids_propose_new_centers_hits_all():
+    from .. import mpi
+
+    a = np.arange(17)
+    X = a[mpi.rank()::mpi.size()]
+    assignments = (X % 3 == 0).astype('int')
+
+    hits = [set(), set()]
+    for i in range(100):
+        proposals = kmedoids._propose_new_centers(
+            X, assignments, 2, mpi_mode=True,
+            random_state=np.random.RandomState(i))
+
+        for cid, (prop_c, (rank, local_ind)) in enumerate(proposals):
+            assert (prop_c % 3 == 0) == cid
+            assert a[rank::mpi.size()][local_ind] == prop_c
+            hits[cid].add(int(prop_c))
+
+    assert hits[1] == set([0, 3, 6, 9, 12, 15])
+    assert hits[0] == set(a[a % 3 != 0])
+
+
+def test_kmedoids_batch_update_numpy():
+
+    X, y = make_blobs(centers=10, random_state=3, n_samples=2000)
+
+    kc = kcenters.kcenters(X, libdist.euclidean, n_clusters=25)
+    medoid_inds = list(kc.center_indices)
+    medoid_coords = kmedoids._medoid_coords(X, medoid_inds)
+    a1, d1, a2, d2 = kmedoids._nearest_two(
+        X, medoid_coords, libdist.euclidean)
+
+    assert_array_equal(a1, kc.assignments)
+    assert_allclose(d1, kc.distances)
+
+    rs = np.random.RandomState(0)
+    cost = kmedoids._msq(d1)
+    for i in range(5):
+        medoid_inds, d1, a1, d2, a2, medoid_coords = \
+            kmedoids._kmedoids_batch_update(
+                X, libdist.euclidean, medoid_inds, medoid_coords,
+                a1, d1, a2, d2, random_state=rs)
+
+        new_cost = kmedoids._msq(d1)
+        assert new_cost <= cost
+        cost = new_cost
+
+        assert_array_equal(medoid_coords, X[medoid_inds])
+
+        # incrementally-maintained nearest and second-nearest medoids
+        # should match recomputing them from scratch.
+        ref_a1, ref_d1, ref_a2, ref_d2 = kmedoids._nearest_two(
+            X, medoid_coords, libdist.euclidean)
+        assert_array_equal(a1, ref_a1)
+        assert_allclose(d1, ref_d1)
+        assert_array_equal(a2, ref_a2)
+        assert_allclose(d2, ref_d2)
+
+    assert cost < kmedoids._msq(kc.distances)
+
+
+def test_kmedoids_batch_update_proposals():
+
+    X = np.array([[0.], [1.], [2.], [10.], [11.], [30.]])
+    medoid_inds = [0, 3]
+    medoid_coords = kmedoids._medoid_coords(X, medoid_inds)
+    a1, d1, a2, d2 = kmedoids._nearest_two(
+        X, medoid_coords, libdist.euclidean)
+
+    # swapping 0 -> 1 helps, and swapping 3 -> 4 helps, but the two
+    # don't interact, so both are accepted in one sweep.
+    medoid_inds, d1, a1, d2, a2, _ = kmedoids._kmedoids_batch_update(
+        X, libdist.euclidean, medoid_inds, medoid_coords,
+        a1, d1, a2, d2, proposals=[1, 4])
+
+    assert_array_equal(medoid_inds, [1, 4])
+    assert_array_equal(a1, [0, 0, 0, 1, 1, 1])
+    assert_allclose(d1, [1, 0, 1, 1, 0, 19])
+
+    with pytest.raises(DataInvalid):
+        kmedoids._kmedoids_batch_update(
+            X, libdist.euclidean, medoid_inds, medoid_coords,
+            a1, d1, a2, d2, proposals=[1])
+
+
+def test_kmedoids_batch_update_independent_swaps():
+
+    # on small integer data (lots of ties and near-ties), the accepted
+    # swaps should change the cost by exactly the sum of their changes
+    # when made one at a time.
+    def cost(medoid_inds):
+        d = np.abs(X - X[medoid_inds].T).min(axis=1)
+        return np.sum(np.square(d, dtype=np.float64))
+
+    for seed in range(600):
+        rs = np.random.RandomState(seed)
+        n_frames, n_clusters = rs.randint(8, 40), rs.randint(2, 8)
+        X = rs.randint(0, 20, size=(n_frames, 1)).astype(float)
+        medoid_inds = list(rs.choice(len(X), n_clusters, replace=False))
+        medoid_coords = kmedoids._medoid_coords(X, medoid_inds)
+        a1, d1, a2, d2 = kmedoids._nearest_two(
+            X, medoid_coords, libdist.euclidean)
+
+        new_inds, new_d1, _, _, _, _ = kmedoids._kmedoids_batch_update(
+            X, libdist.euclidean, medoid_inds, medoid_coords,
+            a1, d1, a2, d2, random_state=rs)
+
+        old_cost = cost(medoid_inds)
+        swap_gains = []
+        for cid in np.flatnonzero(np.array(new_inds) != medoid_inds):
+            swapped = list(medoid_inds)
+            swapped[cid] = new_inds[cid]
+            swap_gains.append(cost(swapped) - old_cost)
+
+        assert all(g < 0 for g in swap_gains)
+        assert_allclose(cost(new_inds), old_cost + sum(swap_gains))
+        assert_allclose(np.sum(np.square(new_d1)), cost(new_inds))
+
+
+def test_kmedoids_batch_updates_mdtraj():
+
+    X = md.load(get_fn('frame0.h5'))
+
+    result = kmedoids.kmedoids(
+        X, 'rmsd', n_clusters=10, n_iters=3, random_state=0,
+        batch_updates=True)
+
+    assignments, distances = util.assign_to_nearest_center(
+        X, X[result.center_indices], util.rmsd)
+    assert_array_equal(result.assignments, assignments)
+    assert_allclose(result.distances, distances, atol=1e-5)
+
+    clust = KHybrid('rmsd', n_clusters=10, kmedoids_updates=3,
+                    batch_kmedoids_updates=True, random_state=0)
+    clust.fit(X)
+
+    kc = kcenters.kcenters(X, 'rmsd', n_clusters=10)
+    assert kmedoids._msq(clust.distances_) <= kmedoids._msq(kc.distances)
+
+
+def test_sampled_kmedoids_memmap():
+
+    X, _ = make_blobs(
+        n_samples=5000, centers=5, n_features=3, random_state=0)
+
+    with tempfile.TemporaryDirectory() as tdname:
+        fname = os.path.join(tdname, 'features.npy')
+        np.save(fname, X)
+        X_mmap = np.load(fname, mmap_mode='r')
+
+        clust = sampled.SampledKMedoids(
+            'euclidean', n_clusters=5, sample_size=500, n_samples=4,
+            n_iters=5, random_state=0)
+        clust.fit(X_mmap)
+
+    result = clust.result_
+    assert len(np.unique(result.center_indices)) == 5
+    assert_allclose(result.centers, X[result.center_indices])
+
+    assignments, distances = util.assign_to_nearest_center(
+        X, X[result.center_indices], util.euclidean)
+    assert_array_equal(result.assignments, assignments)
+    assert_allclose(result.distances, distances)
+
+    # refining on subsamples should do about as well as on all the data
+    full = kmedoids.kmedoids(
+        X, 'euclidean', n_clusters=5, n_iters=20, random_state=0)
+    assert kmedoids._msq(result.distances) <= \
+        1.05 * kmedoids._msq(full.distances)
+
+
+def test_sampled_kmedoids_init_medoids_mdtraj():
+
+    X = md.load(get_fn('frame0.h5'))
+    init = kcenters.kcenters(X, 'rmsd', n_clusters=10).center_indices
+
+    result = sampled.sampled_kmedoids(
+        X, 'rmsd', n_clusters=10, sample_size=100, n_samples=3,
+        n_iters=3, init_medoids=init, random_state=0)
+
+    assignments, distances = util.assign_to_nearest_center(
+        X, X[result.center_indices], util.rmsd)
+    assert_array_equal(result.assignments, assignments)
+    assert_allclose(result.distances, distances, atol=1e-5)
+
+    init_distances = util.assign_to_nearest_center(
+        X, X[init], util.rmsd)[1]
+    assert kmedoids._msq(result.distances) <= kmedoids._msq(init_distances)
+
+
+def test_sampled_kmedoids_sample_too_small():
+
+    X, _ = make_blobs(n_samples=100, centers=5, random_state=0)
+
+    with pytest.raises(ImproperlyConfigured):
+        sampled.sampled_kmedoids(
+            X, 'euclidean', n_clusters=10, sample_size=5)
@@ -85,6 +85,40 @@ def test_unique_state_extraction():
     assert all(save_states.unique_states(assignments) == states[1:])
 
 
+@pytest.mark.parametrize('n_confs', [1, 3])
+def test_save_states(tmp_path, n_confs):
+
+    top = md.load(get_fn('native.pdb'))
+    traj_filenames = [get_fn('frame0.xtc'), get_fn('frame0.h5')]
+    trjs = [md.load(f, top=top) for f in traj_filenames]
+
+    rng = np.random.default_rng(0)
+    assignments = rng.integers(0, 5, size=(2, len(trjs[0])))
+    distances = rng.random(size=(2, len(trjs[0])))
+
+    np.random.seed(0)
+    save_states.save_states(
+        assignments, distances, traj_filenames=traj_filenames,
+        output_directory=str(tmp_path), topology=get_fn('native.pdb'),
+        n_confs=n_confs, n_processes=2)
+
+    for state in range(5):
+        # the center is the frame nearest to the state
+        dists = np.where(assignments == state, distances, np.inf)
+        t, f = np.unravel_index(np.argmin(dists), dists.shape)
+        center = md.load(str(tmp_path / ('State%s-0.pdb' % state)))
+        assert_allclose(center.xyz, trjs[t][f].xyz, atol=1e-3)
+
+        for conf in range(1, n_confs):
+            conf = md.load(str(tmp_path / ('State%s-%s.pdb' % (state, conf))))
+            rmsds = [md.rmsd(trj[assignments[i] == state], conf,
+                             precentered=False).min()
+                     for i, trj in enumerate(trjs)]
+            assert min(rmsds) < 1e-3
+
+    assert len(list(tmp_path.iterdir())) == 5 * n_confs
+
+
 def test_assign_to_nearest_center_few_centers():
 
     # assign_to_nearest_center takes two code paths, one for
@@ -131,3 +165,237 @@ def test_find_cluster_centers_ndarray():
     ctrs = util.find_cluster_centers(assignments=a, distances=d)
 
     assert_array_equal(ctrs, [1, 2])
+
+
+def test_find_cluster_centers_many_labels():
+
+    rng = np.random.default_rng(0)
+    a = rng.integers(0, 500, size=5000)
+    # coarse distances, so that many labels have ties
+    d = rng.integers(0, 20, size=5000) / 10
+
+    ctrs = util.find_cluster_centers(assignments=a, distances=d)
+
+    expected = [np.where(a == c)[0][np.argmin(d[a == c])]
+                for c in np.unique(a)]
+    assert_array_equal(ctrs, expected)
+
+
+@pytest.mark.mpi
+def test_find_cluster_centers_mpi():
+
+    from enspara import mpi
+
+    rng = np.random.default_rng(0)
+    all_a = [rng.integers(0, 50, size=200) for _ in range(mpi.size())]
+    all_d = [rng.integers(0, 20, size=200) / 10 for _ in range(mpi.size())]
+
+    ctrs = util.find_cluster_centers_mpi(
+        all_a[mpi.rank()], all_d[mpi.rank()])
+
+    a = np.concatenate(all_a)
+    d = np.concatenate(all_d)
+    expected = util.find_cluster_centers(a, d)
+
+    assert_array_equal([200*r + i for r, i in ctrs], expected)
+
+
+def test_rmsd_subset_matches_slicing():
+
+    trj = md.load(get_fn('frame0.h5'))
+    mask = np.zeros(len(trj), dtype=bool)
+    mask[::5] = True
+
+    expected = md.rmsd(trj[mask], trj[10])
+
+    out = np.zeros(len(trj))
+    util._distances_to_subset(util.rmsd, trj, trj[10], mask, out)
+
+    assert_allclose(out[mask], expected, atol=1e-3)
+    assert np.all(out[~mask] == 0)
+    assert trj._rmsd_traces.dtype == np.float64
+
+
+def test_rmsd_recenters_replaced_coordinates():
+
+    trj = md.load(get_fn('frame0.h5'))
+    ref = trj[10]
+    util.rmsd(trj, ref)
+
+    # same number of frames, so the cached traces look valid by length;
+    # the replaced coordinates must still be centered and traced again.
+    trj.xyz = trj.xyz[::-1] + 5
+    expected = md.rmsd(trj, ref, precentered=False)
+
+    assert_allclose(util.rmsd(trj, ref), expected, atol=1e-3)
+
+
+def test_assign_to_nearest_center_features():
+
+    # euclidean and manhattan features take a blocked libdist kernel
+    # rather than looping over centers.
+    X = np.random.default_rng(0).random((2000, 5))
+    centers = X[::50]
+
+    for metric in [util.euclidean, util.manhattan]:
+        alldists = np.array([metric(X, c) for c in centers])
+
+        assigns, distances = util.assign_to_nearest_center(
+            X, centers, metric)
+
+        assert_array_equal(np.argmin(alldists, axis=0), assigns)
+        assert_array_equal(np.min(alldists, axis=0), distances)
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'rmsd'])
+def test_vptree_matches_brute_force(metric):
+
+    from enspara.cluster.vptree import VPTree
+
+    if metric == 'rmsd':
+        X = md.load(get_fn('frame0.h5'))
+        centers = X[::7]
+    else:
+        X = np.random.default_rng(0).random((3000, 3))
+        # include duplicate centers, which must go to the lowest index
+        centers = np.concatenate([X[::20], X[:5]])
+
+    tree = VPTree(centers, metric, leaf_size=4, random_state=0)
+    assigns, dists = tree.query(X)
+
+    distance = util._get_distance_method(metric)
+    alldists = np.array([distance(X, centers[i])
+                         for i in range(len(centers))])
+
+    # RMSDs of a subset of frames may differ in the last bits from
+    # those of the whole trajectory
+    assert_allclose(dists, alldists.min(axis=0), atol=1e-6)
+    assert_array_equal(assigns, alldists.argmin(axis=0))
+
+    a, d = util.assign_to_nearest_center(
+        X, centers, distance, index=tree)
+    assert_array_equal(a, assigns)
+
+    with pytest.raises(util.DataInvalid):
+        util.assign_to_nearest_center(X, centers[:10], distance, index=tree)
+
+
+def test_vptree_save_load(tmp_path):
+
+    from enspara.cluster.vptree import VPTree
+
+    X = np.random.default_rng(1).random((500, 4))
+    centers = X[::5]
+
+    tree = VPTree(centers, 'euclidean', random_state=0)
+    path = str(tmp_path / 'index.npz')
+    tree.save(path)
+
+    loaded = VPTree.load(path, centers, 'euclidean')
+    assert_array_equal(loaded.query(X)[0], tree.query(X)[0])
+
+    with pytest.raises(util.DataInvalid):
+        VPTree.load(path, centers[:-1], 'euclidean')
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_load_frames(processes):
+
+    top = md.load(get_fn('native.pdb')).top
+    filenames = [get_fn('frame0.xtc'), get_fn('frame0.h5'),
+                 get_fn('native.pdb')]
+    indices = [(1, 40), (0, 7), (0, 2), (1, 3), (2, 0), (0, 7), (0, 100)]
+
+    frames = util.load_frames(filenames, indices, top=top, stride=2,
+                              processes=processes)
+
+    assert len(frames) == len(indices)
+    for (i, j), frame in zip(indices, frames):
+        expected = md.load_frame(filenames[i], index=j*2, top=top)
+        assert_array_equal(frame.xyz, expected.xyz)
+        assert_array_equal(frame.time, expected.time)
+        assert frame.topology == expected.topology
+
+    with pytest.raises(util.ImproperlyConfigured):
+        util.load_frames(filenames, [(0, 10000)], top=top)
+
+    # a path to a topology works as well as an md.Topology
+    frames = util.load_frames(filenames[:1], [(0, 3)],
+                              top=get_fn('native.pdb'))
+    assert_array_equal(
+        frames[0].xyz,
+        md.load_frame(filenames[0], index=3, top=top).xyz)
+
+
+def test_intermediate_writer_snapshots_and_errors(monkeypatch):
+
+    import argparse
+    import threading
+
+    written = []
+    release = threading.Event()
+
+    def write(result, args, lengths, intermediate_n):
+        release.wait()
+        if intermediate_n == 'fail':
+            raise ValueError(intermediate_n)
+        written.append((intermediate_n, result.assignments.copy(),
+                        threading.current_thread()))
+
+    monkeypatch.setattr(util, 'write_intermediates', write)
+
+    assignments = np.zeros(10, dtype=int)
+    result = util.ClusterResult(
+        center_indices=[0], assignments=assignments,
+        distances=np.zeros(10), centers=[np.zeros(3)])
+    args = argparse.Namespace(subsample=1, no_reassign=False)
+
+    writer = util.IntermediateWriter(args=args, lengths=[10])
+    assert writer.background
+    writer.submit(result, 'a')
+    # snapshots are taken at submission
+    assignments[:] = 1
+
+    # the writer is blocked on 'a', so this blocks until it is written
+    submitted = threading.Event()
+    t = threading.Thread(
+        target=lambda: (writer.submit(result, 'b'), submitted.set()))
+    t.start()
+    assert not submitted.wait(0.2)
+
+    release.set()
+    t.join()
+    writer.close()
+
+    assert [n for n, _, _ in written] == ['a', 'b']
+    assert_array_equal(written[0][1], 0)
+    assert_array_equal(written[1][1], 1)
+    assert written[0][2] is not threading.current_thread()
+
+    writer = util.IntermediateWriter(args=args, lengths=[10])
+    writer.submit(result, 'fail')
+    with pytest.raises(ValueError):
+        writer.close()
+
+    # results that need reassignment are written synchronously
+    written.clear()
+    args = argparse.Namespace(subsample=2, no_reassign=False)
+    with util.IntermediateWriter(args=args, lengths=[10]) as writer:
+        assert not writer.background
+        writer.submit(result, 'c')
+        assert [n for n, _, _ in written] == ['c']
+        assert written[0][2] is threading.current_thread()
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'manhattan'])
+def test_distances_at_writes_dtype_directly(metric):
+
+    from enspara.geometry import libdist
+
+    X = np.random.RandomState(0).normal(size=(100, 5))
+    method = getattr(libdist, metric)
+
+    d = util._distances_at(method, X, X[3], np.float32)
+
+    assert d.dtype == np.float32
+    assert_array_equal(d, method(X, X[3]).astype(np.float32))
@@ -1,13 +1,16 @@
 import numpy as np
+import mdtraj as md
 from scipy.spatial.distance import cdist
 from scipy.spatial.distance import hamming as scipy_hamming
 import pytest
 
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_allclose
 
 from enspara import exception
 from enspara.geometry import libdist
 
+from .util import get_fn
+
 
 def test_hamming_distance():
 
@@ -107,3 +110,157 @@ def test_euclidean_distance_noalloc():
     assert_array_equal(
         d,
         cdist(X, y.reshape(1, -1)).flatten())
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'manhattan', 'hamming'])
+def test_float32_out(metric):
+
+    X = np.random.RandomState(0).randint(0, 4, size=(50, 7))
+    if metric != 'hamming':
+        X = X * 1.1
+    distance = getattr(libdist, metric)
+
+    expected = distance(X, X[3])
+    out = np.full(len(X), -1, dtype='float32')
+    d = distance(X, X[3], out=out)
+
+    # accumulated at double precision, then rounded once
+    assert d is out
+    assert_array_equal(out, expected.astype('float32'))
+
+
+def test_rmsd_float32_out():
+
+    trj = md.load(get_fn('frame0.h5'))
+    trj.center_coordinates()
+    expected = libdist.rmsd(trj.xyz, trj.xyz[3])
+
+    out = np.empty(len(trj), dtype='float32')
+    assert libdist.rmsd(trj.xyz, trj.xyz[3], out=out) is out
+    assert_array_equal(out, expected.astype('float32'))
+
+    mask = np.zeros(len(trj), dtype=bool)
+    mask[::5] = True
+    out.fill(-1)
+    libdist.rmsd(trj.xyz, trj.xyz[3], indices=mask, out=out)
+    assert_array_equal(out[mask], expected[mask].astype('float32'))
+    assert np.all(out[~mask] == -1)
+
+
+def test_rmsd_matches_mdtraj():
+
+    trj = md.load(get_fn('frame0.h5'))
+    expected = md.rmsd(trj, trj, 17)
+
+    trj.center_coordinates()
+    d = libdist.rmsd(trj.xyz, trj.xyz[17])
+
+    assert_allclose(d, expected, atol=1e-3)
+    assert d[17] < 1e-6
+
+    traces = libdist.rmsd_traces(trj.xyz)
+    assert_allclose(
+        traces, np.square(trj.xyz.astype('float64')).sum(axis=(1, 2)))
+    assert_array_equal(
+        d, libdist.rmsd(trj.xyz, trj.xyz[17], X_traces=traces))
+
+
+def test_rmsd_subset_inplace():
+
+    trj = md.load(get_fn('frame0.h5'))
+    trj.center_coordinates()
+    full = libdist.rmsd(trj.xyz, trj.xyz[3])
+
+    mask = np.zeros(len(trj), dtype=bool)
+    mask[::7] = True
+
+    for subset in [mask, np.flatnonzero(mask)]:
+        out = np.full(len(trj), -1, dtype='float64')
+        d = libdist.rmsd(trj.xyz, trj.xyz[3], indices=subset, out=out)
+
+        assert d is out
+        assert_array_equal(out[mask], full[mask])
+        assert np.all(out[~mask] == -1)
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.rmsd(trj.xyz, trj.xyz[3], indices=mask[1:])
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.rmsd(trj.xyz, trj.xyz[3], indices=[len(trj)])
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.rmsd(trj.xyz, trj.xyz[3],
+                     out=np.empty(len(trj), dtype='float16'))
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.rmsd(trj.xyz, trj.xyz[3, :-1])
+
+
+@pytest.mark.parametrize('metric,dtype', [
+    ('euclidean', 'float64'), ('euclidean', 'float32'),
+    ('euclidean', 'int32'), ('manhattan', 'float64'),
+    ('manhattan', 'float32'), ('hamming', 'uint8'), ('hamming', 'int64')])
+def test_nearest_center_matches_distance(metric, dtype, monkeypatch):
+
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 4, size=(1000, 13)).astype(dtype)
+    if np.issubdtype(X.dtype, np.floating):
+        X += rng.random(X.shape).astype(dtype)
+    centers = X[rng.choice(len(X), 300, replace=False)]
+
+    distance = getattr(libdist, metric)
+    alldists = np.array([distance(X, c) for c in centers])
+
+    # small blocks, so that several center and frame blocks are used
+    monkeypatch.setattr(
+        libdist, '_NEAREST_CENTER_BLOCK_BYTES', 7 * X[0].nbytes)
+    monkeypatch.setattr(libdist, '_NEAREST_BLOCK_BYTES', 8 * 7 * 100)
+
+    assignments, distances = libdist.nearest_center(X, centers, metric)
+
+    assert_array_equal(distances, alldists.min(axis=0))
+    # ties (common with integer data) go to the lowest index
+    assert_array_equal(assignments, alldists.argmin(axis=0))
+
+
+def test_nearest_center_euclidean_offset():
+
+    # far from the origin relative to their spread, where ranking by
+    # |c|^2 - 2 <x, c> alone loses the difference between centers
+    rng = np.random.default_rng(2)
+    X = 1e4 + 1e-3 * rng.random((20000, 3))
+    centers = X[rng.choice(len(X), 50, replace=False)]
+
+    alldists = np.array([libdist.euclidean(X, c) for c in centers])
+    assignments, distances = libdist.nearest_center(X, centers)
+
+    assert_array_equal(assignments, alldists.argmin(axis=0))
+    assert_array_equal(distances, alldists.min(axis=0))
+
+
+def test_nearest_center_inplace():
+
+    X = np.random.default_rng(1).random((100, 4))
+    assignments = np.full(len(X), -1, dtype=np.intp)
+    distances = np.zeros(len(X))
+
+    a, d = libdist.nearest_center(
+        X, X[:10], 'euclidean', assignments=assignments,
+        distances=distances)
+
+    assert a is assignments and d is distances
+    assert_array_equal(assignments[:10], np.arange(10))
+    assert_array_equal(distances[:10], 0)
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.nearest_center(X, X[:10, :3])
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.nearest_center(X, X[:10].astype('float32'))
+
+    with pytest.raises(exception.DataInvalid):
+        libdist.nearest_center(
+            X, X[:10], distances=np.zeros(len(X), dtype='float32'))
+
+    with pytest.raises(exception.ImproperlyConfigured):
+        libdist.nearest_center(X, X[:10], 'rmsd')
@@ -1,3 +1,4 @@
+import os
 import tempfile
 import random
 import pytest
@@ -38,3 +39,75 @@ def test_parallel_h5_read_strided():
 
     assert_array_equal(local_arr,
                        full_arr[mpi.rank()::mpi.size(), ::3]._data)
+
+
+@pytest.mark.mpi
+def test_parallel_h5_read_balanced():
+
+    lengths = mpi.comm.bcast(
+        [random.randint(3, 170) for i in range(mpi.size() * 3)], root=0)
+    full_arr = ra.RaggedArray(
+        mpi.comm.bcast(np.random.random(size=(sum(lengths), 11)), root=0),
+        lengths=lengths)
+
+    with tempfile.TemporaryDirectory() as d:
+        d = mpi.comm.bcast(d, root=0)
+        fname = os.path.join(d, 'data.h5')
+        if mpi.rank() == 0:
+            ra.save(fname, full_arr)
+        mpi.comm.Barrier()
+
+        global_lengths, local_arr = mpi.io.load_h5_as_striped(
+            fname, balanced=True)
+        mpi.comm.Barrier()
+
+    owners = mpi.ops.stripe_owners(lengths, balanced=True)
+    assert_array_equal(global_lengths, lengths)
+    assert_array_equal(
+        local_arr,
+        np.concatenate([full_arr[i] for i in np.flatnonzero(
+            owners == mpi.rank())]))
+
+
+@pytest.mark.mpi
+@pytest.mark.parametrize('n_files,stride', [(1, 1), (3, 1), (3, 2)])
+def test_parallel_npy_read_memmap(n_files, stride):
+
+    lengths = mpi.comm.bcast(
+        [random.randint(3, 17) for i in range(mpi.size() * n_files)],
+        root=0)
+    full_arr = ra.RaggedArray(
+        mpi.comm.bcast(np.random.random(size=(sum(lengths), 11)), root=0),
+        lengths=lengths)
+
+    with tempfile.TemporaryDirectory() as d:
+        d = mpi.comm.bcast(d, root=0)
+
+        filenames = []
+        for i in range(len(full_arr.lengths)):
+            filenames.append(os.path.join(d, '%s.npy' % i))
+            if mpi.rank() == 0:
+                np.save(filenames[-1], full_arr._data[
+                    full_arr.starts[i]:full_arr.starts[i]+lengths[i]])
+        mpi.comm.Barrier()
+
+        # the memmap directory is created if need be
+        memmap_dir = os.path.join(d, 'memmaps')
+        global_lengths, local_arr = mpi.io.load_npy_as_striped(
+            filenames, stride=stride, memmap_dir=memmap_dir)
+
+        assert isinstance(local_arr, np.memmap)
+        assert not local_arr.flags.writeable
+        # joined files are removed, but stay readable through the map
+        mpi.comm.Barrier()
+        if os.path.isdir(memmap_dir):
+            assert not os.listdir(memmap_dir)
+        assert_array_equal(global_lengths, full_arr.lengths)
+        assert_array_equal(
+            local_arr,
+            np.concatenate([full_arr._data[s:s+l:stride] for s, l in zip(
+                full_arr.starts[mpi.rank()::mpi.size()],
+                lengths[mpi.rank()::mpi.size()])]))
+
+        del local_arr
+        mpi.comm.Barrier()
@@ -6,7 +6,7 @@ import mdtraj as md
 
 from .util import get_fn
 from .. import exception
-from .. import mpi
+from .. import mpi, ra
 
 
 @pytest.mark.mpi
@@ -45,6 +45,26 @@ def test_mpi_max():
     assert 0 == mpi.ops.striped_array_max(a)
 
 
+@pytest.mark.mpi
+def test_mpi_argmax():
+
+    # every rank's maximum is 10, so the lowest rank wins the tie, at
+    # the first position of its maximum.
+    a = np.array([3, 10, 1, 10]) + np.zeros(mpi.rank() + 1)[:, None]
+    a = a.flatten()
+    payload = np.arange(len(a)) * 2
+
+    assert mpi.ops.striped_array_argmax(a) == (10, 0, 1)
+    assert mpi.ops.striped_array_argmax(a, payload) == (10, 0, 1, 2)
+
+    a[-1] = 11 + mpi.rank()
+    maximum, owner, index, value = mpi.ops.striped_array_argmax(
+        a, payload)
+    assert (maximum, owner, index) == (10 + mpi.size(), mpi.size() - 1,
+                                       4 * mpi.size() - 1)
+    assert value == mpi.comm.bcast(payload[-1], root=owner)
+
+
 @pytest.mark.mpi
 def test_mpi_distribute_frame_ndarray():
 
@@ -66,6 +86,13 @@ def test_mpi_distribute_frame_mdtraj():
     assert_array_equal(d.xyz, data[7].xyz)
     assert type(d) is type(data)
 
+    d, request = mpi.ops.distribute_frame(
+        data, 7, mpi.size()-1, nonblocking=True)
+    request.Wait()
+
+    assert_array_equal(d.xyz, data[7].xyz)
+    assert type(d) is type(data)
+
 
 @pytest.mark.mpi
 def test_mpi_assemble_striped_array():
@@ -77,6 +104,50 @@ def test_mpi_assemble_striped_array():
     assert_array_equal(a, b)
 
 
+def test_stripe_owners_balanced():
+
+    lengths = [100, 1, 1, 1, 50, 50, 2, 2]
+
+    assert_array_equal(mpi.ops.stripe_owners(lengths),
+                       np.arange(len(lengths)) % mpi.size())
+
+    owners = mpi.ops.stripe_owners(lengths, balanced=True)
+    assert owners.shape == (len(lengths),)
+    assert set(owners) <= set(range(mpi.size()))
+
+    # no rank ends up with more frames than round-robin would give it.
+    loads = np.bincount(owners, weights=lengths, minlength=mpi.size())
+    rr_loads = np.bincount(np.arange(len(lengths)) % mpi.size(),
+                           weights=lengths, minlength=mpi.size())
+    assert loads.max() <= rr_loads.max()
+    assert loads.max() <= max(lengths) + sum(lengths) / mpi.size()
+
+    assert_array_equal(owners, mpi.ops.stripe_owners(lengths, balanced=True))
+
+
+@pytest.mark.mpi
+def test_mpi_assemble_striped_ragged_array_balanced():
+
+    lengths = [30, 2, 3, 20, 1, 4, 12]
+    owners = mpi.ops.stripe_owners(lengths, balanced=True)
+
+    full = ra.RaggedArray(np.arange(sum(lengths)) * 10, lengths=lengths)
+    local = np.concatenate(
+        [full[i] for i in np.flatnonzero(owners == mpi.rank())] +
+        [np.zeros(0, dtype=full._data.dtype)])
+
+    assembled = mpi.ops.assemble_striped_ragged_array(
+        local, lengths, owners)
+    assert assembled.dtype == full._data.dtype
+    assert_array_equal(assembled, full._data)
+
+    # local index i is local[i], and so global frame local[i] / 10.
+    local_inds = [i for i in range(len(local))]
+    global_inds = mpi.ops.convert_local_indices(
+        [(mpi.rank(), i) for i in local_inds], lengths, owners)
+    assert_array_equal(global_inds, local[local_inds] // 10)
+
+
 @pytest.mark.mpi
 def test_mpi_randind():
 
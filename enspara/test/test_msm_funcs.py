@@ -7,11 +7,12 @@ from numpy.testing import assert_array_equal, assert_allclose
 import numpy as np
 import scipy.sparse
 
-from .. import exception
+from .. import exception, ra
 
-from ..msm import builders
+from ..msm import builders, transition_matrices
 from ..msm.transition_matrices import assigns_to_counts, eigenspectrum, \
-   trim_disconnected, TrimMapping
+   trim_disconnected, TrimMapping, assigns_to_counts_by_lag, \
+   reversible_eigenspectrum, is_reversible
 from ..msm.timescales import implied_timescales
 from .msm_data import TRIMMABLE
 
@@ -60,6 +61,140 @@ def test_trim_mapping_roundtrip():
         assert tm == tm2
 
 
+def test_implied_timescales_parallel():
+
+    in_assigns = TRIMMABLE['assigns']
+
+    for trim in [False, True]:
+        serial = implied_timescales(
+            in_assigns, lag_times=range(1, 5), method=builders.transpose,
+            trim=trim)
+        parallel = implied_timescales(
+            in_assigns, lag_times=range(1, 5), method=builders.transpose,
+            trim=trim, n_procs=2)
+
+        assert_allclose(parallel, serial)
+
+
+@pytest.mark.parametrize('arr_type', [np.array, scipy.sparse.csr_matrix])
+def test_eigenspectrum_partial(arr_type, monkeypatch):
+    """eigenspectrum's partial (ARPACK) solve of large matrices agrees
+    with the full solve.
+    """
+
+    # small enough to check against the full solve quickly
+    monkeypatch.setattr(transition_matrices, 'FULL_EIG_MAX_STATES', 100)
+
+    rng = np.random.RandomState(0)
+    n_states = 300
+    C = rng.poisson(0.05, size=(n_states, n_states))
+    C = C + C.T + np.diag(rng.randint(1, 20, size=n_states))
+    T = C / C.sum(axis=1)[:, None]
+
+    full_vals, full_vecs = eigenspectrum(T)
+    vals, vecs = eigenspectrum(arr_type(T), n_eigs=5)
+
+    assert vals.shape == (5,)
+    assert vecs.shape == (n_states, 5)
+    assert_allclose(vals, full_vals[:5], rtol=1e-8)
+    assert_allclose(vecs[:, 0], full_vecs[:, 0], atol=1e-10)
+    for i in range(1, 5):
+        # eigenvectors are only determined up to sign
+        assert_allclose(np.abs(vecs[:, i] / np.linalg.norm(vecs[:, i])),
+                        np.abs(full_vecs[:, i] /
+                               np.linalg.norm(full_vecs[:, i])),
+                        atol=1e-6)
+
+
+@pytest.mark.parametrize('arr_type', [np.array, scipy.sparse.csr_matrix])
+@pytest.mark.parametrize('n_states,n_eigs', [(20, None), (20, 4), (300, 5)])
+def test_reversible_eigenspectrum(arr_type, n_states, n_eigs,
+                                  monkeypatch):
+    """The symmetric eigensolver path agrees with the general one for
+    reversible models, and gives biorthonormal left and right vectors.
+    """
+
+    monkeypatch.setattr(transition_matrices, 'FULL_EIG_MAX_STATES', 100)
+
+    rng = np.random.RandomState(2)
+    C = rng.poisson(0.1, size=(n_states, n_states))
+    C = C + np.diag(rng.randint(1, 20, size=n_states))
+    _, T, pi = builders.transpose(arr_type(C))
+
+    assert is_reversible(T, pi)
+
+    full_vals, full_left = eigenspectrum(T, left=True)
+    _, full_right = eigenspectrum(T, left=False)
+
+    vals, left_vecs, right_vecs = reversible_eigenspectrum(
+        T, pi, n_eigs=n_eigs)
+    n = n_states if n_eigs is None else n_eigs
+
+    assert vals.shape == (n,)
+    assert_allclose(vals, full_vals[:n], atol=1e-10)
+    assert_allclose(left_vecs[:, 0], pi, atol=1e-10)
+    assert_allclose(right_vecs[:, 0], 1, atol=1e-8)
+    assert_allclose(left_vecs.T @ right_vecs, np.eye(n), atol=1e-8)
+
+    vals, vecs = eigenspectrum(T, n_eigs=n_eigs, eq_probs=pi)
+    assert_allclose(vals, full_vals[:n], atol=1e-10)
+    assert_allclose(vecs[:, 0], full_left[:, 0], atol=1e-10)
+
+    vals, vecs = eigenspectrum(T, n_eigs=n_eigs, left=False, eq_probs=pi)
+    assert_allclose(vecs[:, 0], full_right[:, 0], atol=1e-10)
+
+
+@pytest.mark.parametrize('arr_type', [np.array, scipy.sparse.csr_matrix])
+def test_eigenspectrum_arpack_no_convergence(arr_type, monkeypatch):
+    """When ARPACK doesn't converge, the eigenpairs are found with the
+    dense solvers instead.
+    """
+
+    monkeypatch.setattr(transition_matrices, 'FULL_EIG_MAX_STATES', 100)
+
+    def no_convergence(*args, **kwargs):
+        raise scipy.sparse.linalg.ArpackNoConvergence(
+            'no convergence', np.zeros(0), np.zeros((0, 0)))
+
+    monkeypatch.setattr(scipy.sparse.linalg, 'eigs', no_convergence)
+    monkeypatch.setattr(scipy.sparse.linalg, 'eigsh', no_convergence)
+
+    rng = np.random.RandomState(0)
+    n_states = 300
+    C = rng.poisson(0.05, size=(n_states, n_states))
+    C = C + C.T + np.diag(rng.randint(1, 20, size=n_states))
+    _, T, pi = builders.transpose(arr_type(C))
+
+    full_vals, full_vecs = eigenspectrum(T)
+
+    vals, vecs = eigenspectrum(T, n_eigs=5)
+    assert_allclose(vals, full_vals[:5], atol=1e-10)
+    assert_allclose(vecs[:, 0], full_vecs[:, 0], atol=1e-10)
+
+    vals, left_vecs, _ = reversible_eigenspectrum(T, pi, n_eigs=5)
+    assert_allclose(vals, full_vals[:5], atol=1e-10)
+    assert_allclose(left_vecs[:, 0], pi, atol=1e-10)
+
+
+def test_eigenspectrum_nonreversible_eq_probs():
+    """eigenspectrum falls back to the general solver when T isn't in
+    detailed balance with respect to the given eq_probs.
+    """
+
+    T = np.array([[0.5, 0.5, 0.0],
+                  [0.0, 0.5, 0.5],
+                  [0.5, 0.0, 0.5]])
+    pi = np.ones(3) / 3
+
+    assert not is_reversible(T, pi)
+
+    expected_vals, expected_vecs = eigenspectrum(T)
+    vals, vecs = eigenspectrum(T, eq_probs=pi)
+
+    assert_allclose(vals, expected_vals)
+    assert_allclose(vecs, expected_vecs)
+
+
 def test_implied_timescales():
 
     in_assigns = TRIMMABLE['assigns']
@@ -135,6 +270,70 @@ def test_assigns_to_counts_negnums():
     assert_array_equal(counts.toarray(), expected)
 
 
+def _reference_counts(trjs, lag_time, n_states, sliding_window):
+    C = np.zeros((n_states, n_states), dtype=int)
+    step = 1 if sliding_window else lag_time
+    for trj in trjs:
+        trj = np.asarray(trj)
+        trj = trj[trj != -1]
+        for i in range(0, len(trj) - lag_time, step):
+            C[trj[i], trj[i + lag_time]] += 1
+    return C
+
+
+@pytest.mark.parametrize('sliding_window', [True, False])
+@pytest.mark.parametrize('lag_time', [1, 3])
+@pytest.mark.parametrize('max_n_states', [None, 5000])
+def test_assigns_to_counts_ragged(sliding_window, lag_time, max_n_states):
+    """assigns_to_counts matches per-trajectory counting on
+    RaggedArrays, lists and padded arrays, with -1s, short trajectories
+    and dense or sparse tallying.
+    """
+
+    rng = np.random.RandomState(0)
+    trjs = [rng.randint(-1, 6, size=n) for n in [0, 1, 3, 40, 17, 2, 25]]
+    n_states = 6 if max_n_states is None else max_n_states
+
+    expected = _reference_counts(trjs, lag_time, n_states, sliding_window)
+
+    for assigns in [ra.RaggedArray(trjs), trjs]:
+        counts = assigns_to_counts(
+            assigns, lag_time=lag_time, max_n_states=max_n_states,
+            sliding_window=sliding_window)
+        assert scipy.sparse.isspmatrix_csr(counts)
+        assert_array_equal(counts.toarray(), expected)
+
+    padded = -np.ones((len(trjs), 40), dtype=int)
+    for i, trj in enumerate(trjs):
+        padded[i, :len(trj)] = trj
+    counts = assigns_to_counts(
+        padded, lag_time=lag_time, max_n_states=max_n_states,
+        sliding_window=sliding_window)
+    assert_array_equal(counts.toarray(), expected)
+
+
+@pytest.mark.parametrize('sliding_window', [True, False])
+def test_assigns_to_counts_by_lag(sliding_window):
+    """assigns_to_counts_by_lag matches assigns_to_counts at each lag.
+    """
+
+    rng = np.random.RandomState(1)
+    assigns = ra.RaggedArray(
+        [rng.randint(-1, 8, size=n) for n in [50, 3, 0, 31, 12]])
+    lag_times = [1, 2, 5, 13, 60]
+
+    counts = assigns_to_counts_by_lag(
+        assigns, lag_times, sliding_window=sliding_window)
+
+    assert len(counts) == len(lag_times)
+    for lag_time, C in zip(lag_times, counts):
+        expected = assigns_to_counts(
+            assigns, lag_time=lag_time, max_n_states=8,
+            sliding_window=sliding_window)
+        assert C.shape == (8, 8)
+        assert_array_equal(C.toarray(), expected.toarray())
+
+
 @pytest.mark.xfail(exception.DataInvalid)
 def test_assigns_to_counts_1d():
     """assigns_to_counts handles 1d arrays gracefully
@@ -258,6 +457,23 @@ def test_mle_types():
                 expected)
 
 
+def test_mle_sparse_warm_start():
+
+    C = scipy.sparse.csr_matrix(np.array(
+        [[10, 2, 0, 1],
+         [3, 8, 4, 0],
+         [0, 5, 9, 2],
+         [1, 0, 3, 7]]))
+
+    _, T, pi = builders.mle(C)
+    _, T_warm, pi_warm = builders.mle(C + C, warm_start=(T, pi))
+    _, T_cold, pi_cold = builders.mle(C + C)
+
+    assert scipy.sparse.issparse(T_warm)
+    assert_allclose(T_warm.toarray(), T_cold.toarray(), atol=1e-6)
+    assert_allclose(pi_warm, pi_cold, atol=1e-6)
+
+
 def test_mle_not_in_place():
 
     in_cts = np.array(
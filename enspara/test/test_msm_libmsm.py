@@ -1,10 +1,14 @@
+import warnings
+
 import numpy as np
+import scipy.sparse
 import pytest
 
 from numpy.testing import assert_allclose
 
 from enspara import exception
-from enspara.msm.libmsm import _mle_prinz_dense
+from enspara.msm.libmsm import (_mle_prinz_dense, _mle_prinz_sparse,
+                                _prinz_sparse_rows)
 
 
 def prinz_mle_py(C, tol=1e-10, max_iter=10**5):
@@ -126,3 +130,141 @@ def test_prinz_mle_pyx_py_agreement():
 
         assert_allclose(T_old, T_new, atol=1e-5)
         assert_allclose(pi_old, pi_new, atol=1e-5)
+
+
+def test_prinz_mle_sparse_dense_agreement():
+    for i in range(50):
+        n_states = np.random.randint(2, 40)
+
+        C = (np.random.poisson(lam=0.3, size=(n_states, n_states)) +
+             np.diag(np.random.poisson(lam=10, size=(n_states,)) + 1))
+        # keep it connected, so that the MLE is unique
+        C = C + np.roll(np.eye(n_states), 1, axis=1)
+
+        T_dense, pi_dense = _mle_prinz_dense(C)
+        T_sparse, pi_sparse = _mle_prinz_sparse(scipy.sparse.csr_matrix(C))
+
+        assert scipy.sparse.isspmatrix_csr(T_sparse)
+        assert_allclose(T_sparse.sum(axis=1), 1)
+        assert_allclose(T_dense, T_sparse.toarray(), atol=1e-5)
+        assert_allclose(pi_dense, pi_sparse, atol=1e-5)
+
+        # T is only nonzero where C + C.T is
+        assert np.all(T_sparse.toarray()[(C + C.T) == 0] == 0)
+
+
+def test_prinz_mle_sparse_warm_start():
+    n_states = 200
+    C = scipy.sparse.random(
+        n_states, n_states, density=0.02, random_state=0,
+        data_rvs=lambda n: np.random.poisson(lam=5, size=n) + 1)
+    C = C + scipy.sparse.identity(n_states)
+    C = C + scipy.sparse.csr_matrix(np.roll(np.eye(n_states), 1, axis=1))
+
+    T, pi = _mle_prinz_sparse(C)
+
+    # detailed balance holds
+    flux = scipy.sparse.diags(pi) @ T
+    assert_allclose(flux.toarray(), flux.T.toarray(), atol=1e-10)
+
+    # starting from the answer (at any scale) stays there
+    T_warm, pi_warm = _mle_prinz_sparse(C, X0=10 * flux)
+    assert_allclose(T_warm.toarray(), T.toarray(), atol=1e-6)
+    assert_allclose(pi_warm, pi, atol=1e-6)
+
+    C_perturbed = C + scipy.sparse.identity(n_states)
+    T_cold, pi_cold = _mle_prinz_sparse(C_perturbed)
+    T_warm, pi_warm = _mle_prinz_sparse(C_perturbed, X0=flux)
+    assert_allclose(T_warm.toarray(), T_cold.toarray(), atol=1e-6)
+    assert_allclose(pi_warm, pi_cold, atol=1e-6)
+
+
+def test_prinz_mle_sparse_no_outgoing():
+    C = scipy.sparse.csr_matrix(np.array([[1., 1.], [0., 0.]]))
+
+    with pytest.raises(exception.DataInvalid):
+        _mle_prinz_sparse(C)
+
+
+def test_prinz_mle_sparse_converges_on_large_counts():
+    # 20k states, with counts between nearby states (as in a
+    # metastable system), ~200k nonzeros, and self-counts everywhere
+    n_states = 20000
+    rng = np.random.RandomState(0)
+    rows = np.repeat(np.arange(n_states), 10)
+    cols = (rows + rng.randint(-50, 51, size=len(rows))) % n_states
+    C = scipy.sparse.csr_matrix(
+        (rng.geometric(0.3, size=len(rows)).astype(float), (rows, cols)),
+        shape=(n_states, n_states))
+    C = C + scipy.sparse.diags(
+        rng.randint(10, 1000, size=n_states).astype(float))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', exception.ConvergenceWarning)
+        T, pi = _mle_prinz_sparse(C, max_iter=25)
+
+    # at the maximum, pi_i T_ij (c_i / pi_i + c_j / pi_j) == C_ij + C_ji
+    C_rs = np.asarray(C.sum(axis=1)).reshape(-1)
+    S = (C + C.T).tocsr()
+    T = T.tocoo()
+    S_vals = np.asarray(S[T.row, T.col]).reshape(-1)
+    assert_allclose(
+        T.data * (C_rs[T.row] + C_rs[T.col] * pi[T.row] / pi[T.col]),
+        S_vals, rtol=1e-8)
+
+
+def test_prinz_mle_sparse_transient_states():
+    # states that are never entered have no equilibrium probability,
+    # which Newton's method only approaches linearly.
+    n_states = 2000
+    rng = np.random.RandomState(1)
+    rows = np.repeat(np.arange(n_states), 10)
+    cols = (rows + rng.randint(-50, 51, size=len(rows))) % n_states
+    C = scipy.sparse.csr_matrix(
+        (rng.geometric(0.3, size=len(rows)).astype(float), (rows, cols)),
+        shape=(n_states, n_states)).tolil()
+    C[:, :3] = 0
+    C[np.arange(3), np.arange(3) + 100] = 5
+    C = C.tocsr()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', exception.ConvergenceWarning)
+        T, pi = _mle_prinz_sparse(C, max_iter=40)
+
+    assert_allclose(np.asarray(T.sum(axis=1)).reshape(-1), 1)
+    assert np.all(pi[:3] < 1e-8)
+
+    C_rs = np.asarray(C.sum(axis=1)).reshape(-1)
+    S = (C + C.T).tocsr()
+    T = T.tocoo()
+    recurrent = (pi[T.row] > 1e-8) & (pi[T.col] > 1e-8)
+    r, c = T.row[recurrent], T.col[recurrent]
+    assert_allclose(
+        T.data[recurrent] * (C_rs[r] + C_rs[c] * pi[r] / pi[c]),
+        np.asarray(S[r, c]).reshape(-1), rtol=1e-8)
+
+
+def test_prinz_sparse_rows_loglikelihood():
+    C = scipy.sparse.random(
+        50, 50, density=0.1, random_state=2,
+        data_rvs=lambda n: np.random.poisson(lam=5, size=n) + 1).tocsr()
+    S = (C + C.T).tocsr()
+    S.sort_indices()
+    C_data = np.asarray(C[np.repeat(np.arange(50), np.diff(S.indptr)),
+                          S.indices]).reshape(-1)
+    y = np.random.RandomState(3).normal(size=50)
+
+    sig, flow, T_data = (np.empty(S.nnz) for _ in range(3))
+    flow_rs = np.empty(50)
+    logl = _prinz_sparse_rows(
+        S.indptr.astype(np.int64), S.indices.astype(np.int64), S.data,
+        C_data, y, sig, flow, flow_rs, T_data)
+
+    T = scipy.sparse.csr_matrix((T_data, S.indices, S.indptr)).toarray()
+    nonzero = C.toarray() > 0
+    assert_allclose(logl, np.sum(C.toarray()[nonzero] * np.log(T[nonzero])))
+
+    # T_ij is proportional to S_ij / (1 + exp(y_j - y_i))
+    expect = S.toarray() / (1 + np.exp(y[None, :] - y[:, None]))
+    expect /= expect.sum(axis=1, keepdims=True)
+    assert_allclose(T, np.nan_to_num(expect))
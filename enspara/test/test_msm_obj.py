@@ -11,6 +11,7 @@ from numpy.testing import assert_allclose, assert_array_equal
 import numpy as np
 
 from ..msm.msm import MSM
+from ..msm.transition_matrices import assigns_to_counts_by_lag
 from ..msm import builders
 
 from .msm_data import TRIMMABLE
@@ -56,6 +57,20 @@ def test_create_msm():
                 assert_array_equal(calc_value, expected_value)
 
 
+def test_msm_fit_counts():
+    in_assigns = TRIMMABLE['assigns']
+
+    for trim in [False, True]:
+        msm = MSM(lag_time=2, method=builders.transpose, trim=trim)
+        msm.fit(in_assigns)
+
+        counts = assigns_to_counts_by_lag(in_assigns, [1, 2, 3])
+        msm_counts = MSM(lag_time=2, method=builders.transpose, trim=trim)
+        msm_counts.fit_counts(counts[1])
+
+        assert msm_counts == msm
+
+
 def test_msm_roundtrip():
     in_assigns = TRIMMABLE['assigns']
 
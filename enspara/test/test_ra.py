@@ -1,16 +1,26 @@
+import os
+import json
+import math
+import shutil
 import unittest
+from unittest.mock import patch
 import logging
 import tempfile
 import pytest
+import multiprocessing as mp
+from functools import partial
 
 import numpy as np
 import mdtraj as md
 from mdtraj import io
 
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_allclose
 
 from enspara import ra
-from ..util.load import load_as_concatenated, concatenate_trjs
+from ..util.load import (load_as_concatenated, load_cached_as_concatenated,
+                         concatenate_trjs, sound_trajectories,
+                         default_lengths_index_dir, _update_lengths_index,
+                         LENGTHS_INDEX_NAME, LENGTHS_INDEX_DIR_VAR)
 from ..exception import DataInvalid, ImproperlyConfigured
 
 from .util import get_fn
@@ -635,6 +645,140 @@ class TestParallelLoad(unittest.TestCase):
         self.assertEqual(expected.shape, xyz.shape)
         self.assertTrue(np.all(expected == xyz))
 
+    def test_load_cached_as_concatenated(self):
+
+        atoms = self.top.select('name CA')
+        args = [{'top': self.top, 'atom_indices': atoms, 'stride': 2},
+                {'top': self.top, 'atom_indices': atoms, 'stride': 3}]
+
+        t1 = md.load(self.trj_fname, top=self.top, atom_indices=atoms,
+                     stride=2)
+        t2 = md.load(self.trj_fname, top=self.top, atom_indices=atoms,
+                     stride=3)
+        t1.center_coordinates()
+        t2.center_coordinates()
+
+        with tempfile.TemporaryDirectory() as d:
+            trj_fname = os.path.join(d, 'frame0.xtc')
+            shutil.copy(self.trj_fname, trj_fname)
+            cache_dir = os.path.join(d, 'cache')
+
+            # the first call fills a store, the second maps it
+            for i in range(2):
+                lengths, xyz = load_cached_as_concatenated(
+                    [trj_fname]*2, cache_dir, args=args, processes=2)
+
+                assert_array_equal(lengths, [len(t1), len(t2)])
+                self.assertIsInstance(xyz, np.memmap)
+                self.assertFalse(xyz.flags.writeable)
+                self.assertEqual(xyz.dtype, np.float32)
+                assert_allclose(xyz[:len(t1)], t1.xyz, atol=1e-6)
+                assert_allclose(xyz[len(t1):], t2.xyz, atol=1e-6)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # a store is filled in chunks, if need be one trajectory each
+            with patch('enspara.util.load.COORDINATE_STORE_CHUNK_BYTES', 1):
+                lengths, chunked = load_cached_as_concatenated(
+                    [trj_fname]*2, os.path.join(d, 'chunked'), args=args)
+            assert_array_equal(chunked, xyz)
+
+            # a changed trajectory, topology or selection gets a new store
+            os.utime(trj_fname, ns=(0, 0))
+            load_cached_as_concatenated([trj_fname]*2, cache_dir, args=args)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            heavy = self.top.select('not element H')
+            args = [dict(a, atom_indices=heavy[:5]) for a in args]
+            lengths, xyz = load_cached_as_concatenated(
+                [trj_fname]*2, cache_dir, args=args)
+            self.assertEqual(xyz.shape[1], 5)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+            other_top = self.top.copy()
+            other_top.atom(0).name = 'X'
+            args[1] = dict(args[1], top=other_top)
+            load_cached_as_concatenated([trj_fname]*2, cache_dir, args=args)
+            self.assertEqual(len(os.listdir(cache_dir)), 4)
+
+            with pytest.raises(ImproperlyConfigured):
+                load_cached_as_concatenated(
+                    [trj_fname], cache_dir,
+                    args=[{'top': self.top, 'frame': 3}])
+
+
+def test_sound_trajectories_index(tmp_path):
+
+    trj_fname = get_fn('frame0.xtc')
+    n_frames = len(md.load(trj_fname, top=get_fn('native.pdb')))
+
+    fnames = [str(tmp_path / ('frame%s.xtc' % i)) for i in range(3)]
+    for f in fnames:
+        shutil.copy(trj_fname, f)
+
+    # with the index turned off, nothing is written
+    lengths = sound_trajectories(fnames, stride=10, processes=2,
+                                 index_dir=False)
+    assert_array_equal(lengths, [math.ceil(n_frames / 10)]*3)
+    assert sorted(os.listdir(tmp_path)) == ['frame0.xtc', 'frame1.xtc',
+                                            'frame2.xtc']
+
+    index_dir = str(tmp_path / 'index')
+    index_fname = os.path.join(index_dir, LENGTHS_INDEX_NAME)
+
+    lengths = sound_trajectories(fnames, stride=10, processes=2,
+                                 index_dir=index_dir)
+    assert_array_equal(lengths, [math.ceil(n_frames / 10)]*3)
+    assert os.path.isfile(index_fname)
+
+    # indexed lengths are used without sounding the file, as long as
+    # its size and modification time haven't changed
+    with open(index_fname) as f:
+        index = json.load(f)
+    index[fnames[0]][2] = 7
+    index[fnames[1]][2] = 7
+    with open(index_fname, 'w') as f:
+        json.dump(index, f)
+    os.utime(fnames[1], ns=(0, 0))
+
+    lengths = sound_trajectories(fnames, index_dir=index_dir)
+    assert_array_equal(lengths, [7, n_frames, n_frames])
+
+    with open(index_fname) as f:
+        assert json.load(f)[fnames[1]][2] == n_frames
+
+
+def test_lengths_index_default_dir(tmp_path, monkeypatch):
+
+    monkeypatch.delenv(LENGTHS_INDEX_DIR_VAR, raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    assert default_lengths_index_dir() == str(tmp_path / 'cache' / 'enspara')
+
+    monkeypatch.setenv(LENGTHS_INDEX_DIR_VAR, '')
+    assert default_lengths_index_dir() is None
+
+    # loading without lengths sounds through the default index
+    index_dir = tmp_path / 'index'
+    monkeypatch.setenv(LENGTHS_INDEX_DIR_VAR, str(index_dir))
+
+    trj_fname = get_fn('frame0.xtc')
+    lengths, xyz = load_as_concatenated(
+        [trj_fname], top=get_fn('native.pdb'))
+
+    with open(index_dir / LENGTHS_INDEX_NAME) as f:
+        index = json.load(f)
+    assert index[os.path.abspath(trj_fname)][2] == lengths[0]
+
+
+def test_lengths_index_concurrent_updates(tmp_path):
+
+    entries = [{'trj%s.xtc' % i: [0, 0, i]} for i in range(32)]
+    with mp.Pool(processes=4) as pool:
+        pool.map(partial(_update_lengths_index, str(tmp_path)), entries)
+
+    with open(os.path.join(tmp_path, LENGTHS_INDEX_NAME)) as f:
+        index = json.load(f)
+    assert index == {k: v for e in entries for k, v in e.items()}
+
 
 class TestConcatenateTrajs(unittest.TestCase):
 
@@ -1,6 +1,11 @@
 import os
+import fcntl
+import hashlib
+import json
 import logging
 import math
+import shutil
+import tempfile
 
 import multiprocessing as mp
 from contextlib import closing
@@ -49,8 +54,146 @@ def sound_trajectory(trj, stride=1, frame=None):
     return math.ceil(n_frames / stride)
 
 
+LENGTHS_INDEX_NAME = 'lengths-index.json'
+LENGTHS_INDEX_DIR_VAR = 'ENSPARA_LENGTHS_INDEX_DIR'
+
+
+def default_lengths_index_dir():
+    """The directory of the trajectory length index used by default.
+
+    This is the value of the environment variable named by
+    LENGTHS_INDEX_DIR_VAR if it is set, or otherwise an enspara
+    directory in the user's cache directory ($XDG_CACHE_HOME, or
+    ~/.cache). If the variable is set to the empty string, no index is
+    used by default.
+
+    Returns
+    ----------
+    index_dir : str or None
+        The directory holding the index, or None if no index is to be
+        used.
+    """
+
+    index_dir = os.environ.get(LENGTHS_INDEX_DIR_VAR)
+    if index_dir is not None:
+        return index_dir or None
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'enspara')
+
+
+def sound_trajectories(filenames, stride=1, processes=None, index_dir=None):
+    """Determine the lengths of many trajectories on disk, using a
+    persistent index of trajectory lengths.
+
+    An index file (named by LENGTHS_INDEX_NAME) in `index_dir` maps each
+    trajectory's absolute path, size and modification time to its
+    number of frames. Only trajectories not in the index, or that have
+    changed since they were indexed, are sounded (in parallel) with
+    sound_trajectory, after which the index is updated under a lock on
+    the index, so that many processes (e.g. MPI ranks) can share one
+    index. An index that can't be written is only warned about.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the trajectories to sound.
+    stride : int, default=1
+        Give lengths as though trajectories were loaded with this
+        stride.
+    processes : int, optional
+        The number of processes to sound trajectories with.
+    index_dir : str or False, optional
+        Directory holding the index of trajectory lengths. It is
+        created if necessary. If None, default_lengths_index_dir() is
+        used; if False, every trajectory is sounded and no index is
+        read or written.
+
+    Returns
+    ----------
+    lengths : list
+        The length (in frames) of each trajectory.
+
+    See Also
+    ----------
+    sound_trajectory, default_lengths_index_dir
+    """
+
+    if index_dir is None:
+        index_dir = default_lengths_index_dir()
+    elif index_dir is False:
+        index_dir = None
+
+    filenames = list(filenames)
+    paths = [os.path.abspath(f) for f in filenames]
+    n_frames = [None] * len(filenames)
+
+    if index_dir is not None:
+        stats = [os.stat(f) for f in filenames]
+        index = _read_lengths_index(index_dir)
+        for i, path in enumerate(paths):
+            entry = index.get(path)
+            if entry is not None and entry[:2] == [stats[i].st_size,
+                                                   stats[i].st_mtime_ns]:
+                n_frames[i] = entry[2]
+
+    stale = [i for i, n in enumerate(n_frames) if n is None]
+    logger.debug("Found %s of %s trajectory lengths in length index; "
+                 "sounding %s with %s processes.",
+                 len(filenames) - len(stale), len(filenames), len(stale),
+                 processes)
+
+    if stale:
+        if len(stale) == 1:
+            sounded = [sound_trajectory(filenames[stale[0]])]
+        else:
+            with mp.Pool(processes=processes) as pool:
+                sounded = pool.map(sound_trajectory,
+                                   [filenames[i] for i in stale])
+
+        for i, n in zip(stale, sounded):
+            n_frames[i] = n
+
+        if index_dir is not None:
+            _update_lengths_index(
+                index_dir,
+                {paths[i]: [stats[i].st_size, stats[i].st_mtime_ns, n]
+                 for i, n in zip(stale, sounded)})
+
+    return [math.ceil(n / stride) for n in n_frames]
+
+
+def _read_lengths_index(index_dir):
+    try:
+        with open(os.path.join(index_dir, LENGTHS_INDEX_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_lengths_index(index_dir, entries):
+    # hold an exclusive lock while re-reading, updating and replacing the
+    # index so that concurrent updates (e.g. from other MPI ranks) don't
+    # drop each other's entries. The index itself is replaced atomically
+    # so that readers, which don't lock, never see a partial index.
+    path = os.path.join(index_dir, LENGTHS_INDEX_NAME)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = _read_lengths_index(index_dir)
+            index.update(entries)
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Couldn't write length index %s: %s", path, e)
+
+
 def load_as_concatenated(filenames, lengths=None, processes=None,
-                         args=None, **kwargs):
+                         args=None, index_dir=None, **kwargs):
     '''Load many trajectories from disk into a single numpy array.
 
     Additional arguments to md.load are supplied as ``*args`` XOR
@@ -75,6 +218,9 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
     args : list, optional
         A list of dictionaries, each of which corresponds to additional
         kwargs to be passed to each of filenames.
+    index_dir : str or False, optional
+        Directory of the trajectory length index used to infer
+        `lengths` (see sound_trajectories).
 
     Returns
     -------
@@ -113,11 +259,12 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
     if lengths is None:
         logger.debug("Sounding %s trajectories with %s processes.",
                      len(filenames), processes)
-        with mp.Pool(processes=processes) as pool:
-            lengths = pool.starmap(
-                sound_trajectory,
-                [(f, kw.get('stride', 1)) for f, kw
-                 in zip(filenames, args) if 'frame' not in kw])
+        sounded = [(f, kw.get('stride', 1)) for f, kw
+                   in zip(filenames, args) if 'frame' not in kw]
+        lengths = [math.ceil(n / stride) for n, (f, stride) in zip(
+            sound_trajectories([f for f, stride in sounded],
+                               processes=processes, index_dir=index_dir),
+            sounded)]
 
         # trjs with frame are always length 1, add that to lengths now
         for i, kw in enumerate(args):
@@ -161,6 +308,194 @@ def load_as_concatenated(filenames, lengths=None, processes=None,
     return lengths, xyz
 
 
+COORDINATE_STORE_CHUNK_BYTES = 2**30
+
+
+def load_cached_as_concatenated(filenames, cache_dir, args, lengths=None,
+                                processes=None, index_dir=None):
+    """Load many trajectories as one memory-mapped array of atom-sliced,
+    centered coordinates from a coordinate store in `cache_dir`,
+    creating the store if it doesn't exist.
+
+    A store is a directory holding the float32 coordinates of all of
+    `filenames`, each frame centered on the origin, as a single .npy
+    file of shape (n_frames, n_atoms, 3), along with their lengths. It
+    is keyed on each trajectory's path, modification time and size and
+    on the topology, atom indices and stride it is loaded with, so that
+    a change to any of them gives a new store. A missing store is
+    filled with load_as_concatenated a chunk of trajectories (about
+    COORDINATE_STORE_CHUNK_BYTES) at a time, so that it needn't fit in
+    memory, and only then moved into place, so that no run ever reads
+    a partial store.
+
+    Parameters
+    ----------
+    filenames : list
+        A list of relative paths to the trajectory files to be loaded.
+    cache_dir : str
+        Directory holding coordinate stores. It is created if necessary.
+    args : list
+        A list of dictionaries of kwargs to md.load for each of
+        filenames. Only 'top', 'stride' and 'atom_indices' are
+        supported.
+    lengths : list, optional
+        The length of each trajectory once loaded, if known, to save
+        sounding trajectories when filling a store.
+    processes : int, optional
+        The number of processes to spawn for loading trajectories into
+        a new store in parallel.
+    index_dir : str or False, optional
+        Directory of the trajectory length index used when filling a
+        store (see sound_trajectories).
+
+    Returns
+    -------
+    (lengths, xyz) : tuple
+       A 2-tuple of trajectory lengths (list of ints, frames) and
+       coordinates (read-only memory map, shape=(n_frames, n_atoms, 3)).
+
+    See Also
+    --------
+    load_as_concatenated
+    """
+
+    filenames = list(filenames)
+    if len(args) != len(filenames):
+        raise exception.ImproperlyConfigured(
+            "len(args) must equal len(filenames), but %s != %s." %
+            (len(args), len(filenames)))
+    for kw in args:
+        unsupported = set(kw) - {'top', 'stride', 'atom_indices'}
+        if unsupported:
+            raise exception.ImproperlyConfigured(
+                "Cached loading doesn't support md.load arguments %s." %
+                sorted(unsupported))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    store = os.path.join(cache_dir, _coordinate_store_key(filenames, args))
+
+    if os.path.isdir(store):
+        logger.debug("Found %s trajectories in coordinate store %s.",
+                     len(filenames), store)
+    else:
+        logger.info("Filling coordinate store %s with %s trajectories.",
+                    store, len(filenames))
+        _fill_coordinate_store(store, filenames, args, lengths=lengths,
+                               processes=processes, index_dir=index_dir)
+
+    lengths = [int(n) for n in np.load(os.path.join(store, 'lengths.npy'))]
+    xyz = np.load(os.path.join(store, 'xyz.npy'), mmap_mode='r')
+
+    return lengths, xyz
+
+
+def _fill_coordinate_store(store, filenames, args, lengths, processes,
+                           index_dir):
+    """Load and center `filenames` into a new coordinate store at
+    `store` (see load_cached_as_concatenated).
+    """
+
+    if lengths is None:
+        strides = [kw.get('stride') or 1 for kw in args]
+        lengths = [math.ceil(n / s) for n, s in zip(
+            sound_trajectories(filenames, processes=processes,
+                               index_dir=index_dir), strides)]
+
+    n_atoms = md.load(filenames[0], frame=0, top=args[0].get('top'),
+                      atom_indices=args[0].get('atom_indices')).n_atoms
+    frame_bytes = n_atoms * 3 * np.dtype(np.float32).itemsize
+    starts = np.concatenate([[0], np.cumsum(lengths, dtype=int)])
+
+    tmp_store = tempfile.mkdtemp(
+        dir=os.path.dirname(store),
+        prefix=os.path.basename(store) + '.tmp-')
+    try:
+        xyz = np.lib.format.open_memmap(
+            os.path.join(tmp_store, 'xyz.npy'), mode='w+',
+            dtype=np.float32, shape=(int(starts[-1]), n_atoms, 3))
+
+        i = 0
+        while i < len(filenames):
+            j = i + 1
+            while j < len(filenames) and (starts[j+1] - starts[i]) * \
+                    frame_bytes <= COORDINATE_STORE_CHUNK_BYTES:
+                j += 1
+
+            _, chunk = load_as_concatenated(
+                filenames[i:j], lengths=lengths[i:j], args=args[i:j],
+                processes=processes)
+            chunk -= chunk.mean(axis=1, keepdims=True)
+            xyz[starts[i]:starts[j]] = chunk
+            del chunk
+            i = j
+
+        xyz.flush()
+        del xyz
+        np.save(os.path.join(tmp_store, 'lengths.npy'),
+                np.array(lengths, dtype=int))
+
+        try:
+            os.rename(tmp_store, store)
+        except OSError:
+            # another process filled the same store first
+            if not os.path.isdir(store):
+                raise
+            shutil.rmtree(tmp_store)
+    except BaseException:
+        shutil.rmtree(tmp_store, ignore_errors=True)
+        raise
+
+
+def _coordinate_store_key(filenames, args):
+    """Name of the coordinate store for `filenames` loaded with `args`.
+    """
+
+    h = hashlib.sha1()
+    top_digests = {}
+
+    for filename, kwargs in zip(filenames, args):
+        stat = os.stat(filename)
+        h.update(str((os.path.abspath(filename), stat.st_mtime_ns,
+                      stat.st_size, kwargs.get('stride') or 1)).encode())
+
+        top = kwargs.get('top')
+        if id(top) not in top_digests:
+            top_digests[id(top)] = _topology_digest(top)
+        h.update(top_digests[id(top)])
+
+        if kwargs.get('atom_indices') is not None:
+            h.update(np.asarray(kwargs['atom_indices'],
+                                dtype=np.int64).tobytes())
+        else:
+            h.update(b'all atoms')
+
+    return h.hexdigest()
+
+
+def _topology_digest(top):
+    """Digest of a topology given as md.load's `top` argument can be: an
+    md.Topology or md.Trajectory (by their atoms), or a path (by its
+    path, modification time and size).
+    """
+
+    if isinstance(top, md.Trajectory):
+        top = top.topology
+
+    h = hashlib.sha1()
+    if isinstance(top, md.Topology):
+        for a in top.atoms:
+            h.update(('%s %s %s %s %s\n' % (
+                a.name, a.element.symbol if a.element else '',
+                a.residue.name, a.residue.resSeq,
+                a.residue.chain.index)).encode())
+    elif top is not None:
+        stat = os.stat(top)
+        h.update(str((os.path.abspath(top), stat.st_mtime_ns,
+                      stat.st_size)).encode())
+
+    return h.digest()
+
+
 def concatenate_trjs(trj_list, atoms=None, n_procs=None):
     """Convert a list of trajectories into a single trajectory building
     a concatenated array in parallel.